@@ -0,0 +1,110 @@
+"""Compare the columnar builder with the original row transpose.
+
+Before `_ColumnarBuilder`, `chop.output` collected each batch as a
+list of tuples and converted it with `zip(*batch)` and one `pa.array`
+per column. This times both on the same rows, appends included, so
+any per-row cost of the builder shows up:
+
+```console
+$ python benchmarks/builder.py
+$ python benchmarks/builder.py --rows 100000 --columns 8 32 --shapes tuple dict
+```
+
+Rows alternate integer and string columns. `transpose` only accepts
+tuples, as the original code did; the builder is timed for every row
+shape in `--shapes`, and its rows/s are also given as a ratio to
+`transpose`.
+"""
+
+import argparse
+import time
+from dataclasses import make_dataclass
+from typing import Any, Callable, Dict, List
+
+import pyarrow as pa  # type: ignore
+from bytewax.clickhouse._arrow import _ColumnarBuilder
+
+
+def make_schema(columns: int) -> pa.Schema:
+    return pa.schema(
+        [(f"c{i}", pa.int64() if i % 2 == 0 else pa.string()) for i in range(columns)]
+    )
+
+
+def make_rows(rows: int, pa_schema: pa.Schema, shape: str) -> List[Any]:
+    names = pa_schema.names
+    tuples = [
+        tuple(j if i % 2 == 0 else f"value-{j}" for i in range(len(names)))
+        for j in range(rows)
+    ]
+    if shape == "tuple":
+        return tuples
+    if shape == "dict":
+        return [dict(zip(names, row)) for row in tuples]
+    cls = make_dataclass("Row", names)
+    return [cls(*row) for row in tuples]
+
+
+def transpose(rows: List[Any], pa_schema: pa.Schema, batch: int) -> None:
+    buffer: List[Any] = []
+    for row in rows:
+        buffer.append(row)
+        if len(buffer) >= batch:
+            columns = list(zip(*buffer))
+            arrays = [pa.array(columns[i], f.type) for i, f in enumerate(pa_schema)]
+            pa.Table.from_arrays(arrays, schema=pa_schema)
+            buffer = []
+
+
+def build(rows: List[Any], pa_schema: pa.Schema, batch: int) -> None:
+    builder = _ColumnarBuilder(pa_schema)
+    for row in rows:
+        builder.append(row)
+        if len(builder) >= batch:
+            builder.finish()
+
+
+def measure(fn: Callable[[], None], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--batch", type=int, default=10_000)
+    parser.add_argument("--columns", type=int, nargs="+", default=[8, 32])
+    parser.add_argument(
+        "--shapes",
+        nargs="+",
+        choices=["tuple", "dict", "dataclass"],
+        default=["tuple", "dict", "dataclass"],
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for columns in args.columns:
+        pa_schema = make_schema(columns)
+        tuples = make_rows(args.rows, pa_schema, "tuple")
+        base = args.rows / measure(
+            lambda: transpose(tuples, pa_schema, args.batch), args.repeat
+        )
+        print(f"cols={columns:<3} transpose  tuple     {base:>12,.0f} rows/s")
+        results: Dict[str, float] = {}
+        for shape in args.shapes:
+            rows = make_rows(args.rows, pa_schema, shape)
+            results[shape] = args.rows / measure(
+                lambda: build(rows, pa_schema, args.batch), args.repeat
+            )
+            print(
+                f"cols={columns:<3} builder    {shape:<9} "
+                f"{results[shape]:>12,.0f} rows/s {results[shape] / base:>6.2f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,439 @@
+"""Benchmark the sink hot path against a local ClickHouse stand-in.
+
+Runs records through `chop.output`, i.e. `_to_sink` into the sink's
+`write_batch`, into a mock HTTP endpoint that accepts Arrow inserts
+the way ClickHouse does. The mock runs in its own process so decoding
+inserts does not compete with the dataflow for the GIL. No ClickHouse
+server is needed:
+
+```console
+$ BYTEWAX_LICENSE=1 python benchmarks/hot_path.py
+$ BYTEWAX_LICENSE=1 python benchmarks/hot_path.py \
+    --batch-sizes 1000 10000 --columns 8 32 --workers 1 4 \
+    --types string datetime64 nullable lowcardinality array
+```
+
+`--paths` picks how the output is set up: `default` keeps the
+upstream keys, of which there are many, so each worker inserts the
+batches it built; `shards` sets `shards` to the worker count.
+
+Every case reports rows/s through the whole dataflow, plus Arrow MB/s
+and wire MB/s as received by the mock, and rows/s of the Python to
+Arrow conversion on its own so a slowdown can be pinned on it.
+
+`--allocations` re-runs each case under `tracemalloc` and reports the
+peak of Python allocations and of the Arrow memory pool.
+`--profile DIR` re-runs each case on one worker under `cProfile`,
+with inserts made inline so the whole path is on the profiled
+thread, writes `DIR/<case>.pstats` and prints the top functions.
+
+`--json FILE` saves the results; `--baseline FILE` compares against
+saved results and exits non-zero if any case got slower by more than
+`--tolerance`, so regressions fail CI.
+"""
+
+import argparse
+import cProfile
+import functools
+import io
+import itertools
+import json
+import multiprocessing
+import pstats
+import sys
+import time
+import tracemalloc
+import urllib.parse
+import urllib.request
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+import bytewax.operators as op
+import lz4.frame  # type: ignore
+import pyarrow as pa  # type: ignore
+import zstandard  # type: ignore
+from bytewax.clickhouse import operators as chop
+from bytewax.clickhouse._arrow import _ColumnarBuilder, _DictionaryCache
+from bytewax.dataflow import Dataflow
+from bytewax.testing import TestingSource, cluster_main, run_main
+from clickhouse_connect import common
+
+# The mock does not report server settings, so let the client send
+# the sink's insert settings without checking them.
+common.set_setting("invalid_setting_action", "send")
+
+STATS_PATH = "/bench/stats"
+COLUMNS_PATH = "/bench/columns"
+# Upstream keys, spread over the workers that batch them.
+KEYS = 64
+
+# name: (Arrow type, ClickHouse type, value for row `i`)
+TYPES: Dict[str, Tuple[Any, str, Callable[[int], Any]]] = {
+    "int": (pa.int64(), "Int64", lambda i: i),
+    "float": (pa.float64(), "Float64", lambda i: i * 0.5),
+    "string": (pa.string(), "String", lambda i: f"value-{i}"),
+    "datetime64": (
+        pa.timestamp("us", tz="UTC"),
+        "DateTime64(6, 'UTC')",
+        lambda i: datetime(2024, 1, 1, tzinfo=timezone.utc) + timedelta(seconds=i),
+    ),
+    "nullable": (
+        pa.float64(),
+        "Nullable(Float64)",
+        lambda i: None if i % 10 == 0 else float(i),
+    ),
+    "lowcardinality": (
+        pa.dictionary(pa.int32(), pa.string()),
+        "LowCardinality(String)",
+        lambda i: f"tag-{i % 20}",
+    ),
+    "array": (pa.list_(pa.int64()), "Array(Int64)", lambda i: [i, i + 1, i + 2]),
+}
+
+
+class _MockHandler(BaseHTTPRequestHandler):
+    """Answer the queries the sink makes and swallow Arrow inserts."""
+
+    protocol_version = "HTTP/1.1"
+    stats: Dict[str, int] = {}
+    columns: List[Tuple[str, str]] = []
+
+    def log_message(self, *args: Any) -> None:
+        pass
+
+    def _read_body(self) -> bytes:
+        if self.headers.get("Transfer-Encoding") == "chunked":
+            chunks: List[bytes] = []
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                if size == 0:
+                    self.rfile.readline()
+                    return b"".join(chunks)
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def _reply(self, out: bytes) -> None:
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(out)))
+        self.send_header("X-ClickHouse-Summary", '{"written_rows":"0"}')
+        self.end_headers()
+        self.wfile.write(out)
+
+    def _insert(self, query: str, body: bytes) -> None:
+        encoding = self.headers.get("Content-Encoding")
+        wire = len(body)
+        if encoding == "lz4":
+            body = lz4.frame.decompress(body)
+        elif encoding == "zstd":
+            body = zstandard.ZstdDecompressor().decompressobj().decompress(body)
+        if query.endswith("FORMAT ArrowStream"):
+            table = pa.ipc.open_stream(pa.py_buffer(body)).read_all()
+        else:
+            table = pa.ipc.open_file(pa.py_buffer(body)).read_all()
+        self.stats["inserts"] += 1
+        self.stats["rows"] += table.num_rows
+        self.stats["arrow_bytes"] += table.nbytes
+        self.stats["wire_bytes"] += wire
+
+    def do_POST(self) -> None:
+        url = urllib.parse.urlparse(self.path)
+        if url.path == STATS_PATH:
+            self._read_body()
+            out = json.dumps(self.stats).encode()
+            for key in self.stats:
+                self.stats[key] = 0
+            self._reply(out)
+            return
+        if url.path == COLUMNS_PATH:
+            _MockHandler.columns = json.loads(self._read_body())
+            self._reply(b"")
+            return
+        body = self._read_body()
+        params = urllib.parse.parse_qs(url.query)
+        query = params.get("query", [""])[0]
+        if not query and body.startswith(b"INSERT"):
+            head, _, body = body.partition(b"\n")
+            query = head.decode(errors="replace")
+        elif not query:
+            query = body.decode(errors="replace")
+        out = b""
+        if query.startswith("INSERT"):
+            self._insert(query, body)
+        elif "version()" in query:
+            out = b"24.8.1.1\tUTC\n"
+        elif query.startswith("EXISTS"):
+            out = b"1\n"
+        elif "engine, partition_key FROM system.tables" in query:
+            out = _native_strings(
+                ["engine", "partition_key"], [("ReplacingMergeTree", "")]
+            )
+        elif "max(parts)" in query:
+            out = b"0\n"
+        elif "default_kind FROM system.columns" in query:
+            out = _native_strings(
+                ["name", "type", "default_kind"],
+                [(name, ch_type, "") for name, ch_type in self.columns],
+            )
+        self._reply(out)
+
+    do_GET = do_POST
+
+
+def _leb128(n: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte, n = n & 0x7F, n >> 7
+        out.append(byte | (0x80 if n else 0))
+        if not n:
+            return bytes(out)
+
+
+def _native_strings(names: List[str], rows: List[Tuple[str, ...]]) -> bytes:
+    """Encode rows of `String` columns as a ClickHouse Native block."""
+
+    def string(value: str) -> bytes:
+        data = value.encode()
+        return _leb128(len(data)) + data
+
+    out = _leb128(len(names)) + _leb128(len(rows))
+    for i, name in enumerate(names):
+        out += string(name) + string("String")
+        out += b"".join(string(row[i]) for row in rows)
+    return out
+
+
+def _serve(port: "Any") -> None:
+    _MockHandler.stats = {"inserts": 0, "rows": 0, "arrow_bytes": 0, "wire_bytes": 0}
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _MockHandler)
+    port.value = server.server_address[1]
+    server.serve_forever()
+
+
+def start_mock() -> Tuple[multiprocessing.Process, int]:
+    """Start the mock ClickHouse in a subprocess; return it and its port."""
+    port = multiprocessing.Value("i", 0)
+    proc = multiprocessing.Process(target=_serve, args=(port,), daemon=True)
+    proc.start()
+    while port.value == 0:
+        time.sleep(0.01)
+    return proc, port.value
+
+
+def set_columns(port: int, ch_schema: str) -> None:
+    """Set the columns the mock reports for the benchmark table."""
+    columns = [line.split(" ", 1) for line in ch_schema.split(",\n")]
+    url = f"http://127.0.0.1:{port}{COLUMNS_PATH}"
+    request = urllib.request.Request(url, data=json.dumps(columns).encode())
+    urllib.request.urlopen(request).close()
+
+
+def take_stats(port: int) -> Dict[str, int]:
+    """Fetch and reset what the mock has received."""
+    url = f"http://127.0.0.1:{port}{STATS_PATH}"
+    with urllib.request.urlopen(urllib.request.Request(url, data=b"")) as resp:
+        return json.loads(resp.read())
+
+
+def make_schema(columns: int, types: List[str]) -> Tuple[pa.Schema, str]:
+    names = [types[c % len(types)] for c in range(columns)]
+    pa_schema = pa.schema([(f"c{c}", TYPES[t][0]) for c, t in enumerate(names)])
+    ch_schema = ",\n".join(f"c{c} {TYPES[t][1]}" for c, t in enumerate(names))
+    return pa_schema, ch_schema
+
+
+def make_rows(rows: int, columns: int, types: List[str]) -> List[Dict[str, Any]]:
+    makers = [TYPES[types[c % len(types)]][2] for c in range(columns)]
+    return [{f"c{c}": make(i) for c, make in enumerate(makers)} for i in range(rows)]
+
+
+def run_convert(rows: List[Dict[str, Any]], pa_schema: pa.Schema, batch: int) -> None:
+    builder = _ColumnarBuilder(pa_schema, dictionaries=_DictionaryCache())
+    for row in rows:
+        builder.append(row)
+        if len(builder) >= batch:
+            builder.finish()
+    builder.finish()
+
+
+def run_dataflow(
+    rows: List[Dict[str, Any]],
+    pa_schema: pa.Schema,
+    ch_schema: str,
+    port: int,
+    batch: int,
+    path: str,
+    workers: int,
+    max_in_flight: int,
+) -> None:
+    flow = Dataflow("bench_hot_path")
+    stream = op.input("input", flow, TestingSource(rows, batch_size=1000))
+    counter = itertools.count()
+    keyed = op.key_on("key", stream, lambda _row: str(next(counter) % KEYS))
+    chop.output(
+        "output",
+        keyed,
+        pa_schema,
+        "bench_hot_path",
+        ch_schema,
+        "default",
+        "",
+        host="127.0.0.1",
+        port=port,
+        order_by="c0",
+        timeout=timedelta(seconds=10),
+        max_size=batch,
+        shards=workers if path == "shards" else None,
+        max_in_flight=max_in_flight,
+    )
+    if workers == 1:
+        # Runs on this thread, so it shows up in profiles.
+        run_main(flow)
+    else:
+        cluster_main(flow, [], 0, worker_count_per_proc=workers)
+
+
+def measure(fn: Callable[[], None]) -> float:
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def measure_allocations(fn: Callable[[], None]) -> Dict[str, float]:
+    pool = pa.default_memory_pool()
+    arrow_start = pool.bytes_allocated()
+    tracemalloc.start()
+    fn()
+    _current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "python_peak_mb": peak / 1e6,
+        "arrow_pool_peak_mb": max(0, pool.max_memory() - arrow_start) / 1e6,
+    }
+
+
+def profile(fn: Callable[[], None], path: Path, top: int) -> str:
+    profiler = cProfile.Profile()
+    profiler.runcall(fn)
+    profiler.dump_stats(str(path))
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(top)
+    return out.getvalue()
+
+
+def compare(
+    results: Dict[str, Dict[str, float]], baseline_path: Path, tolerance: float
+) -> List[str]:
+    baseline = json.loads(baseline_path.read_text())
+    regressions = []
+    for case, result in results.items():
+        if case not in baseline:
+            continue
+        for metric in ("rows_per_s", "convert_rows_per_s"):
+            old, new = baseline[case][metric], result[metric]
+            if new < old * (1 - tolerance):
+                regressions.append(
+                    f"{case} {metric}: {new:,.0f} vs {old:,.0f} ({new / old - 1:+.0%})"
+                )
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[10_000])
+    parser.add_argument("--columns", type=int, nargs="+", default=[8])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1])
+    parser.add_argument(
+        "--paths", nargs="+", choices=["default", "shards"], default=["default"]
+    )
+    parser.add_argument(
+        "--types", nargs="+", choices=sorted(TYPES), default=["int", "string"]
+    )
+    parser.add_argument("--max-in-flight", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--allocations", action="store_true")
+    parser.add_argument("--profile", type=Path, metavar="DIR")
+    parser.add_argument("--profile-top", type=int, default=15)
+    parser.add_argument("--json", type=Path, metavar="FILE")
+    parser.add_argument("--baseline", type=Path, metavar="FILE")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    mock, port = start_mock()
+    if args.profile is not None:
+        args.profile.mkdir(parents=True, exist_ok=True)
+
+    results: Dict[str, Dict[str, float]] = {}
+    for columns in args.columns:
+        pa_schema, ch_schema = make_schema(columns, args.types)
+        set_columns(port, ch_schema)
+        rows = make_rows(args.rows, columns, args.types)
+        for batch in args.batch_sizes:
+            convert = functools.partial(run_convert, rows, pa_schema, batch)
+            convert_best = min(measure(convert) for _ in range(args.repeat))
+            for setup, workers in itertools.product(args.paths, args.workers):
+                case = f"cols={columns}-batch={batch}-workers={workers}-{setup}"
+                flow = functools.partial(
+                    run_dataflow, rows, pa_schema, ch_schema, port, batch, setup
+                )
+
+                take_stats(port)
+                best = min(
+                    measure(functools.partial(flow, workers, args.max_in_flight))
+                    for _ in range(args.repeat)
+                )
+                stats = take_stats(port)
+                runs = args.repeat
+                if stats["rows"] != args.rows * runs:
+                    msg = f"{case}: mock received {stats['rows']} rows"
+                    raise RuntimeError(msg)
+                result = {
+                    "rows_per_s": args.rows / best,
+                    "arrow_mb_per_s": stats["arrow_bytes"] / runs / best / 1e6,
+                    "wire_mb_per_s": stats["wire_bytes"] / runs / best / 1e6,
+                    "inserts": stats["inserts"] / runs,
+                    "convert_rows_per_s": args.rows / convert_best,
+                }
+                line = (
+                    f"{case:<32} {result['rows_per_s']:>12,.0f} rows/s "
+                    f"{result['arrow_mb_per_s']:>8.1f} MB/s arrow "
+                    f"{result['wire_mb_per_s']:>8.1f} MB/s wire "
+                    f"{result['convert_rows_per_s']:>12,.0f} rows/s convert"
+                )
+
+                if args.allocations:
+                    result.update(
+                        measure_allocations(
+                            functools.partial(flow, workers, args.max_in_flight)
+                        )
+                    )
+                    line += (
+                        f" {result['python_peak_mb']:>8.1f} MB py peak"
+                        f" {result['arrow_pool_peak_mb']:>8.1f} MB arrow peak"
+                    )
+                results[case] = result
+                print(line)
+
+                if args.profile is not None and workers == 1:
+                    path = args.profile / f"{case}.pstats"
+                    inline = functools.partial(flow, 1, 0)
+                    print(profile(inline, path, args.profile_top))
+                take_stats(port)
+
+    mock.terminate()
+
+    if args.json is not None:
+        args.json.write_text(json.dumps(results, indent=2, sort_keys=True) + "\n")
+    if args.baseline is not None:
+        regressions = compare(results, args.baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""Benchmark the cost of importing the sink and defining a dataflow.
+
+Each stage runs in a fresh interpreter, so nothing is imported yet:
+
+- `package`: `import bytewax.clickhouse`.
+- `operators`: `import bytewax.clickhouse.operators`.
+- `define`: define a dataflow with `chop.output`, as worker processes
+  and tooling that only build the flow graph do. No server is needed,
+  since the table is only checked once the dataflow runs.
+
+```console
+$ python benchmarks/import_time.py
+$ python benchmarks/import_time.py --repeat 10 --json import.json
+$ python benchmarks/import_time.py --baseline import.json
+```
+
+Every stage reports its best time of `--repeat` runs and which of the
+heavy modules it loaded. It fails if a stage loads a module that is
+meant to be deferred, such as the ClickHouse client before a dataflow
+runs, or if importing prints the license notice.
+
+`--json FILE` saves the results; `--baseline FILE` compares against
+saved results and exits non-zero if any stage got slower by more than
+`--tolerance`, so regressions fail CI.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, List
+
+DEFINE = """
+import pyarrow as pa
+import bytewax.operators as op
+from bytewax.clickhouse import operators as chop
+from bytewax.dataflow import Dataflow
+from bytewax.testing import TestingSource
+
+flow = Dataflow("import_time")
+up = op.key_on("key", op.input("inp", flow, TestingSource([])), lambda _: "k")
+pa_schema = pa.schema([("metric", pa.string()), ("value", pa.float64())])
+chop.output("out", up, pa_schema, "events", None, "user", "password")
+"""
+
+STAGES = {
+    "package": "import bytewax.clickhouse",
+    "operators": "import bytewax.clickhouse.operators",
+    "define": DEFINE,
+}
+
+HEAVY = (
+    "clickhouse_connect",
+    "lz4",
+    "prometheus_client",
+    "pyarrow",
+    "pyarrow.compute",
+    "zstandard",
+)
+
+# Modules each stage must not load.
+DEFERRED = {
+    "package": HEAVY,
+    "operators": tuple(m for m in HEAVY if m != "pyarrow"),
+    "define": tuple(m for m in HEAVY if m != "pyarrow"),
+}
+
+# Stages that must not print the license notice, which is printed
+# once a sink is defined.
+QUIET = ("package", "operators")
+
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+exec(compile({code!r}, "<stage>", "exec"))
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "modules": sorted(sys.modules)}}))
+"""
+
+
+def run_stage(code: str) -> Dict:
+    env = {k: v for k, v in os.environ.items() if k != "BYTEWAX_LICENSE"}
+    out = subprocess.run(
+        [sys.executable, "-c", CHILD.format(code=code)],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    result = json.loads(out.stdout.splitlines()[-1])
+    result["stderr"] = out.stderr
+    return result
+
+
+def compare(
+    results: Dict[str, Dict[str, float]], baseline_path: Path, tolerance: float
+) -> List[str]:
+    baseline = json.loads(baseline_path.read_text())
+    regressions = []
+    for stage, result in results.items():
+        base = baseline.get(stage)
+        if base is None:
+            continue
+        if result["ms"] > base["ms"] * (1 + tolerance):
+            regressions.append(
+                f"{stage}: {result['ms']:.1f} ms vs {base['ms']:.1f} ms baseline"
+            )
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--stages", nargs="+", choices=list(STAGES), default=list(STAGES)
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", type=Path, metavar="FILE")
+    parser.add_argument("--baseline", type=Path, metavar="FILE")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    results: Dict[str, Dict[str, float]] = {}
+    failures = []
+    for stage in args.stages:
+        runs = [run_stage(STAGES[stage]) for _ in range(args.repeat)]
+        best = min(run["seconds"] for run in runs)
+        modules = set(runs[0]["modules"])
+        loaded = [m for m in HEAVY if m in modules]
+        results[stage] = {"ms": best * 1000}
+        print(f"{stage:<10} {best * 1000:>8.1f} ms  loads: {', '.join(loaded) or '-'}")
+
+        early = [m for m in DEFERRED[stage] if m in modules]
+        if early:
+            failures.append(f"{stage}: loads {', '.join(early)}")
+        if stage in QUIET and runs[0]["stderr"]:
+            failures.append(f"{stage}: prints {runs[0]['stderr'].strip()!r}")
+
+    if args.json is not None:
+        args.json.write_text(json.dumps(results, indent=2, sort_keys=True))
+    if args.baseline is not None:
+        failures.extend(
+            f"REGRESSION {regression}"
+            for regression in compare(results, args.baseline, args.tolerance)
+        )
+    for failure in failures:
+        print(failure, file=sys.stderr)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Compare insert throughput of the HTTP and native transports.
+
+Inserts the same wide table through both transports into a running
+ClickHouse server, e.g. the one from `docker compose up -d`, and
+prints rows/s and MB/s of Arrow data for each:
+
+```console
+$ pip install -e '.[native]'
+$ BYTEWAX_LICENSE=1 python benchmarks/transports.py --rows 200000 --columns 40
+```
+"""
+
+import argparse
+import time
+from datetime import datetime, timedelta, timezone
+
+import pyarrow as pa
+from bytewax.clickhouse import ClickHouseSink
+from bytewax.clickhouse._sink import _ClickHousePartition
+
+
+def make_table(rows: int, columns: int) -> pa.Table:
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    data = {
+        "ts": pa.array(
+            [start + timedelta(milliseconds=i) for i in range(rows)],
+            pa.timestamp("us"),
+        ),
+        "tag": pa.array([f"tag-{i % 50}" for i in range(rows)], pa.string()),
+    }
+    for c in range(columns - 2):
+        data[f"v{c}"] = pa.array([float(i * c) for i in range(rows)], pa.float64())
+    return pa.table(data)
+
+
+def ch_schema(table: pa.Table) -> str:
+    types = {pa.timestamp("us"): "DateTime64(6)", pa.string(): "String"}
+    return ",\n".join(f"{f.name} {types.get(f.type, 'Float64')}" for f in table.schema)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--http-port", type=int, default=8123)
+    parser.add_argument("--native-port", type=int, default=9000)
+    parser.add_argument("--username", default="admin")
+    parser.add_argument("--password", default="password")
+    parser.add_argument("--database", default="bytewax")
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--columns", type=int, default=40)
+    parser.add_argument("--batch", type=int, default=50_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    table = make_table(args.rows, args.columns)
+    batches = [
+        table.slice(offset, args.batch) for offset in range(0, args.rows, args.batch)
+    ]
+    mb = table.nbytes / 1e6
+
+    for transport, port in (("http", args.http_port), ("native", args.native_port)):
+        table_name = f"bench_transport_{transport}"
+        ClickHouseSink(
+            table_name,
+            ch_schema(table),
+            args.username,
+            args.password,
+            args.host,
+            args.http_port,
+            args.database,
+            order_by="ts",
+        )
+        part = _ClickHousePartition(
+            table_name,
+            args.host,
+            port,
+            args.username,
+            args.password,
+            args.database,
+            max_in_flight=0,
+            transport=transport,
+        )
+        best = float("inf")
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            for batch in batches:
+                part.write_batch([batch])
+            best = min(best, time.perf_counter() - start)
+        part.close()
+        print(
+            f"{transport:>6}: {args.rows / best:>12,.0f} rows/s "
+            f"{mb / best:>8.1f} MB/s ({args.rows} rows x {args.columns} columns)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -12,7 +12,7 @@ import logging
 logger = logging.getLogger("bytewax.clickhouse").setLevel(logging.INFO)
 
 CH_SCHEMA = """
-        metric String,
+        metric LowCardinality(String),
         value Float64,
         ts DateTime,
         """
@@ -21,7 +21,7 @@ ORDER_BY = "metric, ts"
 
 PA_SCHEMA = pa.schema(
     [
-        ("metric", pa.string()),
+        ("metric", pa.dictionary(pa.int32(), pa.string())),
         ("value", pa.float64()),
         ("ts", pa.timestamp("us")),  # microsecond
     ]
@@ -53,4 +53,6 @@ chop.output(
     order_by=ORDER_BY,
     timeout=timedelta(seconds=1),
     max_size=10,
+    shards=4,
+    shard_by=["metric"],
 )
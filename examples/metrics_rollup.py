@@ -0,0 +1,92 @@
+from datetime import timedelta, datetime
+
+from bytewax import operators as op
+from bytewax.connectors.demo import RandomMetricSource
+from bytewax.dataflow import Dataflow
+import pyarrow as pa
+
+from bytewax.clickhouse import Aggregation, TableSpec
+from bytewax.clickhouse import operators as chop
+
+import logging
+
+logger = logging.getLogger("bytewax.clickhouse").setLevel(logging.INFO)
+
+CH_SCHEMA = """
+        metric LowCardinality(String),
+        ts DateTime,
+        value SimpleAggregateFunction(sum, Float64),
+        samples SimpleAggregateFunction(sum, UInt64),
+        min_value SimpleAggregateFunction(min, Float64),
+        max_value SimpleAggregateFunction(max, Float64),
+        """
+
+PA_SCHEMA = pa.schema(
+    [
+        ("metric", pa.dictionary(pa.int32(), pa.string())),
+        ("value", pa.float64()),
+        ("ts", pa.timestamp("us")),  # microsecond
+    ]
+)
+
+# One row per metric and minute: the keys, the bucketed time column,
+# then the aggregations in order.
+ROLLUP_SCHEMA = pa.schema(
+    [
+        ("metric", pa.dictionary(pa.int32(), pa.string())),
+        ("ts", pa.timestamp("us")),
+        ("value", pa.float64()),
+        ("samples", pa.uint64()),
+        ("min_value", pa.float64()),
+        ("max_value", pa.float64()),
+    ]
+)
+
+
+flow = Dataflow("test_ch_rollup")
+
+# Build a sample stream of metrics
+metrica = op.input("inp_a", flow, RandomMetricSource("a_metric"))
+metricb = op.input("inp_b", flow, RandomMetricSource("b_metric"))
+metricc = op.input("inp_c", flow, RandomMetricSource("c_metric"))
+metrics = op.merge("merge", metrica, metricb, metricc)
+metrics = op.map("add_time", metrics, lambda x: x + tuple([datetime.now()]))
+metrics = op.map("add_key", metrics, lambda x: ("All", x))
+
+rollup = chop.aggregate(
+    "rollup",
+    metrics,
+    PA_SCHEMA,
+    keys=["metric"],
+    time_column="ts",
+    bucket=timedelta(minutes=1),
+    aggregations={
+        "value": Aggregation("sum", "value"),
+        "samples": Aggregation("count"),
+        "min_value": Aggregation("min", "value"),
+        "max_value": Aggregation("max", "value"),
+    },
+    timeout=timedelta(seconds=10),
+)
+op.inspect("inspect_rollup", rollup)
+
+
+# As the table merges parts, rows of the same metric and minute are
+# combined with the function of each column, so partial rows of
+# separate batches add up.
+chop.output(
+    "output_clickhouse",
+    rollup,
+    ROLLUP_SCHEMA,
+    "metrics_1m",
+    CH_SCHEMA,
+    "admin",
+    "password",
+    database="bytewax",
+    port=8123,
+    table_spec=TableSpec(
+        engine="AggregatingMergeTree",
+        order_by="metric, ts",
+    ),
+    timeout=timedelta(seconds=1),
+)
@@ -0,0 +1,117 @@
+"""Fixtures standing in for a ClickHouse server."""
+
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+import clickhouse_connect  # type: ignore
+import pyarrow as pa  # type: ignore
+import pytest
+from bytewax.clickhouse import _pool
+
+# Keep the license notice out of test output.
+os.environ.setdefault("BYTEWAX_LICENSE", "1")
+
+
+class FakeSummary:
+    """The summary of an insert, as `clickhouse_connect` returns it."""
+
+    def __init__(self, written_rows: int):
+        self.written_rows = written_rows
+
+    def query_id(self) -> str:
+        return ""
+
+
+class FakeServer:
+    """What a fake ClickHouse has been asked, and what it answers.
+
+    `columns` are reported for every table, as `system.columns` would,
+    and `clusters` lists the rows of `system.clusters` for each cluster.
+    Inserts carrying an `insert_deduplication_token` seen before are
+    dropped, as ClickHouse does for Replicated tables.
+    """
+
+    def __init__(self) -> None:
+        self.columns: List[Tuple[str, str, str]] = [
+            ("id", "Int64", ""),
+            ("name", "String", ""),
+        ]
+        self.engine = "ReplacingMergeTree"
+        self.partition_key = ""
+        self.exists = True
+        self.clusters: Dict[str, List[Tuple[int, int, str, int]]] = {}
+        self.queries: List[str] = []
+        self.inserts: List[Tuple[str, pa.Table, Dict[str, Any]]] = []
+        self.tokens: Dict[str, pa.Table] = {}
+
+    def rows(self, column: str = "id") -> List[Any]:
+        """Values of `column` of every insert the server kept."""
+        return [v for _, table, _ in self.inserts for v in table[column].to_pylist()]
+
+
+class FakeClient:
+    """A `clickhouse_connect` client answering from a `FakeServer`."""
+
+    def __init__(self, server: FakeServer, **kwargs: Any):
+        self.server = server
+        self.kwargs = kwargs
+
+    def command(self, query: str, **kwargs: Any) -> Any:
+        self.server.queries.append(query)
+        if query.startswith("EXISTS"):
+            return int(self.server.exists)
+        if "max(parts)" in query:
+            return 0
+        return None
+
+    def query(self, query: str, **kwargs: Any) -> Any:
+        self.server.queries.append(query)
+        if "system.tables" in query:
+            rows: List[Tuple[Any, ...]] = [
+                (self.server.engine, self.server.partition_key)
+            ]
+        elif "system.clusters" in query:
+            cluster = query.split("cluster = '", 1)[1].split("'", 1)[0]
+            rows = list(self.server.clusters.get(cluster, []))
+        else:
+            rows = list(self.server.columns)
+        return type("Result", (), {"result_rows": rows})()
+
+    def raw_insert(
+        self,
+        table: str,
+        column_names: Any,
+        body: Any,
+        settings: Optional[Dict[str, Any]] = None,
+        fmt: Optional[str] = None,
+        compression: Optional[str] = None,
+    ) -> FakeSummary:
+        data = body if isinstance(body, bytes) else b"".join(body)
+        arrow_table = pa.ipc.open_stream(pa.py_buffer(data)).read_all()
+        return self.insert_arrow(table, arrow_table, settings)
+
+    def insert_arrow(
+        self, table: str, arrow_table: pa.Table, settings: Optional[Dict] = None
+    ) -> FakeSummary:
+        settings = dict(settings or {})
+        token = settings.get("insert_deduplication_token")
+        if token is not None:
+            if token in self.server.tokens:
+                return FakeSummary(0)
+            self.server.tokens[token] = arrow_table
+        self.server.inserts.append((table, arrow_table, settings))
+        return FakeSummary(arrow_table.num_rows)
+
+    def close(self) -> None:
+        pass
+
+
+@pytest.fixture
+def fake_clickhouse(monkeypatch: pytest.MonkeyPatch) -> FakeServer:
+    """Send every ClickHouse client of the sink to a `FakeServer`."""
+    server = FakeServer()
+    monkeypatch.setattr(
+        clickhouse_connect, "get_client", lambda **kw: FakeClient(server, **kw)
+    )
+    monkeypatch.setattr(_pool, "_SHARED", {})
+    return server
@@ -0,0 +1,186 @@
+from datetime import datetime, timedelta, timezone
+
+import bytewax.operators as op
+import pyarrow as pa  # type: ignore
+import pytest
+from bytewax.clickhouse import Aggregation
+from bytewax.clickhouse import operators as chop
+from bytewax.clickhouse._aggregate import _PreAggregator
+from bytewax.dataflow import Dataflow
+from bytewax.recovery import RecoveryConfig, init_db_dir
+from bytewax.testing import TestingSink, TestingSource, run_main
+
+SCHEMA = pa.schema(
+    [
+        ("metric", pa.string()),
+        ("value", pa.float64()),
+        ("ts", pa.timestamp("s", tz="UTC")),
+    ]
+)
+T0 = datetime(2024, 1, 1, tzinfo=timezone.utc)
+AGGREGATIONS = {
+    "total": Aggregation("sum", "value"),
+    "samples": Aggregation("count"),
+    "low": Aggregation("min", "value"),
+    "last": Aggregation("max", "ts"),
+}
+
+
+def _rows(seconds, metric="a", values=None):
+    values = values if values is not None else [1.0] * len(seconds)
+    return [
+        {"metric": metric, "value": v, "ts": T0 + timedelta(seconds=s)}
+        for s, v in zip(seconds, values)
+    ]
+
+
+def _aggregator(**kwargs) -> _PreAggregator:
+    kwargs.setdefault("aggregations", AGGREGATIONS)
+    return _PreAggregator(SCHEMA, ["metric"], "ts", timedelta(minutes=1), **kwargs)
+
+
+def _sorted(table: pa.Table):
+    return sorted(table.to_pylist(), key=lambda row: (row["metric"], row["ts"]))
+
+
+def test_rows_reduce_per_key_and_bucket():
+    aggregator = _aggregator()
+    rows = _rows([0, 30, 59, 60], values=[1.0, 2.0, None, 4.0])
+    rows += _rows([10], metric="b", values=[5.0])
+
+    table = aggregator(pa.Table.from_pylist(rows, schema=SCHEMA))
+
+    assert table.schema.equals(aggregator.pa_schema)
+    assert table.schema.names == ["metric", "ts", "total", "samples", "low", "last"]
+    minute = timedelta(minutes=1)
+    assert _sorted(table) == [
+        {
+            "metric": "a",
+            "ts": T0,
+            "total": 3.0,
+            "samples": 3,
+            "low": 1.0,
+            "last": T0 + timedelta(seconds=59),
+        },
+        {
+            "metric": "a",
+            "ts": T0 + minute,
+            "total": 4.0,
+            "samples": 1,
+            "low": 4.0,
+            "last": T0 + minute,
+        },
+        {
+            "metric": "b",
+            "ts": T0,
+            "total": 5.0,
+            "samples": 1,
+            "low": 5.0,
+            "last": T0 + timedelta(seconds=10),
+        },
+    ]
+
+
+def test_result_types():
+    schema = pa.schema(
+        [("k", pa.string()), ("ts", pa.date32()), ("u", pa.uint8()), ("i", pa.int8())]
+    )
+    aggregator = _PreAggregator(
+        schema,
+        ["k"],
+        "ts",
+        timedelta(days=7),
+        {
+            "u_sum": Aggregation("sum", "u"),
+            "i_sum": Aggregation("sum", "i"),
+            "i_max": Aggregation("max", "i"),
+            "n": Aggregation("count", "i"),
+        },
+    )
+
+    assert aggregator.pa_schema == pa.schema(
+        [
+            ("k", pa.string()),
+            ("ts", pa.date32()),
+            ("u_sum", pa.uint64()),
+            ("i_sum", pa.int64()),
+            ("i_max", pa.int8()),
+            ("n", pa.uint64()),
+        ]
+    )
+    assert aggregator(schema.empty_table()).num_rows == 0
+
+
+def test_all_null_sums_are_zero():
+    table = pa.Table.from_pylist(_rows([0], values=[None]), schema=SCHEMA)
+    [row] = _aggregator()(table).to_pylist()
+
+    assert row["total"] == 0.0
+    assert row["samples"] == 1
+    assert row["low"] is None
+
+
+@pytest.mark.parametrize(
+    ("kwargs", "match"),
+    [
+        ({"aggregations": {"x": Aggregation("sum", "nope")}}, "not in `pa_schema`"),
+        ({"aggregations": {"metric": Aggregation("count")}}, "named like key"),
+        ({"aggregations": {"x": Aggregation("sum", "metric")}}, "cannot sum"),
+        ({"aggregations": {"x": Aggregation("min", "metric")}}, "cannot take the min"),
+    ],
+)
+def test_invalid_aggregations(kwargs, match):
+    with pytest.raises(ValueError, match=match):
+        _aggregator(**kwargs)
+
+
+def test_invalid_buckets():
+    with pytest.raises(ValueError, match="milliseconds"):
+        _PreAggregator(SCHEMA, [], "ts", timedelta(microseconds=1), {})
+    with pytest.raises(ValueError, match="not a time column"):
+        _PreAggregator(SCHEMA, [], "value", timedelta(minutes=1), {})
+    with pytest.raises(ValueError, match="requires a `column`"):
+        Aggregation("sum")
+
+
+def _flow(inp, out) -> Dataflow:
+    flow = Dataflow("rollup")
+    rows = op.input("inp", flow, TestingSource(inp))
+    keyed = op.key_on("key", rows, lambda row: row["metric"])
+    rollup = chop.aggregate(
+        "rollup",
+        keyed,
+        SCHEMA,
+        keys=["metric"],
+        time_column="ts",
+        bucket=timedelta(minutes=1),
+        aggregations=AGGREGATIONS,
+        timeout=timedelta(hours=1),
+    )
+    op.output("out", rollup, TestingSink(out))
+    return flow
+
+
+def test_buffered_rows_survive_resume(tmp_path):
+    init_db_dir(tmp_path, 1)
+    recovery = RecoveryConfig(str(tmp_path))
+    before = _rows(range(0, 90, 10))
+    after = _rows(range(90, 150, 10))
+    inp = [*before, TestingSource.ABORT(), *after]
+    out = []
+
+    # Nothing is flushed before the abort, so the rows before it only
+    # reach the output if they were kept in the snapshot.
+    run_main(_flow(inp, out), epoch_interval=timedelta(0), recovery_config=recovery)
+    assert out == []
+    run_main(_flow(inp, out), epoch_interval=timedelta(0), recovery_config=recovery)
+
+    rows = sorted(
+        (row for _, table in out for row in table.to_pylist()),
+        key=lambda row: row["ts"],
+    )
+    assert [(row["ts"], row["samples"]) for row in rows] == [
+        (T0, 6),
+        (T0 + timedelta(minutes=1), 6),
+        (T0 + timedelta(minutes=2), 3),
+    ]
@@ -0,0 +1,232 @@
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+import numpy as np
+import pyarrow as pa  # type: ignore
+import pytest
+from bytewax.clickhouse._arrow import (
+    _as_table,
+    _ColumnarBuilder,
+    _DictionaryCache,
+    _InsertStream,
+)
+
+SCHEMA = pa.schema(
+    [
+        ("id", pa.int64()),
+        ("name", pa.string()),
+        ("ts", pa.timestamp("us")),
+    ]
+)
+TS = datetime(2024, 1, 2, 3, 4, 5)  # noqa: DTZ001
+EXPECTED = {"id": [1], "name": ["a"], "ts": [TS]}
+
+
+@dataclass
+class _Row:
+    ts: datetime
+    name: str
+    id: int
+
+
+@pytest.mark.parametrize(
+    "row",
+    [
+        (1, "a", TS),
+        [1, "a", TS],
+        {"name": "a", "id": 1, "ts": TS},
+        _Row(TS, "a", 1),
+        np.array(
+            [("a", TS, 1)],
+            dtype=[("name", "U1"), ("ts", "datetime64[us]"), ("id", "i8")],
+        )[0],
+    ],
+    ids=["tuple", "list", "mapping", "dataclass", "record"],
+)
+def test_builder_row_shapes(row):
+    builder = _ColumnarBuilder(SCHEMA)
+    builder.append(row)
+
+    table = builder.finish()
+    assert table.schema.equals(SCHEMA)
+    assert table.to_pydict() == EXPECTED
+
+
+def test_builder_plain_numpy_rows_are_positional():
+    schema = pa.schema([("x", pa.float64()), ("y", pa.float64())])
+    builder = _ColumnarBuilder(schema)
+    builder.extend(list(np.array([[1.0, 2.0], [3.0, 4.0]])))
+
+    assert builder.finish().to_pydict() == {"x": [1.0, 3.0], "y": [2.0, 4.0]}
+
+
+def test_builder_missing_keys_are_null():
+    builder = _ColumnarBuilder(SCHEMA)
+    builder.append({"id": 1})
+
+    assert builder.finish().to_pydict() == {"id": [1], "name": [None], "ts": [None]}
+
+
+def test_builder_resets_after_finish():
+    builder = _ColumnarBuilder(SCHEMA)
+    builder.extend([(i, str(i), TS) for i in range(3)])
+    assert len(builder) == 3
+
+    assert builder.finish().num_rows == 3
+    assert len(builder) == 0
+    builder.append((9, "9", TS))
+    assert builder.finish()["id"].to_pylist() == [9]
+
+
+@pytest.mark.parametrize(
+    ("rows", "error", "match"),
+    [
+        ([(1, "a", TS), (1, "a")], ValueError, "row has 2 values"),
+        ([(1, "a", TS), "1,a"], TypeError, "rows must be"),
+        ([np.array([(1,)], dtype=[("id", "i8")])[0]], ValueError, "do not cover"),
+    ],
+    ids=["width", "type", "record"],
+)
+def test_builder_rejects_bad_rows(rows, error, match):
+    builder = _ColumnarBuilder(SCHEMA)
+    builder.extend(rows)
+    with pytest.raises(error, match=match):
+        builder.finish()
+
+
+def test_builder_converts_mixed_row_shapes():
+    builder = _ColumnarBuilder(SCHEMA)
+    builder.extend([(1, "a", TS), {"id": 2, "name": "b"}, _Row(TS, "c", 3)])
+
+    assert builder.finish().to_pydict() == {
+        "id": [1, 2, 3],
+        "name": ["a", "b", "c"],
+        "ts": [TS, None, TS],
+    }
+
+
+def test_builder_single_field_dataclass():
+    schema = pa.schema([("tag", pa.string())])
+    builder = _ColumnarBuilder(schema)
+    builder.extend([_Tag("a"), _Tag(None)])
+
+    assert builder.finish().to_pydict() == {"tag": ["a", None]}
+
+
+@dataclass
+class _Tag:
+    tag: Optional[str]
+
+
+def test_builder_keeps_dictionary_codes_across_batches():
+    schema = pa.schema([("tag", pa.dictionary(pa.int32(), pa.string()))])
+    builder = _ColumnarBuilder(schema, dictionaries=_DictionaryCache())
+    builder.extend([_Tag("b"), _Tag("a")])
+    first = builder.finish()["tag"].chunk(0)
+    builder.extend([_Tag("c"), _Tag("a"), _Tag(None)])
+    second = builder.finish()["tag"].chunk(0)
+
+    assert first.indices.to_pylist() == [0, 1]
+    assert second.indices.to_pylist() == [2, 1, None]
+    assert second.dictionary.to_pylist() == ["b", "a", "c"]
+    assert second.to_pylist() == ["c", "a", None]
+
+
+def test_dictionary_starts_over_past_max_size():
+    cache = _DictionaryCache(max_size=3)
+    dict_type = pa.dictionary(pa.int32(), pa.string())
+    cache.recode("tag", pa.array(["a", "b"], dict_type))
+    recoded = cache.recode("tag", pa.array(["c", "d"], dict_type))
+
+    assert recoded.dictionary.to_pylist() == ["c", "d"]
+    assert recoded.to_pylist() == ["c", "d"]
+
+
+def test_dictionary_cache_tells_columns_apart_by_type():
+    cache = _DictionaryCache()
+    strings = pa.dictionary(pa.int32(), pa.string())
+    ints = pa.dictionary(pa.int32(), pa.int64())
+    cache.recode("tag", pa.array(["a", "b"], strings))
+    cache.recode("tag", pa.array([7], ints))
+    recoded = cache.recode("tag", pa.array(["b"], strings))
+
+    # A same-named column of another table does not reset the first.
+    assert recoded.indices.to_pylist() == [1]
+    assert recoded.dictionary.to_pylist() == ["a", "b"]
+
+
+def test_as_table_wraps_record_batches():
+    batch = pa.record_batch([[1], ["a"], [TS]], schema=SCHEMA)
+    table = _as_table(batch, SCHEMA)
+
+    assert isinstance(table, pa.Table)
+    assert table.to_pydict() == EXPECTED
+
+
+def test_as_table_reorders_columns_by_name():
+    table = _as_table(pa.table({"ts": [TS], "id": [1], "name": ["a"]}), SCHEMA)
+
+    assert table.schema.equals(SCHEMA)
+    assert table.to_pydict() == EXPECTED
+
+
+@pytest.mark.parametrize(
+    "table",
+    [
+        pa.table({"id": [1], "name": ["a"]}),
+        pa.table({"id": pa.array([1], pa.int32()), "name": ["a"], "ts": [TS]}),
+    ],
+    ids=["missing column", "other type"],
+)
+def test_as_table_rejects_other_schemas(table):
+    with pytest.raises(ValueError, match="does not match `pa_schema`"):
+        _as_table(table, SCHEMA)
+
+
+def _decompress(body: bytes, compression: Optional[str]) -> bytes:
+    if compression == "lz4":
+        import lz4.frame  # type: ignore # noqa: PLC0415
+
+        return lz4.frame.decompress(body)
+    if compression == "zstd":
+        import zstandard  # type: ignore # noqa: PLC0415
+
+        return zstandard.ZstdDecompressor().decompressobj().decompress(body)
+    return body
+
+
+@pytest.mark.parametrize("compression", [None, "lz4", "zstd"])
+@pytest.mark.parametrize("arrow_compression", [None, "lz4", "zstd"])
+def test_insert_stream_round_trips(arrow_compression, compression, monkeypatch):
+    # Small chunks, so the table is sent as several record batches.
+    monkeypatch.setattr(_InsertStream, "CHUNK_BYTES", 256)
+    table = pa.table({"id": list(range(100)), "name": [f"n{i}" for i in range(100)]})
+    stream = _InsertStream(table, arrow_compression, compression, level=1)
+    chunks = list(stream)
+    body = b"".join(chunks)
+
+    assert all(chunks)
+    assert stream.bytes_sent == len(body)
+    reader = pa.ipc.open_stream(_decompress(body, compression))
+    batches = list(reader)
+    assert len(batches) > 1
+    assert pa.Table.from_batches(batches).equals(table)
+
+
+def test_insert_stream_starts_over_when_iterated_again():
+    table = pa.table({"id": [1, 2, 3]})
+    stream = _InsertStream(table, compression="zstd")
+    first = b"".join(stream)
+    second = b"".join(stream)
+
+    assert first == second
+    assert stream.bytes_sent == len(second)
+    reader = pa.ipc.open_stream(_decompress(second, "zstd"))
+    assert reader.read_all().equals(table)
+
+
+def test_insert_stream_of_an_empty_table():
+    table = pa.table({"id": pa.array([], pa.int64())})
+    reader = pa.ipc.open_stream(b"".join(_InsertStream(table)))
+    assert reader.read_all().equals(table)
@@ -0,0 +1,167 @@
+from datetime import datetime, timedelta, timezone
+
+import pyarrow as pa  # type: ignore
+import pytest
+from bytewax.clickhouse import OutputTable, _writer
+from bytewax.clickhouse._arrow import _ColumnarBuilder, _DictionaryCache
+from bytewax.clickhouse._writer import _BatchTuner
+from bytewax.clickhouse.operators import (
+    _ColumnarCollectLogic,
+    _ColumnarCollectState,
+    _TablesCollectLogic,
+    _TablesCollectState,
+)
+
+SCHEMA = pa.schema([("id", pa.int64())])
+TIMEOUT = timedelta(seconds=1)
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = START
+
+    def __call__(self) -> datetime:
+        return self.now
+
+
+def _columnar(clock: Clock, max_rows: int = 1000) -> _ColumnarCollectLogic:
+    state = _ColumnarCollectState([])
+    return _ColumnarCollectLogic(
+        "out",
+        clock,
+        TIMEOUT,
+        _BatchTuner(max_rows, None, TIMEOUT),
+        _ColumnarBuilder(SCHEMA, state.rows),
+        state,
+    )
+
+
+def _tables(clock: Clock) -> _TablesCollectLogic:
+    return _TablesCollectLogic(
+        "out",
+        clock,
+        TIMEOUT,
+        _BatchTuner(1000, None, TIMEOUT),
+        {"a": OutputTable(SCHEMA, "id Int64"), "b": OutputTable(SCHEMA, "id Int64")},
+        _DictionaryCache(),
+        _TablesCollectState({}),
+    )
+
+
+def test_trickle_flushes_within_timeout():
+    clock = Clock()
+    logic = _columnar(clock)
+    for i in range(5):
+        clock.now = START + i * TIMEOUT / 4
+        logic.on_item({"id": i})
+
+    # Rows kept arriving, but the batch is due a timeout after the
+    # first one.
+    assert logic.notify_at() == START + TIMEOUT
+    (table,), _keep = logic.on_notify()
+    assert table.column("id").to_pylist() == list(range(5))
+
+
+def test_tables_trickle_flushes_within_timeout():
+    clock = Clock()
+    logic = _tables(clock)
+    for i in range(5):
+        clock.now = START + i * TIMEOUT / 4
+        logic.on_item(("a" if i % 2 else "b", {"id": i}))
+
+    assert logic.notify_at() == START + TIMEOUT
+    out, _keep = logic.on_notify()
+    assert sorted(name for name, _table in out) == ["a", "b"]
+
+
+def test_timeout_restarts_with_the_next_batch():
+    clock = Clock()
+    logic = _columnar(clock, max_rows=2)
+    logic.on_item({"id": 0})
+    clock.now = START + TIMEOUT / 2
+    (table,), keep = logic.on_item({"id": 1})
+
+    assert table.num_rows == 2
+    assert keep is _ColumnarCollectLogic.DISCARD
+    # The next logic for the key starts a batch of its own.
+    logic = _columnar(clock)
+    logic.on_item({"id": 2})
+    assert logic.notify_at() == clock.now + TIMEOUT
+
+
+def test_passed_through_tables_start_no_timeout():
+    logic = _columnar(Clock())
+    (table,), keep = logic.on_item(pa.table({"id": [1, 2]}))
+
+    assert table.num_rows == 2
+    assert keep is _ColumnarCollectLogic.DISCARD
+    assert logic.notify_at() is None
+
+
+def test_tuner_targets_max_rows():
+    tuner = _BatchTuner(1000, None, TIMEOUT)
+    assert tuner.target_rows == 1000
+
+
+def test_tuner_caps_rows_by_bytes():
+    tuner = _BatchTuner(1000, 800, TIMEOUT)
+    # The row size is unknown until a batch has been built.
+    assert tuner.target_rows == 1000
+    tuner.record_table(pa.table({"id": list(range(10))}))
+    assert tuner.target_rows == 100
+
+
+def test_tuner_shrinks_while_inserts_are_slow():
+    tuner = _BatchTuner(1600, None, TIMEOUT)
+    tuner.record_insert(2.0)
+    assert tuner.target_rows == 800
+    for _ in range(10):
+        tuner.record_insert(2.0)
+    assert tuner.target_rows == 1600 * _BatchTuner.MIN_FACTOR
+
+
+def test_tuner_grows_back_once_inserts_are_quick():
+    tuner = _BatchTuner(1600, None, TIMEOUT)
+    for _ in range(3):
+        tuner.record_insert(2.0)
+    target = tuner.target_rows
+    # Latencies between a quarter of the ceiling and the ceiling
+    # leave the target alone.
+    tuner.latency = 0.5
+    tuner.record_insert(0.5)
+    assert tuner.target_rows == target
+    for _ in range(20):
+        tuner.record_insert(0.01)
+    assert tuner.target_rows == 1600
+
+
+def test_tuner_grows_back_on_a_merge_backlog():
+    tuner = _BatchTuner(1600, None, TIMEOUT)
+    tuner.record_insert(2.0)
+    tuner.record_parts(_BatchTuner.BACKLOG_PARTS)
+    assert tuner.merge_backlog
+    tuner.record_insert(2.0)
+    assert tuner.target_rows == 1600
+
+    tuner.record_parts(_BatchTuner.BACKLOG_PARTS - 1)
+    assert not tuner.merge_backlog
+
+
+def test_tuner_polls_once_per_interval(monkeypatch):
+    now = 1000.0
+    monkeypatch.setattr(_writer.time, "monotonic", lambda: now)
+    tuner = _BatchTuner(1000, None, TIMEOUT)
+
+    assert tuner.poll_due()
+    assert not tuner.poll_due()
+    now += _BatchTuner.POLL_INTERVAL
+    assert tuner.poll_due()
+
+
+@pytest.mark.parametrize("max_rows", [0, 1])
+def test_tuner_targets_at_least_one_row(max_rows):
+    tuner = _BatchTuner(max_rows, None, TIMEOUT)
+    for _ in range(10):
+        tuner.record_insert(2.0)
+    assert tuner.target_rows == 1
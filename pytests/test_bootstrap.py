@@ -0,0 +1,128 @@
+import json
+from datetime import timedelta
+
+import pytest
+from bytewax.clickhouse import ClickHouseSink, ClusterShard, _bootstrap, _sink
+from bytewax.clickhouse._bootstrap import _MetadataCache, _TableMetadata
+
+KEY = ("localhost", 8123, "default", "events", None)
+METADATA = _TableMetadata(
+    "ReplacingMergeTree",
+    [("id", "Int64", ""), ("name", "String", "")],
+    [ClusterShard("a", 8123, 2)],
+    "toYYYYMM(ts)",
+)
+
+
+def _sink_of(schema="id Int64, name String", **kwargs):
+    return ClickHouseSink("events", schema, "user", "password", **kwargs)
+
+
+def test_defining_the_sink_makes_no_queries(fake_clickhouse):
+    _sink_of()
+    assert fake_clickhouse.queries == []
+
+
+def test_partition_0_creates_the_table(fake_clickhouse):
+    fake_clickhouse.exists = False
+    _sink_of().build_part("out", "0", None).close()
+
+    assert fake_clickhouse.queries[0] == "EXISTS default.events"
+    assert fake_clickhouse.queries[1].startswith("CREATE TABLE default.events (")
+
+
+def test_table_is_checked_once_per_process(fake_clickhouse):
+    sink = _sink_of()
+    sink.build_part("out", "0", None).close()
+    queries = len(fake_clickhouse.queries)
+    sink.build_part("out", "1", None).close()
+
+    assert len(fake_clickhouse.queries) == queries
+
+
+def test_other_partitions_wait_for_the_table(fake_clickhouse, monkeypatch):
+    fake_clickhouse.exists = False
+    waits = []
+
+    def sleep(seconds):
+        # Partition 0 creates the table while we wait.
+        waits.append(seconds)
+        fake_clickhouse.exists = True
+
+    monkeypatch.setattr(_sink.time, "sleep", sleep)
+    _sink_of().build_part("out", "1", None).close()
+
+    assert len(waits) == 1
+    assert not any(q.startswith("CREATE") for q in fake_clickhouse.queries)
+
+
+def test_waiting_for_the_table_times_out(fake_clickhouse, monkeypatch):
+    fake_clickhouse.exists = False
+    monkeypatch.setattr(_sink.time, "sleep", lambda seconds: None)
+    sink = _sink_of(bootstrap_timeout=timedelta(0))
+
+    with pytest.raises(TimeoutError, match="created by the worker of partition 0"):
+        sink.build_part("out", "1", None)
+
+
+def test_creating_the_table_needs_a_schema(fake_clickhouse):
+    fake_clickhouse.exists = False
+    with pytest.raises(ValueError, match="Bad Schema"):
+        _sink_of(schema=None).build_part("out", "0", None)
+
+
+def test_cached_metadata_skips_the_queries(fake_clickhouse, tmp_path):
+    _sink_of(metadata_cache_dir=tmp_path).build_part("out", "0", None).close()
+    queries = len(fake_clickhouse.queries)
+    # As after a restart of the process.
+    _sink_of(metadata_cache_dir=tmp_path).build_part("out", "0", None).close()
+
+    assert queries > 0
+    assert len(fake_clickhouse.queries) == queries
+
+
+def test_cache_round_trips_metadata(tmp_path):
+    cache = _MetadataCache(tmp_path / "cache", ttl=60)
+    assert cache.load(KEY) is None
+    cache.store(KEY, METADATA)
+
+    assert cache.load(KEY) == METADATA
+    assert cache.load((*KEY[:-1], "cluster")) is None
+
+
+def test_cache_entries_expire(tmp_path, monkeypatch):
+    now = 1000.0
+    monkeypatch.setattr(_bootstrap.time, "time", lambda: now)
+    cache = _MetadataCache(tmp_path, ttl=60)
+    cache.store(KEY, METADATA)
+
+    now += 59
+    assert cache.load(KEY) == METADATA
+    now += 1
+    assert cache.load(KEY) is None
+    # Entries from the future, after the clock moved back, are stale too.
+    now -= 120
+    assert cache.load(KEY) is None
+
+
+def test_unreadable_cache_entries_are_missing(tmp_path, caplog):
+    cache = _MetadataCache(tmp_path, ttl=60)
+    cache.store(KEY, METADATA)
+    (path,) = tmp_path.glob("*.json")
+    data = json.loads(path.read_text())
+    del data["metadata"]["engine"]
+    path.write_text(json.dumps(data))
+
+    assert cache.load(KEY) is None
+    path.write_text("{")
+    assert cache.load(KEY) is None
+    assert "Ignoring unreadable table metadata" in caplog.text
+
+
+def test_unwritable_cache_is_ignored(tmp_path, caplog):
+    (tmp_path / "file").write_text("")
+    cache = _MetadataCache(tmp_path / "file", ttl=60)
+    cache.store(KEY, METADATA)
+
+    assert cache.load(KEY) is None
+    assert "Could not cache table metadata" in caplog.text
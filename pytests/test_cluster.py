@@ -0,0 +1,116 @@
+from collections import Counter
+
+import pyarrow as pa  # type: ignore
+import pytest
+from bytewax.clickhouse import ClickHouseSink, ClusterShard
+from bytewax.clickhouse._cluster import _cluster_shards, _ShardRouter
+from conftest import FakeClient
+
+CLUSTER = [
+    (1, 1, "shard1-a", 9000),
+    (1, 1, "shard1-b", 9000),
+    (2, 2, "shard2-a", 9440),
+]
+
+
+def _table(ids, names=None):
+    names = names if names is not None else [f"n{i}" for i in ids]
+    return pa.table({"id": list(ids), "name": names})
+
+
+def test_cluster_shards_use_the_first_replica(fake_clickhouse):
+    fake_clickhouse.clusters["c"] = CLUSTER
+    client = FakeClient(fake_clickhouse)
+
+    assert _cluster_shards(client, "c", None) == [
+        ClusterShard("shard1-a", 9000, 1),
+        ClusterShard("shard2-a", 9440, 2),
+    ]
+    # The HTTP port replaces the native ports listed.
+    assert [s.port for s in _cluster_shards(client, "c", 8123)] == [8123, 8123]
+
+
+def test_cluster_shards_of_an_unknown_cluster(fake_clickhouse):
+    with pytest.raises(ValueError, match="'missing' is not in `system.clusters`"):
+        _cluster_shards(FakeClient(fake_clickhouse), "missing", None)
+
+
+def test_router_without_key_spreads_tables_by_weight():
+    router = _ShardRouter([ClusterShard("a"), ClusterShard("b", weight=2)], None)
+    table = _table([1])
+
+    assert [router.split(table)[0][0] for _ in range(6)] == [0, 1, 1, 0, 1, 1]
+    # A sequence number always picks the same shard.
+    assert router.split(table, seq=3) == [(0, table)]
+    assert router.split(table, seq=3) == [(0, table)]
+
+
+def test_router_splits_rows_by_key():
+    router = _ShardRouter([ClusterShard("a"), ClusterShard("b", weight=3)], ["name"])
+    table = _table(range(400), [f"user-{i % 40}" for i in range(400)])
+    pieces = router.split(table)
+
+    assert [shard for shard, _piece in pieces] == [0, 1]
+    assert sorted(i for _, piece in pieces for i in piece["id"].to_pylist()) == (
+        list(range(400))
+    )
+    # Rows with the same key stay together.
+    owners = {}
+    for shard, piece in pieces:
+        for name in piece["name"].to_pylist():
+            assert owners.setdefault(name, shard) == shard
+    # Shard 1 owns three of the four slots.
+    counts = Counter(owners.values())
+    assert counts[1] > counts[0]
+
+
+def test_router_hashes_dictionary_columns_by_value():
+    router = _ShardRouter([ClusterShard("a"), ClusterShard("b")], ["name"])
+    names = [f"user-{i}" for i in range(50)]
+    plain = _table(range(50), names)
+    encoded = plain.set_column(1, "name", pa.array(names).dictionary_encode())
+
+    assert [
+        (shard, piece["id"].to_pylist()) for shard, piece in router.split(plain)
+    ] == [(shard, piece["id"].to_pylist()) for shard, piece in router.split(encoded)]
+
+
+def test_router_needs_some_weight():
+    with pytest.raises(ValueError, match="total weight of at least 1"):
+        _ShardRouter([ClusterShard("a", weight=0)], None)
+
+
+def test_sink_inserts_into_each_shard(fake_clickhouse, monkeypatch):
+    fake_clickhouse.clusters["c"] = CLUSTER
+    fake_clickhouse.exists = False
+    hosts = []
+    original = FakeClient.insert_arrow
+
+    def insert_arrow(self, table, arrow_table, settings=None):
+        hosts.extend([self.kwargs["host"]] * arrow_table.num_rows)
+        return original(self, table, arrow_table, settings)
+
+    monkeypatch.setattr(FakeClient, "insert_arrow", insert_arrow)
+    sink = ClickHouseSink(
+        "events",
+        "id Int64, name String",
+        "user",
+        "password",
+        cluster="c",
+        sharding_key=["id"],
+        max_in_flight=0,
+    )
+    part = sink.build_part("out", "0", None)
+    part.write_batch([_table(range(100))])
+    part.close()
+
+    assert sorted(fake_clickhouse.rows()) == list(range(100))
+    assert set(hosts) == {"shard1-a", "shard2-a"}
+    # The table is created on every shard.
+    creates = [q for q in fake_clickhouse.queries if q.startswith("CREATE TABLE")]
+    assert len(creates) == 2
+
+
+def test_sharding_key_needs_a_cluster():
+    with pytest.raises(ValueError, match="requires `cluster`"):
+        ClickHouseSink("events", "id Int64", "user", "password", sharding_key=["id"])
@@ -0,0 +1,152 @@
+import pyarrow as pa  # type: ignore
+import pytest
+from bytewax.clickhouse import ColumnHint, SkipIndex, TableSpec
+from bytewax.clickhouse._ddl import _column_definitions
+
+
+def _define(arrow_field: pa.Field, hint=None, key_columns=frozenset()) -> str:
+    hints = {arrow_field.name: hint} if hint is not None else None
+    return _column_definitions(pa.schema([arrow_field]), hints, key_columns)
+
+
+@pytest.mark.parametrize(
+    ("arrow_field", "expected"),
+    [
+        (pa.field("c", pa.int64()), "c Nullable(Int64)"),
+        (pa.field("c", pa.int64(), nullable=False), "c Int64"),
+        (
+            pa.field("c", pa.dictionary(pa.int32(), pa.string())),
+            "c LowCardinality(Nullable(String))",
+        ),
+        (pa.field("c", pa.list_(pa.int32())), "c Array(Int32)"),
+        (
+            pa.field("c", pa.timestamp("ms", tz="UTC")),
+            "c Nullable(DateTime64(3, 'UTC')) CODEC(Delta, ZSTD)",
+        ),
+    ],
+)
+def test_nullable_fields_are_nullable_columns(arrow_field, expected):
+    assert _define(arrow_field) == expected
+
+
+def test_nullable_hint_overrides_the_field():
+    not_null = ColumnHint(nullable=False)
+    assert _define(pa.field("c", pa.string()), not_null) == "c String"
+    required = pa.field("c", pa.string(), nullable=False)
+    assert _define(required, ColumnHint(nullable=True)) == "c Nullable(String)"
+
+
+def test_key_columns_are_not_nullable():
+    spec = TableSpec(order_by="`event id`, toDate(ts)", version="v")
+    schema = pa.schema(
+        [("event id", pa.int64()), ("ts", pa.date32()), ("x", pa.int8())]
+    )
+    definitions = _column_definitions(schema, None, spec._key_columns())
+
+    assert definitions.split(",\n") == [
+        "`event id` Int64",
+        "ts Date32 CODEC(Delta, ZSTD)",
+        "x Nullable(Int8)",
+    ]
+
+
+def test_arrays_cannot_be_hinted_nullable():
+    with pytest.raises(ValueError, match="can't be `Nullable`"):
+        _define(pa.field("c", pa.list_(pa.int32())), ColumnHint(nullable=True))
+
+
+@pytest.mark.parametrize("data_type", [pa.int32(), pa.uint64(), pa.date32()])
+def test_monotonic_columns_use_delta(data_type):
+    arrow_field = pa.field("c", data_type, nullable=False)
+    assert _define(arrow_field, ColumnHint(monotonic=True)).endswith(
+        "CODEC(Delta, ZSTD)"
+    )
+
+
+@pytest.mark.parametrize("data_type", [pa.string(), pa.float64(), pa.bool_()])
+def test_monotonic_needs_integers_or_times(data_type):
+    with pytest.raises(ValueError, match="`monotonic` needs"):
+        _define(pa.field("c", data_type), ColumnHint(monotonic=True))
+
+
+def test_gauge_needs_floats():
+    assert _define(pa.field("c", pa.float32()), ColumnHint(gauge=True)) == (
+        "c Nullable(Float32) CODEC(Gorilla)"
+    )
+    with pytest.raises(ValueError, match="`gauge` needs"):
+        _define(pa.field("c", pa.int64()), ColumnHint(gauge=True))
+
+
+def test_default_spec_is_a_replacing_merge_tree():
+    query = TableSpec(order_by="id").create_query("db", "events", "id Int64, x String")
+    assert query == (
+        "CREATE TABLE db.events (\n"
+        "    id Int64,\n"
+        "    x String\n"
+        ") ENGINE = ReplacingMergeTree()\n"
+        "ORDER BY tuple(id)"
+    )
+
+
+def test_create_query_renders_every_clause():
+    spec = TableSpec(
+        order_by="host, ts",
+        version="v",
+        partition_by="toYYYYMM(ts)",
+        primary_key="host",
+        indexes=[
+            SkipIndex("ts_idx", "ts", "minmax", granularity=4),
+            SkipIndex("msg_idx", "lower(msg)", "bloom_filter(0.01)"),
+        ],
+        codecs={"ts": "Delta, ZSTD", "msg text": "ZSTD(3)"},
+        ttl="ts + INTERVAL 30 DAY",
+        settings={
+            "index_granularity": 4096,
+            "allow_nullable_key": True,
+            "storage_policy": "it's hot",
+        },
+    )
+    schema = "host String, ts DateTime, `msg text` String, v UInt64"
+
+    assert spec.create_query("db", "logs", schema).split("\n") == [
+        "CREATE TABLE db.logs (",
+        "    host String,",
+        "    ts DateTime CODEC(Delta, ZSTD),",
+        "    `msg text` String CODEC(ZSTD(3)),",
+        "    v UInt64,",
+        "    INDEX ts_idx ts TYPE minmax GRANULARITY 4,",
+        "    INDEX msg_idx lower(msg) TYPE bloom_filter(0.01) GRANULARITY 1",
+        ") ENGINE = ReplacingMergeTree(v)",
+        "PARTITION BY toYYYYMM(ts)",
+        "PRIMARY KEY host",
+        "ORDER BY tuple(host, ts)",
+        "TTL ts + INTERVAL 30 DAY",
+        "SETTINGS index_granularity = 4096, allow_nullable_key = 1, "
+        "storage_policy = 'it\\'s hot'",
+    ]
+
+
+def test_create_query_keeps_engine_arguments():
+    spec = TableSpec(engine="ReplicatedMergeTree('/t/{shard}', '{replica}')")
+    query = spec.create_query("db", "events", "id Int64")
+
+    assert ") ENGINE = ReplicatedMergeTree('/t/{shard}', '{replica}')" in query
+    assert spec.engine_name == "ReplicatedMergeTree"
+    assert "ORDER BY tuple()" in query
+
+
+def test_codecs_need_known_columns():
+    spec = TableSpec(codecs={"missing": "ZSTD"})
+    with pytest.raises(ValueError, match=r"not in the schema: \['missing'\]"):
+        spec.create_query("db", "events", "id Int64")
+
+
+def test_codecs_cannot_replace_a_schema_codec():
+    spec = TableSpec(codecs={"id": "ZSTD"})
+    with pytest.raises(ValueError, match="`id` already has a codec"):
+        spec.create_query("db", "events", "id Int64 CODEC(Delta)")
+
+
+def test_version_needs_a_replacing_engine():
+    with pytest.raises(ValueError, match="`version` requires"):
+        TableSpec(engine="MergeTree", version="v")
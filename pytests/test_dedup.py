@@ -0,0 +1,97 @@
+import pickle
+from typing import List, Sequence
+
+import pyarrow as pa  # type: ignore
+from bytewax.clickhouse import ClickHouseSink
+from bytewax.clickhouse._arrow import _content_digest
+from bytewax.clickhouse._sink import _ClickHousePartition, _PartitionState
+
+BLOCK = 300
+ROWS = 1000
+
+
+def _sink() -> ClickHouseSink:
+    return ClickHouseSink(
+        "events",
+        "id Int64, name String",
+        "user",
+        "password",
+        max_in_flight=0,
+        dedup_block_rows=BLOCK,
+    )
+
+
+def _batch(ids: Sequence[int]) -> pa.Table:
+    return pa.table({"id": list(ids), "name": [f"n{i}" for i in ids]})
+
+
+def _run(
+    part: _ClickHousePartition, ids: Sequence[int], epoch: int
+) -> List[_PartitionState]:
+    """Write rows `ids` in epochs of `epoch` rows."""
+    states = []
+    for lo in range(0, len(ids), epoch):
+        part.write_batch([_batch(ids[lo : lo + epoch])])
+        states.append(pickle.loads(pickle.dumps(part.snapshot())))
+    return states
+
+
+def test_blocks_are_full_within_an_epoch(fake_clickhouse):
+    part = _sink().build_part("out", "0", None)
+    part.write_batch([_batch(range(0, 200))])
+    part.write_batch([_batch(range(200, 450))])
+
+    assert [t.num_rows for _, t, _ in fake_clickhouse.inserts] == [BLOCK]
+    state = part.snapshot()
+    # The rest of the rows are inserted at the snapshot.
+    assert [t.num_rows for _, t, _ in fake_clickhouse.inserts] == [BLOCK, 150]
+    assert state.next_block == 2
+
+
+def test_replay_in_the_same_order_is_dropped(fake_clickhouse):
+    part = _sink().build_part("out", "0", None)
+    states = _run(part, range(600), 300)
+    # Crash after the first epoch, then replay the second one.
+    resumed = _sink().build_part("out", "0", states[0])
+    _run(resumed, range(300, 600), 300)
+    resumed.close()
+
+    assert sorted(fake_clickhouse.rows()) == list(range(600))
+    assert len(fake_clickhouse.tokens) == 2
+
+
+def test_replay_in_another_order_loses_no_rows(fake_clickhouse):
+    part = _sink().build_part("out", "0", None)
+    states = _run(part, range(600), 300)
+    # Crash after the first epoch. Two upstream workers interleave
+    # differently on replay, so block 1 now holds other rows.
+    replay = [*range(450, 750), *range(300, 450), *range(750, ROWS)]
+    resumed = _sink().build_part("out", "0", states[0])
+    _run(resumed, replay, 250)
+    resumed.close()
+
+    assert sorted(set(fake_clickhouse.rows())) == list(range(ROWS))
+
+
+def test_tokens_name_the_rows(fake_clickhouse):
+    part = _sink().build_part("out", "0", None)
+    _run(part, range(450), 450)
+
+    tokens = [s["insert_deduplication_token"] for _, _, s in fake_clickhouse.inserts]
+    assert tokens == [
+        f"out-0-0-{_content_digest(_batch(range(300)))}",
+        f"out-0-1-{_content_digest(_batch(range(300, 450)))}",
+    ]
+
+
+def test_digest_ignores_chunks_and_dictionary_codes():
+    table = _batch(range(10))
+    chunked = pa.concat_tables([table.slice(0, 3), table.slice(3)])
+    assert _content_digest(chunked) == _content_digest(table)
+
+    a = pa.DictionaryArray.from_arrays(pa.array([0, 1]), pa.array(["x", "y"]))
+    b = pa.DictionaryArray.from_arrays(pa.array([1, 0]), pa.array(["y", "x"]))
+    assert _content_digest(pa.table({"t": a})) == _content_digest(pa.table({"t": b}))
+    assert _content_digest(pa.table({"t": a})) != _content_digest(
+        pa.table({"t": b.indices})
+    )
@@ -0,0 +1,46 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+DEFINE = """
+import pyarrow as pa
+import bytewax.operators as op
+from bytewax.clickhouse import operators as chop
+from bytewax.dataflow import Dataflow
+from bytewax.testing import TestingSource
+
+flow = Dataflow("imports")
+up = op.key_on("key", op.input("inp", flow, TestingSource([])), lambda _: "k")
+pa_schema = pa.schema([("metric", pa.string()), ("value", pa.float64())])
+chop.output("out", up, pa_schema, "events", None, "user", "password")
+"""
+
+DEFERRED = ("clickhouse_connect", "lz4", "prometheus_client", "zstandard")
+
+
+def _modules(code: str) -> list:
+    """Modules loaded by running `code` in a fresh interpreter."""
+    child = f"{code}\nimport json, sys\nprint(json.dumps(sorted(sys.modules)))"
+    env = {**os.environ, "BYTEWAX_LICENSE": "1"}
+    out = subprocess.run(
+        [sys.executable, "-c", child], env=env, capture_output=True, check=True
+    )
+    return json.loads(out.stdout.decode().splitlines()[-1])
+
+
+def test_package_import_is_light():
+    modules = _modules("import bytewax.clickhouse")
+    assert "bytewax.clickhouse" in modules
+    for module in (*DEFERRED, "pyarrow", "pyarrow.compute"):
+        assert module not in modules
+
+
+@pytest.mark.parametrize("code", ["import bytewax.clickhouse.operators", DEFINE])
+def test_defining_a_dataflow_connects_nothing(code):
+    modules = _modules(code)
+    assert "bytewax.clickhouse.operators" in modules
+    for module in (*DEFERRED, "pyarrow.compute"):
+        assert module not in modules
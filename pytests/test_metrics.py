@@ -0,0 +1,99 @@
+from contextlib import contextmanager
+from typing import Any, Dict, List
+
+import pyarrow as pa  # type: ignore
+import pytest
+from bytewax.clickhouse import ClickHouseSink, _metrics
+from prometheus_client import REGISTRY
+
+
+class FakeSpan:
+    def __init__(self, name: str, attributes: Dict[str, Any]) -> None:
+        self.name = name
+        self.attributes = dict(attributes)
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+
+class FakeTracer:
+    def __init__(self) -> None:
+        self.spans: List[FakeSpan] = []
+
+    @contextmanager
+    def start_as_current_span(self, name, attributes):
+        span = FakeSpan(name, attributes)
+        self.spans.append(span)
+        yield span
+
+
+def _sample(name: str, step_id: str, partition: str = "0") -> Any:
+    labels = {"step_id": step_id, "partition": partition}
+    return REGISTRY.get_sample_value(f"bytewax_clickhouse_{name}", labels)
+
+
+def _sink(**kwargs: Any) -> ClickHouseSink:
+    return ClickHouseSink(
+        "events", "id Int64, name String", "user", "password", **kwargs
+    )
+
+
+def test_unknown_metric():
+    with pytest.raises(AttributeError, match="NO_SUCH_METRIC"):
+        _metrics.NO_SUCH_METRIC  # noqa: B018
+
+
+def test_metrics_are_registered_once():
+    assert _metrics.ROWS_INSERTED is _metrics.ROWS_INSERTED
+    for name in _metrics._METRIC_NAMES:
+        assert getattr(_metrics, name) is not None
+
+
+def test_inserts_are_counted_per_partition(fake_clickhouse):
+    part = _sink(max_in_flight=0).build_part("metrics-count", "3", None)
+    part.write_batch([pa.table({"id": [1, 2, 3], "name": ["a", "b", "c"]})])
+    part.close()
+
+    assert _sample("rows_inserted_total", "metrics-count", "3") == 3
+    assert _sample("server_written_rows_total", "metrics-count", "3") == 3
+    assert _sample("bytes_inserted_total", "metrics-count", "3") > 0
+    assert _sample("insert_seconds_count", "metrics-count", "3") == 1
+
+
+def test_retries_are_counted(fake_clickhouse):
+    part = _sink(max_in_flight=0).build_part("metrics-retry", "0", None)
+    part._on_retry(ConnectionError("reset"))
+    part.close()
+
+    assert _sample("insert_retries_total", "metrics-retry") == 1
+
+
+def test_queue_depth_is_removed_on_close(fake_clickhouse):
+    part = _sink(max_in_flight=1).build_part("metrics-queue", "0", None)
+    assert _sample("queue_depth", "metrics-queue") == 0
+    part.close()
+
+    # Closed partitions leave no stale series behind.
+    assert _sample("queue_depth", "metrics-queue") is None
+
+
+def test_spans_are_skipped_without_a_tracer(monkeypatch):
+    monkeypatch.setattr(_metrics, "_tracer", lambda: None)
+    with _metrics._span("clickhouse.insert", rows=1) as span:
+        assert span is None
+
+
+def test_inserts_are_traced(fake_clickhouse, monkeypatch):
+    tracer = FakeTracer()
+    monkeypatch.setattr(_metrics, "_tracer", lambda: tracer)
+    part = _sink(max_in_flight=0).build_part("metrics-trace", "0", None)
+    part.write_batch([pa.table({"id": [1, 2], "name": ["a", "b"]})])
+    part.close()
+
+    (span,) = tracer.spans
+    assert span.name == "clickhouse.insert"
+    assert span.attributes["db.sql.table"] == "events"
+    assert span.attributes["bytewax.step_id"] == "metrics-trace"
+    assert span.attributes["rows"] == 2
+    assert span.attributes["written_rows"] == 2
+    assert span.attributes["bytes"] > 0
@@ -0,0 +1,110 @@
+from datetime import date, datetime, timedelta, timezone
+
+import pyarrow as pa  # type: ignore
+import pytest
+from bytewax.clickhouse._native import _numpy_columns
+
+pytest.importorskip("pandas")
+pytest.importorskip("clickhouse_driver")
+
+from clickhouse_driver.bufferedwriter import BufferedSocketWriter  # noqa: E402
+from clickhouse_driver.columns.service import write_column  # noqa: E402
+from clickhouse_driver.context import Context  # noqa: E402
+
+# Berlin is two hours ahead of UTC in July.
+BERLIN = datetime(2024, 7, 2, 3, 4, 5, tzinfo=timezone(timedelta(hours=2)))
+NAIVE = datetime(2024, 7, 2, 3, 4, 5)  # noqa: DTZ001
+
+
+class _ServerInfo:
+    revision = used_revision = 54460
+
+    def get_timezone(self):
+        return "UTC"
+
+
+class _Socket:
+    def __init__(self):
+        self.data = b""
+
+    def sendall(self, data):
+        self.data += bytes(data)
+
+
+def _encode(ch_type, values, use_numpy):
+    """Encode a column as the driver sends it in a Native block."""
+    context = Context()
+    context.server_info = _ServerInfo()
+    context.settings = {}
+    context.client_settings = {
+        "use_numpy": use_numpy,
+        "strings_as_bytes": False,
+        "strings_encoding": "utf-8",
+        "input_format_null_as_default": False,
+    }
+    sock = _Socket()
+    buf = BufferedSocketWriter(sock, 1 << 16)
+    write_column(context, "c", ch_type, values, buf)
+    buf.flush()
+    return sock.data
+
+
+@pytest.mark.parametrize(
+    ("ch_type", "array"),
+    [
+        ("Int64", pa.array([2**62 + 1, -(2**63)], pa.int64())),
+        ("UInt64", pa.array([2**64 - 1], pa.uint64())),
+        ("Nullable(Int64)", pa.array([2**62 + 1, None], pa.int64())),
+        ("Float32", pa.array([1.5, -2.0], pa.float32())),
+        ("Bool", pa.array([True, False])),
+        ("Nullable(Bool)", pa.array([True, None])),
+        ("String", pa.array(["a", "bé", ""])),
+        ("Nullable(String)", pa.array(["a", None])),
+        ("LowCardinality(String)", pa.array(["a", "b", "a"]).dictionary_encode()),
+        (
+            "LowCardinality(Nullable(String))",
+            pa.array(["a", None, "a"]).dictionary_encode(),
+        ),
+        ("Date", pa.array([date(2024, 1, 2)], pa.date32())),
+        ("Nullable(Date)", pa.array([date(2024, 1, 2), None], pa.date32())),
+        ("DateTime", pa.array([NAIVE], pa.timestamp("s"))),
+        ("Nullable(DateTime64(6))", pa.array([NAIVE, None], pa.timestamp("us"))),
+        ("DateTime('Europe/Berlin')", pa.array([NAIVE], pa.timestamp("s"))),
+        (
+            "DateTime('Europe/Berlin')",
+            pa.array([BERLIN], pa.timestamp("s", tz="Europe/Berlin")),
+        ),
+        (
+            "Nullable(DateTime64(3, 'UTC'))",
+            pa.array([BERLIN, None], pa.timestamp("ms", tz="Europe/Berlin")),
+        ),
+        (
+            "DateTime64(6)",
+            pa.array(
+                [datetime(2024, 1, 2, tzinfo=timezone.utc)],
+                pa.timestamp("us", tz="UTC"),
+            ),
+        ),
+    ],
+)
+def test_numpy_columns_encode_like_python_values(ch_type, array):
+    [values] = _numpy_columns(pa.table({"c": array}))
+
+    expected = _encode(ch_type, array.to_pylist(), use_numpy=False)
+    assert _encode(ch_type, values, use_numpy=True) == expected
+
+
+@pytest.mark.parametrize(
+    "array",
+    [
+        pa.array([1.0, float("nan")]),
+        pa.array([[1, 2]]),
+        pa.array([b"x"]),
+        pa.array([1], pa.decimal128(10, 2)),
+    ],
+    ids=["nan", "list", "binary", "decimal"],
+)
+def test_other_tables_are_written_as_python_values(array):
+    table = pa.table({"id": [1] * len(array), "c": array})
+
+    assert _numpy_columns(table) is None
@@ -0,0 +1,131 @@
+from datetime import date, datetime
+
+import pyarrow as pa  # type: ignore
+import pytest
+from bytewax.clickhouse._partitioning import (
+    _partition_key_functions,
+    _PartitionBuffer,
+    _split_partitions,
+)
+
+SCHEMA = pa.schema(
+    [
+        ("tenant", pa.string()),
+        ("n", pa.int64()),
+        ("ts", pa.timestamp("s")),
+        ("day", pa.date32()),
+    ]
+)
+
+
+def _table(tenants, ns=None, months=None) -> pa.Table:
+    ns = ns if ns is not None else list(range(len(tenants)))
+    months = months if months is not None else [1] * len(tenants)
+    return pa.table(
+        {
+            "tenant": tenants,
+            "n": ns,
+            "ts": [datetime(2024, m, 15, 12) for m in months],  # noqa: DTZ001
+            "day": [date(2024, m, 15) for m in months],
+        },
+        schema=SCHEMA,
+    )
+
+
+def _keys(partition_key: str, table: pa.Table):
+    functions = _partition_key_functions(partition_key, SCHEMA)
+    assert functions is not None
+    return [
+        (key, part["n"].to_pylist())
+        for key, part in _split_partitions(table, functions)
+    ]
+
+
+def test_unpartitioned_tables_are_not_split():
+    table = _table(["a", "b"])
+    assert _partition_key_functions("", SCHEMA) == []
+    assert _split_partitions(table, []) == [((), table)]
+
+
+@pytest.mark.parametrize(
+    "partition_key",
+    ["unknown", "toYYYYMM(tenant)", "cityHash64(tenant) % 4", "intDiv(n, x)"],
+)
+def test_keys_not_computed_here_are_rejected(partition_key):
+    assert _partition_key_functions(partition_key, SCHEMA) is None
+
+
+def test_split_by_column():
+    table = _table(["b", "a", "b", "a"])
+
+    assert _keys("tenant", table) == [(("a",), [1, 3]), (("b",), [0, 2])]
+
+
+def test_split_by_time_bucket():
+    table = _table(["a"] * 3, months=[2, 1, 2])
+
+    assert _keys("toYYYYMM(ts)", table) == [
+        ((datetime(2024, 1, 1),), [1]),  # noqa: DTZ001
+        ((datetime(2024, 2, 1),), [0, 2]),  # noqa: DTZ001
+    ]
+    assert [key for key, _ in _keys("toStartOfMonth(day)", table)] == [
+        (date(2024, 1, 1),),
+        (date(2024, 2, 1),),
+    ]
+
+
+def test_split_by_tuple_with_nulls():
+    table = _table(["a", None, "a", None], ns=[10, 25, 15, 5])
+
+    assert _keys("tuple(tenant, intDiv(n, 10))", table) == [
+        (("a", 1), [10, 15]),
+        ((None, 0), [5]),
+        ((None, 2), [25]),
+    ]
+    assert _keys("(`tenant`, intDiv(n, 10))", table) == _keys(
+        "tuple(tenant, intDiv(n, 10))", table
+    )
+
+
+def test_single_partition_is_not_copied():
+    table = _table(["a", "a"])
+    [(key, part)] = _split_partitions(table, _partition_key_functions("tenant", SCHEMA))
+
+    assert key == ("a",)
+    assert part is table
+
+
+def test_buffer_inserts_partitions_once_full():
+    buffer = _PartitionBuffer(_partition_key_functions("tenant", SCHEMA), 3, 10)
+
+    assert buffer.add(_table(["a", "b"], ns=[0, 1])) == []
+    [ready] = buffer.add(_table(["a", "a", "b"], ns=[2, 3, 4]))
+    assert ready["n"].to_pylist() == [0, 2, 3]
+    assert buffer.rows == {("b",): 2}
+
+    [rest] = buffer.drain()
+    assert rest["n"].to_pylist() == [1, 4]
+    assert buffer.drain() == []
+
+
+def test_buffer_caps_partitions_per_insert():
+    buffer = _PartitionBuffer(_partition_key_functions("tenant", SCHEMA), 100, 2)
+    buffer.add(_table(["a", "b", "c", "d", "e"]))
+
+    inserts = buffer.drain()
+    assert [t["tenant"].to_pylist() for t in inserts] == [["a", "b"], ["c", "d"], ["e"]]
+
+
+def test_buffer_unifies_dictionaries():
+    schema = pa.schema([("tenant", pa.dictionary(pa.int32(), pa.string()))])
+    functions = _partition_key_functions("tenant", schema)
+    buffer = _PartitionBuffer(functions, 100, 10)
+    for tenants in (["a", "b"], ["b", "c"]):
+        array = pa.array(tenants).dictionary_encode()
+        buffer.add(pa.table({"tenant": array}))
+
+    [table] = buffer.drain()
+    assert table["tenant"].num_chunks > 1
+    chunks = table["tenant"].chunks
+    assert all(chunk.dictionary.equals(chunks[0].dictionary) for chunk in chunks)
+    assert sorted(table["tenant"].to_pylist()) == ["a", "b", "b", "c"]
@@ -0,0 +1,60 @@
+import pytest
+from bytewax.clickhouse import ClickHouseSink, pool_stats
+from bytewax.clickhouse._pool import _acquire_client, _release_client
+
+
+def _acquire(host="localhost", database="default", max_connections=4):
+    return _acquire_client(
+        host, 8123, "user", "password", database, max_connections=max_connections
+    )
+
+
+def test_clients_are_shared_per_server(fake_clickhouse):
+    a = _acquire()
+    b = _acquire(max_connections=8)
+    other = _acquire(database="other")
+
+    assert a is b
+    assert other is not a
+    stats = {s["database"]: s for s in pool_stats()}
+    # The first caller sets the pool options.
+    assert stats["default"]["users"] == 2
+    assert stats["default"]["max_connections"] == 4
+    assert stats["other"]["users"] == 1
+    assert stats["default"]["connections_opened"] == 0
+    assert stats["default"]["requests"] == 0
+    for client in (a, b, other):
+        _release_client(client)
+
+
+def test_last_release_closes_the_client(fake_clickhouse, monkeypatch):
+    closed = []
+    a = _acquire()
+    b = _acquire()
+    monkeypatch.setattr(a, "close", lambda: closed.append(a), raising=False)
+
+    _release_client(a)
+    assert closed == []
+    assert pool_stats()[0]["users"] == 1
+    _release_client(b)
+    assert closed == [a]
+    assert pool_stats() == []
+    # The next user gets a new client.
+    assert _acquire() is not a
+
+
+def test_partitions_share_one_client(fake_clickhouse):
+    sink = ClickHouseSink("events", "id Int64, name String", "user", "password")
+    parts = [sink.build_part("out", str(i), None) for i in range(2)]
+
+    (stats,) = pool_stats()
+    # Each partition holds a client per sender thread.
+    assert stats["users"] == 2
+    for part in parts:
+        part.close()
+    assert pool_stats() == []
+
+
+def test_unknown_transport():
+    with pytest.raises(ValueError, match="unknown transport"):
+        _acquire_client("localhost", 8123, "u", "p", "db", transport="udp")
@@ -0,0 +1,174 @@
+import threading
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterator, List, Tuple
+
+import clickhouse_connect  # type: ignore
+import pytest
+from bytewax.clickhouse import RetryPolicy
+from bytewax.clickhouse._writer import _is_retryable, _Retrier
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Answer `SELECT 42` with the next scripted status and body."""
+
+    protocol_version = "HTTP/1.1"
+    script: List[Tuple[int, bytes]] = []
+    requests = 0
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        query = self.path + body.decode(errors="replace")
+        if "version()" in query:
+            status, out = 200, b"24.8.1.1\tUTC\n"
+        elif "SELECT 42" in query:
+            type(self).requests += 1
+            status, out = self.script.pop(0) if self.script else (200, b"42\n")
+        else:
+            # An empty Native block: no settings, no rows.
+            status, out = 200, b""
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(out)))
+        self.end_headers()
+        self.wfile.write(out)
+
+    do_GET = do_POST
+
+
+def _error(code: int, name: str) -> Tuple[int, bytes]:
+    return 500, f"Code: {code}. DB::Exception: {name}. (X) (version 24.8)\n".encode()
+
+
+@pytest.fixture
+def server() -> Iterator[type]:
+    handler = type("Handler", (_Handler,), {"script": [], "requests": 0})
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    handler.port = httpd.server_address[1]
+    yield handler
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _client(server):
+    return clickhouse_connect.get_client(host="127.0.0.1", port=server.port)
+
+
+def _policy(**kwargs) -> RetryPolicy:
+    kwargs.setdefault("initial_backoff", timedelta(0))
+    kwargs.setdefault("breaker_cooldown", timedelta(milliseconds=200))
+    return RetryPolicy(**kwargs)
+
+
+def _raised(server, status: Tuple[int, bytes]) -> Exception:
+    server.script = [status]
+    with pytest.raises(Exception) as info:
+        _client(server).command("SELECT 42")
+    return info.value
+
+
+def test_is_retryable_by_error_code(server):
+    assert _is_retryable(_raised(server, _error(252, "TOO_MANY_PARTS")))
+    assert _is_retryable(_raised(server, _error(159, "TIMEOUT_EXCEEDED")))
+    assert not _is_retryable(_raised(server, _error(62, "SYNTAX_ERROR")))
+    assert not _is_retryable(_raised(server, _error(60, "UNKNOWN_TABLE")))
+
+
+def test_is_retryable_by_status(server):
+    assert _is_retryable(_raised(server, (502, b"Bad Gateway")))
+    assert not _is_retryable(_raised(server, (403, b"Forbidden")))
+
+
+def test_is_retryable_connection_refused(server):
+    server.port = 1
+    with pytest.raises(Exception) as info:
+        _client(server)
+    assert _is_retryable(info.value)
+
+
+def test_retries_until_success(server):
+    client = _client(server)
+    server.script = [_error(252, "TOO_MANY_PARTS")] * 2
+    retried = []
+    retrier = _Retrier(_policy(), "t", on_retry=retried.append)
+
+    assert retrier.call(lambda: client.command("SELECT 42")) == 42
+    assert server.requests == 3
+    assert len(retried) == 2
+    assert not retrier.is_open
+
+
+def test_gives_up_after_max_retries(server):
+    client = _client(server)
+    server.script = [_error(252, "TOO_MANY_PARTS")] * 3
+    retrier = _Retrier(_policy(max_retries=2, breaker_threshold=10), "t")
+
+    with pytest.raises(Exception, match="Code: 252"):
+        retrier.call(lambda: client.command("SELECT 42"))
+    assert server.requests == 3
+
+
+def test_does_not_retry_data_errors(server):
+    client = _client(server)
+    server.script = [_error(62, "SYNTAX_ERROR")]
+    retrier = _Retrier(_policy(), "t")
+
+    with pytest.raises(Exception, match="Code: 62"):
+        retrier.call(lambda: client.command("SELECT 42"))
+    assert server.requests == 1
+
+
+def test_breaker_opens_and_half_opens(server):
+    client = _client(server)
+    server.script = [_error(210, "NETWORK_ERROR")] * 4
+    retrier = _Retrier(_policy(max_retries=1, breaker_threshold=2), "t")
+    seen = []
+
+    def on_retry(ex):
+        seen.append((server.requests, retrier.is_open))
+
+    retrier.on_retry = on_retry
+    assert retrier.call(lambda: client.command("SELECT 42")) == 42
+
+    # Once open, failures no longer count against `max_retries`, and
+    # each cooldown lets a single probe through until one succeeds.
+    assert seen == [(1, False), (2, True), (3, True), (4, True)]
+    assert server.requests == 5
+    assert not retrier.is_open
+
+
+def test_breaker_waits_for_cooldown(server):
+    client = _client(server)
+    server.script = [_error(210, "NETWORK_ERROR")] * 2
+    retrier = _Retrier(
+        _policy(breaker_threshold=2, breaker_cooldown=timedelta(seconds=60)), "t"
+    )
+    probes = []
+    retrier.on_retry = lambda ex: probes.append(server.requests)
+
+    thread = threading.Thread(
+        target=retrier.call, args=(lambda: client.command("SELECT 42"),), daemon=True
+    )
+    thread.start()
+    thread.join(0.5)
+
+    # Open, and holding the next probe back until the cooldown is over.
+    assert retrier.is_open
+    assert thread.is_alive()
+    assert server.requests == 2
+
+
+def test_outage_fails_after_max_outage(server):
+    client = _client(server)
+    server.script = [_error(210, "NETWORK_ERROR")] * 100
+    retrier = _Retrier(
+        _policy(breaker_threshold=1, max_outage=timedelta(milliseconds=300)), "t"
+    )
+
+    with pytest.raises(Exception, match="Code: 210"):
+        retrier.call(lambda: client.command("SELECT 42"))
+    assert retrier.is_open
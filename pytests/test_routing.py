@@ -0,0 +1,112 @@
+import zlib
+from zlib import adler32
+
+import bytewax.operators as op
+import pyarrow as pa  # type: ignore
+import pytest
+from bytewax.clickhouse import (
+    ClickHouseDynamicSink,
+    ClickHouseMultiSink,
+    ClickHouseSink,
+    OutputTable,
+)
+from bytewax.clickhouse.operators import _shard
+from bytewax.dataflow import Dataflow
+from bytewax.testing import TestingSink, TestingSource, run_main
+
+SCHEMA = pa.schema([("id", pa.int64()), ("name", pa.string())])
+
+
+def _sharded(values, shards, shard_by=None):
+    out = []
+    flow = Dataflow("shard")
+    keyed = op.input("inp", flow, TestingSource([("k", v) for v in values]))
+    op.output("out", _shard("shard", keyed, shards, SCHEMA, shard_by), TestingSink(out))
+    run_main(flow)
+    return out
+
+
+def test_shard_spreads_round_robin():
+    out = _sharded([{"id": i, "name": "n"} for i in range(7)], 3)
+    assert [key for key, _value in out] == ["0", "1", "2", "0", "1", "2", "0"]
+
+
+def test_shard_by_keeps_equal_values_together():
+    rows = [{"id": i, "name": f"n{i % 2}"} for i in range(10)]
+    out = _sharded(rows, 4, ["name"])
+
+    shards = {value["name"]: set() for _key, value in out}
+    for key, value in out:
+        shards[value["name"]].add(key)
+    assert all(len(keys) == 1 for keys in shards.values())
+    # The hash must agree across processes, so it is not `hash`.
+    expected = zlib.crc32(repr(("n0",)).encode()) % 4
+    assert shards["n0"] == {str(expected)}
+
+
+def test_shard_by_reads_every_row_shape():
+    out = _sharded([(1, "a"), {"id": 1, "name": "a"}], 8, ["name", "id"])
+    assert out[0][0] == out[1][0]
+
+
+def test_shard_spreads_tables_round_robin():
+    table = pa.table({"id": [1], "name": ["a"]})
+    out = _sharded([table, table, table], 2, ["name"])
+    assert [key for key, _value in out] == ["0", "1", "0"]
+
+
+def test_shard_needs_one_shard():
+    with pytest.raises(ValueError, match="at least 1"):
+        _sharded([{"id": 1, "name": "a"}], 0)
+
+
+def test_shard_by_needs_known_columns():
+    with pytest.raises(ValueError, match="unknown column"):
+        _sharded([{"id": 1, "name": "a"}], 2, ["missing"])
+
+
+@pytest.mark.parametrize(
+    "sink",
+    [
+        ClickHouseSink("events", "id Int64", "user", "password", parts=4),
+        ClickHouseMultiSink(
+            {"events": OutputTable(SCHEMA, "id Int64, name String")},
+            "user",
+            "password",
+            parts=4,
+        ),
+    ],
+)
+def test_part_fn_maps_shard_numbers_one_to_one(sink):
+    assert sink.list_parts() == ["0", "1", "2", "3"]
+    assert [sink.part_fn(str(i)) for i in range(4)] == [0, 1, 2, 3]
+    # Other keys are hashed consistently across processes.
+    assert sink.part_fn("user-1") == adler32(b"user-1")
+
+
+def test_dynamic_sink_inserts_tables_without_keys(fake_clickhouse):
+    sink = ClickHouseDynamicSink("events", "id Int64, name String", "user", "password")
+    part = sink.build("out", 0, 2)
+    part.write_batch([pa.table({"id": [1, 2], "name": ["a", "b"]})])
+
+    # Dynamic sinks are never snapshotted, so the rows must already
+    # be on the server.
+    assert fake_clickhouse.rows() == [1, 2]
+    part.close()
+
+
+def test_dynamic_sink_in_a_dataflow(fake_clickhouse):
+    tables = [pa.table({"id": [i], "name": ["a"]}) for i in range(5)]
+    flow = Dataflow("dynamic")
+    stream = op.input("inp", flow, TestingSource(tables))
+    op.output("out", stream, ClickHouseDynamicSink("events", None, "user", "password"))
+    run_main(flow)
+
+    assert sorted(fake_clickhouse.rows()) == list(range(5))
+
+
+def test_dynamic_sink_rejects_stateful_options():
+    with pytest.raises(ValueError, match="partitioned sink"):
+        ClickHouseDynamicSink(
+            "events", "id Int64", "user", "password", dedup_block_rows=100
+        )
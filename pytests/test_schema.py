@@ -0,0 +1,177 @@
+from datetime import date, datetime, timezone
+from decimal import Decimal
+
+import pyarrow as pa  # type: ignore
+import pytest
+from bytewax.clickhouse._schema import _compile_plan
+
+
+def _convert(field: pa.Field, ch_type: str, values, default_kind: str = ""):
+    schema = pa.schema([field])
+    plan = _compile_plan(schema, [(field.name, ch_type, default_kind)])
+    table = plan.apply(pa.table({field.name: pa.array(values, field.type)}))
+    return plan, table.column(0)
+
+
+def test_matching_schema_needs_no_plan():
+    schema = pa.schema(
+        [pa.field("id", pa.int64(), nullable=False), ("name", pa.string())]
+    )
+    plan = _compile_plan(
+        schema, [("id", "Int64", ""), ("name", "Nullable(String)", "")]
+    )
+
+    assert not plan
+
+
+@pytest.mark.parametrize(
+    ("source", "ch_type", "values", "target", "expected"),
+    [
+        (pa.int32(), "Int64", [1, 2], pa.int64(), [1, 2]),
+        (pa.int64(), "Float64", [1, 2], pa.float64(), [1.0, 2.0]),
+        (pa.large_string(), "String", ["a"], pa.string(), ["a"]),
+        (
+            pa.int64(),
+            "Decimal(10, 2)",
+            [3],
+            pa.decimal128(10, 2),
+            [Decimal("3.00")],
+        ),
+        (
+            pa.timestamp("us"),
+            "DateTime",
+            [datetime(2024, 1, 2, 3, 4, 5, 678)],  # noqa: DTZ001
+            pa.timestamp("s"),
+            [datetime(2024, 1, 2, 3, 4, 5)],  # noqa: DTZ001
+        ),
+        (
+            pa.timestamp("us", tz="UTC"),
+            "DateTime64(3)",
+            [datetime(2024, 1, 2, tzinfo=timezone.utc)],
+            pa.timestamp("ms", tz="UTC"),
+            [datetime(2024, 1, 2, tzinfo=timezone.utc)],
+        ),
+        (
+            pa.list_(pa.int32()),
+            "Array(Int64)",
+            [[1, 2]],
+            pa.list_(pa.int64()),
+            [[1, 2]],
+        ),
+        (
+            pa.float64(),
+            "SimpleAggregateFunction(sum, Float64)",
+            [1.5],
+            pa.float64(),
+            [1.5],
+        ),
+    ],
+)
+def test_casts_to_the_column_type(source, ch_type, values, target, expected):
+    plan, column = _convert(pa.field("c", source, nullable=False), ch_type, values)
+
+    assert column.type == target
+    assert column.to_pylist() == expected
+
+
+def test_low_cardinality_is_dictionary_encoded():
+    _, column = _convert(pa.field("c", pa.string()), "LowCardinality(String)", ["a"])
+
+    assert column.type == pa.dictionary(pa.int32(), pa.string())
+    assert column.to_pylist() == ["a"]
+
+
+def test_dictionary_source_is_recast_for_plain_column():
+    dict_type = pa.dictionary(pa.int8(), pa.string())
+    _, column = _convert(pa.field("c", dict_type), "String", ["a", "b", "a"])
+
+    assert column.type == pa.string()
+    assert column.to_pylist() == ["a", "b", "a"]
+
+
+@pytest.mark.parametrize(
+    ("source", "ch_type", "expected"),
+    [
+        (pa.int64(), "Int64", 0),
+        (pa.string(), "String", ""),
+        (pa.bool_(), "Bool", False),
+        (pa.date32(), "Date", date(1970, 1, 1)),
+        (pa.float64(), "LowCardinality(Float64)", 0.0),
+    ],
+)
+def test_nulls_become_the_column_default(source, ch_type, expected):
+    _, column = _convert(pa.field("c", source), ch_type, [None])
+
+    assert column.null_count == 0
+    assert column.to_pylist() == [expected]
+
+
+def test_filled_nulls_are_warned_about_once(caplog):
+    plan, _ = _convert(pa.field("c", pa.int64()), "Int64", [1, None])
+    plan.apply(pa.table({"c": pa.array([None], pa.int64())}))
+
+    warnings = [r for r in caplog.records if r.levelname == "WARNING"]
+    assert len(warnings) == 1
+    assert "'c'" in warnings[0].getMessage()
+
+
+def test_columns_without_nulls_are_not_warned_about(caplog):
+    _convert(pa.field("c", pa.int64()), "Int64", [1, 2])
+
+    assert not [r for r in caplog.records if r.levelname == "WARNING"]
+
+
+@pytest.mark.parametrize(
+    ("ch_type", "default_kind"),
+    [
+        ("Nullable(Int64)", ""),
+        ("Int64", "DEFAULT"),
+        ("LowCardinality(Nullable(String))", ""),
+    ],
+)
+def test_nulls_are_kept_for_the_server(ch_type, default_kind):
+    field = pa.field("c", pa.string() if "String" in ch_type else pa.int64())
+    _, column = _convert(field, ch_type, [None], default_kind)
+
+    assert column.to_pylist() == [None]
+
+
+def test_non_nullable_source_needs_no_fill():
+    schema = pa.schema([pa.field("id", pa.int64(), nullable=False)])
+
+    assert not _compile_plan(schema, [("id", "Int64", "")])
+
+
+def test_unknown_types_pass_through():
+    schema = pa.schema([("id", pa.string())])
+
+    assert not _compile_plan(schema, [("id", "UUID", "")])
+
+
+def test_integers_too_large_for_a_decimal_fail():
+    with pytest.raises(pa.ArrowInvalid):
+        _convert(pa.field("c", pa.int64()), "Decimal(10, 2)", [10**12])
+
+
+def test_mismatches_are_reported_together():
+    schema = pa.schema(
+        [
+            ("missing", pa.int64()),
+            ("computed", pa.int64()),
+            ("lossy", pa.float64()),
+            ("text", pa.string()),
+        ]
+    )
+    columns = [
+        ("computed", "Int64", "MATERIALIZED"),
+        ("lossy", "Int64", ""),
+        ("text", "Date", ""),
+    ]
+    with pytest.raises(ValueError) as info:
+        _compile_plan(schema, columns)
+
+    message = str(info.value)
+    assert "`missing` is not a column of the table" in message
+    assert "`computed` is a MATERIALIZED column" in message
+    assert "`lossy` of type double cannot be Int64" in message
+    assert "`text` of type string cannot be Date" in message
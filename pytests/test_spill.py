@@ -0,0 +1,146 @@
+import threading
+
+import pyarrow as pa  # type: ignore
+import pytest
+from bytewax.clickhouse import ClickHouseSink
+from bytewax.clickhouse._spill import _SpillBuffer
+from conftest import FakeClient
+
+
+def _table(start: int, stop: int) -> pa.Table:
+    ids = list(range(start, stop))
+    return pa.table({"id": ids, "name": [f"n{i}" for i in ids]})
+
+
+def _files(spill: _SpillBuffer):
+    return sorted(int(path.stem) for path in spill.directory.glob("*.arrow"))
+
+
+def test_tables_come_back_in_order_with_tokens(tmp_path):
+    spill = _SpillBuffer(tmp_path, 1 << 20)
+    spill.put((_table(0, 2), "a"))
+    spill.put((_table(2, 4), None))
+
+    table, token, seq = spill.get()
+    assert (table.equals(_table(0, 2)), token, seq) == (True, "a", 0)
+    table, token, seq = spill.get()
+    assert (table.equals(_table(2, 4)), token, seq) == (True, None, 1)
+    assert table.schema.metadata is None
+
+
+def test_control_items_come_after_files(tmp_path):
+    spill = _SpillBuffer(tmp_path, 1 << 20)
+    stop = object()
+    spill.put((_table(0, 1), None))
+    spill.put(stop)
+
+    assert spill.get()[2] == 0
+    assert spill.get() is stop
+
+
+def test_dictionary_columns_round_trip(tmp_path):
+    spill = _SpillBuffer(tmp_path, 1 << 20)
+    tags = pa.chunked_array(
+        [pa.array(["a", "b"]).dictionary_encode(), pa.array(["c"]).dictionary_encode()]
+    )
+    spill.put((pa.table({"tag": tags}), None))
+
+    assert spill.get()[0]["tag"].to_pylist() == ["a", "b", "c"]
+
+
+def test_position_covers_unacked_files(tmp_path):
+    spill = _SpillBuffer(tmp_path, 1 << 20)
+    assert spill.position() == (0, 0)
+    for i in range(3):
+        spill.put((_table(i, i + 1), None))
+    assert spill.position() == (0, 3)
+
+    # In flight until acked.
+    seq = spill.get()[2]
+    assert spill.position() == (0, 3)
+    spill.ack(seq)
+    spill.task_done()
+    assert spill.position() == (1, 3)
+    assert _files(spill) == [1, 2]
+
+
+def test_resume_requeues_unacked_and_drops_the_rest(tmp_path):
+    spill = _SpillBuffer(tmp_path, 1 << 20)
+    for i in range(3):
+        spill.put((_table(i, i + 1), f"t{i}"))
+    spill.ack(spill.get()[2])
+    position = spill.position()
+    # Written after the snapshot; upstream replays its rows.
+    spill.put((_table(3, 4), "t3"))
+
+    resumed = _SpillBuffer(tmp_path, 1 << 20, position)
+    assert _files(resumed) == [1, 2]
+    assert resumed.unfinished_tasks == 2
+    assert [resumed.get()[1] for _ in range(2)] == ["t1", "t2"]
+    assert resumed.position() == (1, 3)
+    # New files carry on after the resumed ones.
+    resumed.put((_table(3, 4), "t3"))
+    assert resumed.get()[2] == 3
+
+
+def test_put_blocks_over_max_bytes_until_acked(tmp_path):
+    spill = _SpillBuffer(tmp_path, 1)
+    spill.put((_table(0, 1), None))
+    second = threading.Thread(target=spill.put, args=((_table(1, 2), None),))
+    second.start()
+    second.join(0.2)
+    assert second.is_alive()
+
+    spill.ack(spill.get()[2])
+    second.join(5)
+    assert not second.is_alive()
+    assert _files(spill) == [1]
+
+
+def test_fail_unblocks_put(tmp_path):
+    spill = _SpillBuffer(tmp_path, 1)
+    spill.put((_table(0, 1), None))
+    second = threading.Thread(target=spill.put, args=((_table(1, 2), None),))
+    second.start()
+
+    spill.fail()
+    second.join(5)
+    assert not second.is_alive()
+
+
+def test_sink_resumes_spilled_batches(fake_clickhouse, monkeypatch, tmp_path):
+    # The server hangs until the worker "crashes", then the stuck
+    # insert fails and the worker is restarted from its last snapshot.
+    stuck = threading.Event()
+    restarted = threading.Event()
+    insert_arrow = FakeClient.insert_arrow
+
+    def insert(self, *args, **kwargs):
+        if not restarted.is_set():
+            stuck.set()
+            restarted.wait()
+            msg = "Code: 62. connection lost with the crash"
+            raise ValueError(msg)
+        return insert_arrow(self, *args, **kwargs)
+
+    monkeypatch.setattr(FakeClient, "insert_arrow", insert)
+    sink = ClickHouseSink(
+        "events", "id Int64, name String", "user", "password", spill_dir=tmp_path
+    )
+    part = sink.build_part("out", "0", None)
+    part.write_batch([_table(0, 10)])
+    part.write_batch([_table(10, 20)])
+    state = part.snapshot()
+    assert state.spill_position == (0, 2)
+    part.write_batch([_table(20, 30)])
+
+    stuck.wait()
+    restarted.set()
+    with pytest.raises(RuntimeError):
+        part.pipelines[0].flush()
+    resumed = sink.build_part("out", "0", state)
+    resumed.write_batch([_table(20, 30)])
+    resumed.close()
+
+    assert sorted(fake_clickhouse.rows()) == list(range(30))
+    assert not list(tmp_path.rglob("*.arrow"))
@@ -0,0 +1,328 @@
+import threading
+from datetime import timedelta
+
+import bytewax.operators as op
+import pyarrow as pa  # type: ignore
+import pytest
+from bytewax.clickhouse import (
+    ClickHouseMultiSink,
+    ClickHouseSink,
+    OutputTable,
+    RetryPolicy,
+)
+from bytewax.clickhouse import operators as chop
+from bytewax.clickhouse._sink import _WorkerIndexSink, _WorkerSink
+from bytewax.clickhouse._writer import _BatchTuner, _InsertPipeline
+from bytewax.dataflow import Dataflow
+from bytewax.testing import TestingSource, cluster_main, run_main
+from conftest import FakeClient
+
+
+def _pipeline(insert, max_in_flight=1, max_queued=1) -> _InsertPipeline:
+    return _InsertPipeline(
+        insert,
+        object,
+        lambda client: None,
+        max_in_flight=max_in_flight,
+        max_queued=max_queued,
+        name="test",
+    )
+
+
+def test_pipeline_inserts_in_order():
+    inserted = []
+    pipeline = _pipeline(lambda client, table, token: inserted.append(token))
+    for i in range(20):
+        pipeline.submit(pa.table({"id": [i]}), str(i))
+    pipeline.close()
+
+    assert inserted == [str(i) for i in range(20)]
+
+
+def test_pipeline_blocks_when_queue_is_full():
+    release = threading.Event()
+    started = threading.Event()
+
+    def insert(client, table, token):
+        started.set()
+        release.wait()
+
+    pipeline = _pipeline(insert)
+    pipeline.submit(pa.table({"id": [0]}))
+    started.wait()
+    # One insert runs and one waits in the queue; the third blocks.
+    pipeline.submit(pa.table({"id": [1]}))
+    third = threading.Thread(target=pipeline.submit, args=(pa.table({"id": [2]}),))
+    third.start()
+    third.join(0.2)
+    assert third.is_alive()
+    assert pipeline.depth == 2
+
+    release.set()
+    third.join()
+    pipeline.close()
+    assert pipeline.depth == 0
+
+
+def test_pipeline_keeps_raising_after_a_failed_insert():
+    inserted = []
+
+    def insert(client, table, token):
+        if token == "0":
+            msg = "boom"
+            raise ValueError(msg)
+        inserted.append(token)
+
+    pipeline = _pipeline(insert, max_queued=4)
+    for i in range(3):
+        pipeline.submit(pa.table({"id": [i]}), str(i))
+    with pytest.raises(RuntimeError) as info:
+        pipeline.flush()
+    assert isinstance(info.value.__cause__, ValueError)
+    # The tables queued after the failure were dropped, so no later
+    # call may succeed.
+    assert inserted == []
+    for call in (pipeline.check, pipeline.flush, pipeline.close):
+        with pytest.raises(RuntimeError):
+            call()
+    with pytest.raises(RuntimeError):
+        pipeline.submit(pa.table({"id": [3]}), "3")
+
+
+def test_partition_close_raises_a_failed_insert(fake_clickhouse, monkeypatch):
+    def fail(self, *args, **kwargs):
+        msg = "boom"
+        raise ValueError(msg)
+
+    monkeypatch.setattr(FakeClient, "insert_arrow", fail)
+    sink = ClickHouseSink("events", "id Int64, name String", "user", "password")
+    part = sink.build_part("out", "0", None)
+    part.write_batch([pa.table({"id": [1], "name": ["a"]})])
+    with pytest.raises(RuntimeError):
+        part.snapshot()
+    with pytest.raises(RuntimeError):
+        part.close()
+    assert all(not thread.is_alive() for p in part.pipelines for thread in p._threads)
+
+
+def test_worker_sink_waits_for_inserts_at_snapshots(fake_clickhouse, monkeypatch):
+    release = threading.Event()
+    original = FakeClient.insert_arrow
+
+    def held(self, *args, **kwargs):
+        release.wait()
+        return original(self, *args, **kwargs)
+
+    monkeypatch.setattr(FakeClient, "insert_arrow", held)
+    sink = ClickHouseSink("events", "id Int64, name String", "user", "password")
+    part = _WorkerSink(sink).build_part("out", "1", None)
+    part.write_batch([pa.table({"id": [1, 2], "name": ["a", "b"]})])
+
+    # The write returns while its insert is in flight.
+    assert fake_clickhouse.rows() == []
+    release.set()
+    part.snapshot()
+    assert fake_clickhouse.rows() == [1, 2]
+    part.close()
+
+
+def test_worker_sink_lists_its_own_partition():
+    sink = ClickHouseSink("events", "id Int64", "user", "password")
+    worker = _WorkerSink(sink)
+    _WorkerIndexSink().build("out", 2, 12)
+
+    assert worker.list_parts() == ["2"]
+    # Partitions are indexed in the sorted global list of all workers.
+    assert worker.part_fn("2") == 4
+    assert worker.part_fn("10") == 2
+
+
+def test_worker_sink_rejects_stateful_options():
+    sink = ClickHouseSink(
+        "events", "id Int64", "user", "password", dedup_block_rows=100
+    )
+    with pytest.raises(ValueError, match="partitioned sink"):
+        _WorkerSink(sink)
+
+
+@pytest.mark.parametrize(
+    "kwargs", [{"compression_level": 3}, {"arrow_compression": "zstd"}]
+)
+def test_native_transport_rejects_http_compression(kwargs):
+    with pytest.raises(ValueError, match="HTTP transport"):
+        ClickHouseSink(
+            "events", "id Int64", "user", "password", transport="native", **kwargs
+        )
+
+
+def _insert_settings(server, **kwargs):
+    sink = ClickHouseSink(
+        "events", "id Int64, name String", "user", "password", max_in_flight=0, **kwargs
+    )
+    part = sink.build_part("out", "0", None)
+    part.write_batch([pa.table({"id": [1], "name": ["a"]})])
+    part.snapshot()
+    part.close()
+    ((_table, _rows, settings),) = server.inserts
+    return settings
+
+
+def test_inserts_are_synchronous_by_default(fake_clickhouse):
+    assert _insert_settings(fake_clickhouse) == {"buffer_size": 0}
+
+
+def test_async_insert_settings(fake_clickhouse):
+    settings = _insert_settings(
+        fake_clickhouse,
+        async_insert=True,
+        wait_for_async_insert=False,
+        async_insert_max_data_size=1 << 20,
+        async_insert_busy_timeout=timedelta(milliseconds=250),
+    )
+    assert settings == {
+        "buffer_size": 0,
+        "async_insert": 1,
+        "wait_for_async_insert": 0,
+        "async_insert_max_data_size": 1 << 20,
+        "async_insert_busy_timeout_ms": 250,
+    }
+
+
+def test_async_insert_waits_by_default(fake_clickhouse):
+    settings = _insert_settings(fake_clickhouse, async_insert=True)
+    assert settings["wait_for_async_insert"] == 1
+    assert "async_insert_busy_timeout_ms" not in settings
+
+
+def test_async_insert_deduplicates_blocks(fake_clickhouse):
+    settings = _insert_settings(
+        fake_clickhouse, async_insert=True, dedup_block_rows=100
+    )
+    assert settings["async_insert_deduplicate"] == 1
+    assert settings["insert_deduplication_token"].startswith("out-0-0-")
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        {"async_insert_max_data_size": 1 << 20},
+        {"async_insert_busy_timeout": timedelta(seconds=1)},
+    ],
+)
+def test_async_insert_options_need_async_insert(kwargs):
+    with pytest.raises(ValueError, match="require `async_insert=True`"):
+        ClickHouseSink("events", "id Int64", "user", "password", **kwargs)
+
+
+def _record_bodies(monkeypatch, fail_first=False):
+    """Record the chunks of each insert body sent to the server."""
+    bodies = []
+    original = FakeClient.raw_insert
+
+    def raw_insert(self, table, column_names, body, **kwargs):
+        chunks = iter(body)
+        bodies.append([next(chunks)])
+        if fail_first and len(bodies) == 1:
+            # The connection drops after the first chunk.
+            msg = "connection reset"
+            raise ConnectionError(msg)
+        bodies[-1].extend(chunks)
+        return original(self, table, column_names, b"".join(bodies[-1]), **kwargs)
+
+    monkeypatch.setattr(FakeClient, "raw_insert", raw_insert)
+    return bodies
+
+
+def test_batch_is_streamed_one_table_at_a_time(fake_clickhouse, monkeypatch):
+    bodies = _record_bodies(monkeypatch)
+    sink = ClickHouseSink(
+        "events", "id Int64, name String", "user", "password", max_in_flight=0
+    )
+    part = sink.build_part("out", "0", None)
+    tables = [pa.table({"id": [i, i + 1], "name": ["a", "b"]}) for i in (0, 2, 4)]
+    part.write_batch(tables)
+    part.close()
+
+    # One insert, sent as a chunk per table and the end of the stream,
+    # without combining the tables first.
+    ((_table, inserted, _settings),) = fake_clickhouse.inserts
+    (chunks,) = bodies
+    assert len(chunks) == 4
+    assert inserted.column("id").to_pylist() == list(range(6))
+
+
+def test_retried_insert_resends_the_whole_body(fake_clickhouse, monkeypatch):
+    bodies = _record_bodies(monkeypatch, fail_first=True)
+    sink = ClickHouseSink(
+        "events",
+        "id Int64, name String",
+        "user",
+        "password",
+        max_in_flight=0,
+        retry_policy=RetryPolicy(initial_backoff=timedelta(0)),
+    )
+    part = sink.build_part("out", "0", None)
+    part.write_batch([pa.table({"id": [1], "name": ["a"]})] * 2)
+    part.close()
+
+    assert [len(chunks) for chunks in bodies] == [1, 3]
+    assert bodies[1][0] == bodies[0][0]
+    assert fake_clickhouse.rows() == [1, 1]
+
+
+def test_fan_out_polls_parts_of_every_table(fake_clickhouse):
+    schema = pa.schema([("id", pa.int64()), ("name", pa.string())])
+    tables = {
+        name: OutputTable(schema, "id Int64, name String")
+        for name in ("events", "errors")
+    }
+    tuner = _BatchTuner(100, None, timedelta(seconds=1))
+    sink = ClickHouseMultiSink(
+        tables, "user", "password", max_in_flight=0, batch_tuner=tuner
+    )
+    part = sink.build_part("out", "0", None)
+    part.write_batch([("errors", pa.table({"id": [1], "name": ["a"]}))])
+
+    (query,) = [q for q in fake_clickhouse.queries if "max(parts)" in q]
+    assert "table IN ('events', 'errors')" in query
+    part.close()
+
+
+def _flow(keys: int) -> Dataflow:
+    schema = pa.schema([("id", pa.int64()), ("name", pa.string())])
+    flow = Dataflow("worker_local")
+    rows = op.input("inp", flow, TestingSource(range(100)))
+    keyed = op.map("key", rows, lambda i: (str(i % keys), {"id": i, "name": "n"}))
+    chop.output(
+        "out",
+        keyed,
+        schema,
+        "events",
+        "id Int64, name String",
+        "user",
+        "password",
+        timeout=timedelta(milliseconds=10),
+    )
+    return flow
+
+
+def test_output_inserts_on_each_worker(fake_clickhouse, monkeypatch):
+    built = {}
+    original = ClickHouseSink.build_part
+
+    def record(self, step_id, for_part, resume_state):
+        built[for_part] = threading.current_thread().name
+        return original(self, step_id, for_part, resume_state)
+
+    monkeypatch.setattr(ClickHouseSink, "build_part", record)
+    cluster_main(_flow(keys=16), [], 0, worker_count_per_proc=2)
+
+    assert sorted(fake_clickhouse.rows()) == list(range(100))
+    # One partition per worker, each built by its own worker.
+    assert sorted(built) == ["0", "1"]
+    assert len(set(built.values())) == 2
+
+
+def test_output_single_worker(fake_clickhouse):
+    run_main(_flow(keys=1))
+    assert sorted(fake_clickhouse.rows()) == list(range(100))
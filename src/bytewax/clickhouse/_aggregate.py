@@ -0,0 +1,185 @@
+"""Pre-aggregation of batches before they are inserted.
+
+Metric streams are often inserted sample by sample, only to be summed
+up by the server. `_PreAggregator` groups each batch by key columns
+and a time bucket with Arrow's hash aggregation kernels and keeps one
+row per group, with the sum, count, minimum or maximum of its columns.
+
+Tables of `SummingMergeTree` or `AggregatingMergeTree` with
+`SimpleAggregateFunction` columns merge these partial rows on the
+server the same way they merge rows of separate inserts, so each
+batch can be reduced on its own.
+"""
+
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+import pyarrow as pa  # type: ignore
+
+_FUNCTIONS = ("sum", "count", "min", "max")
+
+
+@dataclass(frozen=True)
+class Aggregation:
+    """A column of a pre-aggregated table.
+
+    `function` is one of `"sum"`, `"count"`, `"min"` or `"max"` of
+    `column` over the rows of a group. `count` counts non-null values
+    of `column`, or every row without one. Sums of integers are
+    `int64`, or `uint64` for unsigned integers, sums of floats are
+    `float64`, counts are `uint64` and minimums and maximums keep the
+    type of `column`.
+    """
+
+    function: str
+    column: Optional[str] = None
+
+    def __post_init__(self) -> None:
+        if self.function not in _FUNCTIONS:
+            msg = f"`function` must be one of {_FUNCTIONS!r}; got {self.function!r}"
+            raise ValueError(msg)
+        if self.column is None and self.function != "count":
+            msg = f"`{self.function}` requires a `column`"
+            raise ValueError(msg)
+
+
+def _bucket_options(bucket: timedelta, is_date: bool) -> Dict[str, Any]:
+    """Options of `floor_temporal` for buckets of `bucket`."""
+    if bucket < timedelta(milliseconds=1) or bucket % timedelta(milliseconds=1):
+        msg = f"`bucket` must be a positive number of milliseconds; got {bucket}"
+        raise ValueError(msg)
+    if not bucket % timedelta(days=1):
+        return {"multiple": bucket.days, "unit": "day"}
+    if is_date:
+        msg = f"buckets of a date column must be whole days; got {bucket}"
+        raise ValueError(msg)
+    if not bucket % timedelta(seconds=1):
+        return {"multiple": int(bucket.total_seconds()), "unit": "second"}
+    return {"multiple": bucket // timedelta(milliseconds=1), "unit": "millisecond"}
+
+
+def _result_type(aggregation: Aggregation, data_type: pa.DataType) -> pa.DataType:
+    t = pa.types
+    if aggregation.function == "count":
+        return pa.uint64()
+    if aggregation.function == "sum":
+        if t.is_unsigned_integer(data_type):
+            return pa.uint64()
+        if t.is_integer(data_type):
+            return pa.int64()
+        if t.is_floating(data_type):
+            return pa.float64()
+        msg = f"cannot sum `{aggregation.column}` of type {data_type}"
+        raise ValueError(msg)
+    comparable = (
+        t.is_integer(data_type)
+        or t.is_floating(data_type)
+        or t.is_timestamp(data_type)
+        or t.is_date(data_type)
+    )
+    if not comparable:
+        msg = (
+            f"cannot take the {aggregation.function} of `{aggregation.column}` "
+            f"of type {data_type}"
+        )
+        raise ValueError(msg)
+    return data_type
+
+
+class _PreAggregator:
+    """Reduce tables of `pa_schema` to one row per key and time bucket.
+
+    Output tables have the `keys` columns, `time_column` floored to
+    `bucket` and one column per aggregation, in that order; their
+    schema is `pa_schema` of the aggregator. Buckets start at the Unix
+    epoch in the time zone of `time_column`, like ClickHouse's
+    `toStartOfInterval`.
+
+    Raises:
+        ValueError: If a column is not in `pa_schema` or has a type
+        that cannot be aggregated, `time_column` is not a timestamp or
+        date, or an aggregation is named like a key.
+    """
+
+    def __init__(
+        self,
+        pa_schema: pa.Schema,
+        keys: Sequence[str],
+        time_column: str,
+        bucket: timedelta,
+        aggregations: Mapping[str, Aggregation],
+    ):
+        used = [*keys, time_column]
+        used.extend(a.column for a in aggregations.values() if a.column is not None)
+        unknown = sorted(set(used) - set(pa_schema.names))
+        if unknown:
+            msg = f"columns not in `pa_schema`: {unknown!r}"
+            raise ValueError(msg)
+        clashes = sorted(set(aggregations) & set(used[: len(keys) + 1]))
+        if clashes:
+            msg = f"aggregations are named like key columns: {clashes!r}"
+            raise ValueError(msg)
+        time_type = pa_schema.field(time_column).type
+        if not (pa.types.is_timestamp(time_type) or pa.types.is_date(time_type)):
+            msg = f"`{time_column}` of type {time_type} is not a time column"
+            raise ValueError(msg)
+
+        self.groups = [*keys, time_column]
+        self.bucket = _bucket_options(bucket, pa.types.is_date(time_type))
+        self.time_index = pa_schema.get_field_index(time_column)
+        # Aggregations of the time column see its values before they
+        # are floored, under a name no column can have.
+        self.raw_time = f"{time_column}\0raw"
+        self.keeps_raw_time = any(
+            a.column == time_column for a in aggregations.values()
+        )
+        # Arrow names each result `<column>_<function>`, or `count_all`.
+        self.specs: List[Tuple[Any, ...]] = []
+        self.results: List[Tuple[str, str, pa.DataType]] = []
+        fields = [pa_schema.field(name) for name in self.groups]
+        for name, aggregation in aggregations.items():
+            if aggregation.column is None:
+                spec: Tuple[Any, ...] = ([], "count_all")
+                result = "count_all"
+                result_type = pa.uint64()
+            else:
+                column = (
+                    self.raw_time
+                    if aggregation.column == time_column
+                    else aggregation.column
+                )
+                spec = (column, aggregation.function)
+                result = f"{column}_{aggregation.function}"
+                data_type = pa_schema.field(aggregation.column).type
+                result_type = _result_type(aggregation, data_type)
+            if spec not in self.specs:
+                self.specs.append(spec)
+            self.results.append((name, result, result_type))
+            fields.append(pa.field(name, result_type))
+        self.pa_schema = pa.schema(fields)
+
+    def __call__(self, table: pa.Table) -> pa.Table:
+        import pyarrow.compute as pc  # type: ignore # noqa: PLC0415
+
+        if table.num_rows == 0:
+            return self.pa_schema.empty_table()
+        raw_time = table.column(self.time_index)
+        time = pc.floor_temporal(raw_time, **self.bucket)
+        table = table.set_column(self.time_index, table.field(self.time_index), time)
+        if self.keeps_raw_time:
+            table = table.append_column(self.raw_time, raw_time)
+        specs = [
+            # Groups whose values are all null sum to 0, as on the server.
+            (*spec, pc.ScalarAggregateOptions(min_count=0))
+            if spec[1] == "sum"
+            else spec
+            for spec in self.specs
+        ]
+        grouped = table.group_by(self.groups, use_threads=False).aggregate(specs)
+        columns = [grouped.column(name) for name in self.groups]
+        columns.extend(
+            grouped.column(result).cast(result_type)
+            for _, result, result_type in self.results
+        )
+        return pa.Table.from_arrays(columns, schema=self.pa_schema)
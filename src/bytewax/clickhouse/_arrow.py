@@ -0,0 +1,430 @@
+"""Arrow conversion helpers for the ClickHouse sink.
+
+Rows arriving from the dataflow are buffered as they are, and each
+batch is converted to Arrow column by column when it is flushed. The
+shape of the rows is decided once per batch, so splitting rows into
+columns runs in C (`zip(*rows)`, `operator.attrgetter`,
+`pa.Table.from_pylist`) rather than a Python loop per value.
+Dictionary-typed columns are coded against dictionaries kept across
+batches, so low-cardinality values keep the same codes from batch to
+batch.
+
+Finished tables are serialized here too, a chunk at a time, with
+optional compression of the Arrow buffers and of the request body.
+"""
+
+import io
+import operator
+import threading
+from dataclasses import is_dataclass
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Sized,
+    Tuple,
+)
+
+import pyarrow as pa  # type: ignore
+
+# ClickHouse's own default for `low_cardinality_max_dictionary_size`.
+_MAX_DICTIONARY_SIZE = 8192
+
+
+class _Dictionary:
+    """Codes for the values of one column, in order of first appearance."""
+
+    def __init__(self, dict_type: pa.DictionaryType, max_size: int):
+        self.type = dict_type
+        # Codes must fit the index type.
+        self.max_size = min(max_size, 2 ** (dict_type.index_type.bit_width - 1))
+        self.codes: Dict[Any, int] = {}
+        self.values: List[Any] = []
+        self.array = pa.array(self.values, dict_type.value_type)
+
+    def recode(self, array: pa.DictionaryArray) -> pa.DictionaryArray:
+        import pyarrow.compute as pc  # type: ignore # noqa: PLC0415
+
+        local = array.dictionary.to_pylist()
+        new = [value for value in local if value not in self.codes]
+        if new and len(self.values) + len(new) > self.max_size:
+            if len(local) > self.max_size:
+                return array
+            self.codes, self.values, new = {}, [], local
+        if new:
+            for value in new:
+                self.codes[value] = len(self.values)
+                self.values.append(value)
+            self.array = pa.array(self.values, self.type.value_type)
+        # Only the batch's own, small, dictionary is looked up in
+        # Python; the codes of every row are mapped in one kernel.
+        mapping = pa.array([self.codes[value] for value in local], self.type.index_type)
+        return pa.DictionaryArray.from_arrays(
+            pc.take(mapping, array.indices), self.array
+        )
+
+
+class _DictionaryCache:
+    """Dictionaries of dictionary-typed columns, kept across batches.
+
+    pyarrow gives the dictionary array of every batch a dictionary of
+    its own, numbered in order of appearance in that batch. This
+    re-codes them against one dictionary per column that only grows,
+    so a value keeps its code across batches and the tables of a sink
+    batch share their dictionaries. Columns are told apart by name and
+    type, so one cache can serve the builders of several tables. Each
+    worker thread has its own dictionaries. One that would grow past
+    `max_size` values starts over.
+    """
+
+    def __init__(self, max_size: int = _MAX_DICTIONARY_SIZE):
+        self.max_size = max_size
+        self._local = threading.local()
+
+    def recode(self, name: str, array: pa.DictionaryArray) -> pa.DictionaryArray:
+        dictionaries: Dict[Tuple[str, pa.DataType], _Dictionary] = (
+            self._local.__dict__.setdefault("dictionaries", {})
+        )
+        key = (name, array.type)
+        dictionary = dictionaries.get(key)
+        if dictionary is None:
+            dictionary = dictionaries[key] = _Dictionary(array.type, self.max_size)
+        return dictionary.recode(array)
+
+
+class _ColumnarBuilder:
+    """Accumulate rows and convert them to a table of one Arrow schema.
+
+    Accepted row shapes:
+
+    - tuples and lists, positionally in schema order
+    - mappings, by field name; missing keys become nulls
+    - dataclass instances, by field name
+    - NumPy structured records, by field name, and plain 1-D NumPy
+      arrays, positionally
+
+    Rows are only checked when the batch is converted, by `finish`.
+    Batches whose rows are all of one type are split into columns in
+    bulk; mixed batches fall back to converting row by row.
+    """
+
+    def __init__(
+        self,
+        pa_schema: pa.Schema,
+        rows: Optional[List[Any]] = None,
+        dictionaries: Optional[_DictionaryCache] = None,
+    ):
+        self.pa_schema = pa_schema
+        self.dictionaries = dictionaries
+        self.names: List[str] = pa_schema.names
+        self.rows: List[Any] = rows if rows is not None else []
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def append(self, row: Any) -> None:
+        """Append a single row to the batch."""
+        self.rows.append(row)
+
+    def extend(self, rows: Iterable[Any]) -> None:
+        """Append many rows to the batch."""
+        self.rows.extend(rows)
+
+    def _check_widths(self, rows: Sequence[Sized]) -> None:
+        width = len(self.names)
+        if any(n != width for n in set(map(len, rows))):
+            row = next(row for row in rows if len(row) != width)
+            msg = f"row has {len(row)} values but schema has {width} fields: {row!r}"
+            raise ValueError(msg)
+
+    def _record_index(self, dtype: Any) -> List[int]:
+        try:
+            return [dtype.names.index(name) for name in self.names]
+        except ValueError as ex:
+            msg = f"record fields {dtype.names!r} do not cover {self.names!r}"
+            raise ValueError(msg) from ex
+
+    def _as_tuple(self, row: Any) -> Sequence[Any]:
+        """One row in schema order, for batches of mixed row types."""
+        if isinstance(row, (tuple, list)):
+            return row
+        if isinstance(row, Mapping):
+            return tuple(row.get(name) for name in self.names)
+        if hasattr(row, "dtype") and hasattr(row, "item"):
+            if row.dtype.names:
+                values = row.item()
+                return tuple(values[i] for i in self._record_index(row.dtype))
+            return row.tolist()
+        if is_dataclass(row) and not isinstance(row, type):
+            return tuple(getattr(row, name) for name in self.names)
+        msg = (
+            "rows must be tuples, lists, mappings, dataclasses or "
+            f"NumPy records; got {type(row)!r}"
+        )
+        raise TypeError(msg)
+
+    def _columns(self, rows: List[Any]) -> Sequence[Sequence[Any]]:
+        """Split rows of a single type into columns in schema order."""
+        first = rows[0]
+        if hasattr(first, "dtype") and hasattr(first, "item"):
+            import numpy as np  # noqa: PLC0415
+
+            if len(set(map(operator.attrgetter("dtype"), rows))) > 1:
+                rows = [self._as_tuple(row) for row in rows]
+            elif first.dtype.names:
+                index = self._record_index(first.dtype)
+                records = np.array(rows, dtype=first.dtype)
+                return [records[first.dtype.names[i]].tolist() for i in index]
+            else:
+                self._check_widths(rows)
+                return np.stack(rows).T.tolist()
+        elif is_dataclass(first) and not isinstance(first, type):
+            if len(self.names) == 1:
+                return [list(map(operator.attrgetter(self.names[0]), rows))]
+            rows = list(map(operator.attrgetter(*self.names), rows))
+        elif not isinstance(first, (tuple, list)):
+            rows = [self._as_tuple(row) for row in rows]
+        self._check_widths(rows)
+        return list(zip(*rows))
+
+    def _to_array(self, array: pa.Array, field: pa.Field) -> pa.Array:
+        if self.dictionaries is not None and pa.types.is_dictionary(field.type):
+            array = self.dictionaries.recode(field.name, array)
+        return array
+
+    def finish(self) -> pa.Table:
+        """Convert the buffered rows to a table and reset the builder.
+
+        Raises:
+            ValueError: If a row has the wrong number of values, or a
+            record lacks fields of the schema.
+            TypeError: If a row is of none of the accepted shapes.
+        """
+        rows = self.rows
+        if not rows:
+            return self.pa_schema.empty_table()
+        # Dictionary types are encoded by pyarrow while converting,
+        # without building the plain values first.
+        uniform = len(set(map(type, rows))) == 1
+        if uniform and isinstance(rows[0], Mapping):
+            columns: Sequence[pa.Array] = pa.RecordBatch.from_pylist(
+                rows, schema=self.pa_schema
+            ).columns
+        else:
+            if not uniform:
+                rows = [self._as_tuple(row) for row in rows]
+            columns = [
+                pa.array(column, type=field.type)
+                for column, field in zip(self._columns(rows), self.pa_schema)
+            ]
+        arrays = [
+            self._to_array(column, field)
+            for column, field in zip(columns, self.pa_schema)
+        ]
+        table = pa.Table.from_arrays(arrays, schema=self.pa_schema)
+        self.rows.clear()
+        return table
+
+
+def _as_table(value: Any, pa_schema: pa.Schema) -> pa.Table:
+    """Check an Arrow table or record batch against a schema.
+
+    Record batches are wrapped into a table and columns are re-ordered
+    to match the schema by name; neither copies any data.
+
+    Raises:
+        ValueError: If the fields of `value` do not match `pa_schema`.
+    """
+    if isinstance(value, pa.RecordBatch):
+        value = pa.Table.from_batches([value])
+    if not value.schema.equals(pa_schema):
+        if sorted(value.schema.names) == sorted(pa_schema.names):
+            value = value.select(pa_schema.names)
+        if not value.schema.equals(pa_schema):
+            msg = (
+                "Arrow schema does not match `pa_schema`; "
+                f"got:\n{value.schema}\nexpected:\n{pa_schema}"
+            )
+            raise ValueError(msg)
+    return value
+
+
+def _field_getter(
+    pa_schema: pa.Schema, names: Sequence[str]
+) -> Callable[[Any], Tuple[Any, ...]]:
+    """Build a function returning the named fields of a row.
+
+    Supports the same row shapes as `_ColumnarBuilder`.
+    """
+    positions = []
+    for name in names:
+        try:
+            positions.append(pa_schema.names.index(name))
+        except ValueError as ex:
+            msg = f"unknown column {name!r}; schema has {pa_schema.names!r}"
+            raise ValueError(msg) from ex
+
+    def getter(row: Any) -> Tuple[Any, ...]:
+        if isinstance(row, (tuple, list)):
+            return tuple(row[i] for i in positions)
+        if isinstance(row, Mapping):
+            return tuple(row.get(name) for name in names)
+        if hasattr(row, "dtype") and hasattr(row, "item"):
+            if row.dtype.names:
+                return tuple(row[name].item() for name in names)
+            return tuple(row[i].item() for i in positions)
+        return tuple(getattr(row, name) for name in names)
+
+    return getter
+
+
+class _DigestWriter:
+    """A write-only file that only hashes what is written to it."""
+
+    closed = False
+
+    def __init__(self) -> None:
+        import hashlib  # noqa: PLC0415
+
+        self.hash = hashlib.blake2b(digest_size=8)
+
+    def write(self, data: bytes) -> int:
+        self.hash.update(data)
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+
+def _content_digest(table: pa.Table) -> str:
+    """A digest of the values of a table, in row order.
+
+    Tables with equal values have equal digests however they are
+    chunked or sliced. Dictionary columns are hashed by value, so the
+    digest does not depend on the codes a worker's dictionaries gave
+    them.
+    """
+    columns = []
+    for column in table.columns:
+        plain = (
+            column.cast(column.type.value_type)
+            if pa.types.is_dictionary(column.type)
+            else column
+        )
+        # Copied into buffers of their own; the IPC writer can keep
+        # bytes of a sliced array outside the slice.
+        columns.append(pa.concat_arrays(plain.chunks or [pa.array([], plain.type)]))
+    table = pa.Table.from_arrays(columns, names=table.column_names)
+    writer = _DigestWriter()
+    with pa.ipc.new_stream(writer, table.schema) as stream:
+        stream.write_table(table)
+    return writer.hash.hexdigest()
+
+
+COMPRESSIONS = ("lz4", "zstd")
+
+
+def _check_compression(name: str, value: Optional[str]) -> None:
+    if value is not None and value not in COMPRESSIONS:
+        msg = f"`{name}` must be one of {COMPRESSIONS!r} or None; got {value!r}"
+        raise ValueError(msg)
+
+
+class _InsertStream:
+    """An `INSERT ... FORMAT ArrowStream` body, serialized as it is sent.
+
+    The table is written as record batches of an Arrow IPC stream, one
+    per chunk of the table or per `CHUNK_BYTES` of data if smaller, and
+    each is handed to the HTTP client straight away to be sent with
+    chunked transfer encoding. Only one serialized chunk is in memory
+    at a time, instead of a copy of the whole table.
+
+    `arrow_compression` compresses the IPC buffers themselves, which
+    ClickHouse decodes while reading the Arrow data. `compression`
+    compresses the whole body as one streamed frame, to be sent with a
+    matching `Content-Encoding` header.
+
+    Iterating again starts the body over, so a failed insert can be
+    retried with the same object.
+    """
+
+    CHUNK_BYTES = 4 * 1024 * 1024
+
+    def __init__(
+        self,
+        table: pa.Table,
+        arrow_compression: Optional[str] = None,
+        compression: Optional[str] = None,
+        level: Optional[int] = None,
+    ):
+        self.table = table
+        self.options = pa.ipc.IpcWriteOptions(
+            compression=(
+                pa.Codec(arrow_compression, compression_level=level)
+                if arrow_compression is not None
+                else None
+            )
+        )
+        self.compression = compression
+        self.level = level
+        self.bytes_sent = 0
+
+    def _ipc_chunks(self) -> Iterator[bytes]:
+        sink = io.BytesIO()
+
+        def drain() -> bytes:
+            data = sink.getvalue()
+            sink.seek(0)
+            sink.truncate()
+            return data
+
+        table = self.table
+        row_bytes = table.nbytes / max(table.num_rows, 1)
+        max_rows = max(1, int(self.CHUNK_BYTES / max(row_bytes, 1)))
+        with pa.ipc.new_stream(sink, table.schema, options=self.options) as w:
+            for batch in table.to_batches(max_chunksize=max_rows):
+                w.write_batch(batch)
+                yield drain()
+        # Closing the writer wrote the end-of-stream marker.
+        yield drain()
+
+    def _compressed_chunks(self) -> Iterator[bytes]:
+        chunks = self._ipc_chunks()
+        if self.compression == "lz4":
+            import lz4.frame  # type: ignore # noqa: PLC0415
+
+            lz4_compressor = lz4.frame.LZ4FrameCompressor(
+                compression_level=self.level or 0
+            )
+            yield lz4_compressor.begin()
+            for chunk in chunks:
+                yield lz4_compressor.compress(chunk)
+            yield lz4_compressor.flush()
+        elif self.compression == "zstd":
+            import zstandard  # type: ignore # noqa: PLC0415
+
+            zstd_compressor = zstandard.ZstdCompressor(
+                level=self.level or 3
+            ).compressobj()
+            for chunk in chunks:
+                yield zstd_compressor.compress(chunk)
+            yield zstd_compressor.flush()
+        else:
+            yield from chunks
+
+    def __iter__(self) -> Iterator[bytes]:
+        self.bytes_sent = 0
+        for chunk in self._compressed_chunks():
+            # An empty chunk would end a chunked request early.
+            if chunk:
+                self.bytes_sent += len(chunk)
+                yield chunk
@@ -0,0 +1,114 @@
+"""Table metadata of a ClickHouse sink, and its cache on local disk.
+
+The sink checks, and if needed creates, its table when the dataflow
+is built rather than when it is defined. What it learns about the
+table, the shards of its cluster, the table's engine, partition key and
+columns, is a `_TableMetadata`, which `_MetadataCache` keeps in a JSON
+file per table so that restarts within its TTL skip the metadata queries.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple, Union
+
+from bytewax.clickhouse._cluster import ClusterShard
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class _TableMetadata:
+    """What the sink knows about its table.
+
+    `columns` are the `name`, `type` and `default_kind` of each
+    column, as in `system.columns`. `shards` are those of the cluster
+    the sink inserts into, if any. `partition_key` is the expression
+    of `PARTITION BY`, as in `system.tables`.
+    """
+
+    engine: str
+    columns: List[Tuple[str, str, str]]
+    shards: Optional[List[ClusterShard]] = None
+    partition_key: str = ""
+
+    def to_json(self) -> dict:
+        return {
+            "engine": self.engine,
+            "columns": [list(column) for column in self.columns],
+            "shards": (
+                [[s.host, s.port, s.weight] for s in self.shards]
+                if self.shards is not None
+                else None
+            ),
+            "partition_key": self.partition_key,
+        }
+
+    @classmethod
+    def from_json(cls, data: dict) -> "_TableMetadata":
+        shards = data["shards"]
+        return cls(
+            data["engine"],
+            [(name, ch_type, kind) for name, ch_type, kind in data["columns"]],
+            [ClusterShard(*shard) for shard in shards] if shards is not None else None,
+            data["partition_key"],
+        )
+
+
+class _MetadataCache:
+    """Table metadata kept in `directory` for `ttl` seconds.
+
+    Entries are keyed by everything that identifies the table: server,
+    database, table and cluster. Unreadable or expired entries count
+    as missing. Files are replaced atomically, so processes sharing
+    the directory never read a partial entry.
+    """
+
+    def __init__(self, directory: Union[str, Path], ttl: float):
+        self.directory = Path(directory)
+        self.ttl = ttl
+
+    def _path(self, key: Sequence[object]) -> Path:
+        digest = hashlib.sha256(repr(tuple(key)).encode()).hexdigest()[:32]
+        return self.directory / f"{digest}.json"
+
+    def load(self, key: Sequence[object]) -> Optional[_TableMetadata]:
+        path = self._path(key)
+        try:
+            with path.open() as f:
+                data = json.load(f)
+            if data["key"] != repr(tuple(key)):
+                return None
+            age = time.time() - data["cached_at"]
+            if not 0 <= age < self.ttl:
+                return None
+            metadata = _TableMetadata.from_json(data["metadata"])
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError) as ex:
+            logger.warning(f"Ignoring unreadable table metadata in {path}: {ex}")
+            return None
+        logger.info(f"Using table metadata cached {age:.0f}s ago in {path}")
+        return metadata
+
+    def store(self, key: Sequence[object], metadata: _TableMetadata) -> None:
+        path = self._path(key)
+        data = {
+            "key": repr(tuple(key)),
+            "cached_at": time.time(),
+            "metadata": metadata.to_json(),
+        }
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            with tmp.open("w") as f:
+                json.dump(data, f)
+            os.replace(tmp, path)
+        except OSError as ex:
+            # The cache only saves queries; never fail the flow on it.
+            logger.warning(f"Could not cache table metadata in {path}: {ex}")
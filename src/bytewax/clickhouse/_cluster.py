@@ -0,0 +1,137 @@
+"""Direct-to-shard routing for the ClickHouse sink.
+
+Instead of inserting into a `Distributed` table, which forwards rows
+to the shards from one node, the sink can learn the shards of a
+cluster and insert each row straight into the local table of its
+shard. Rows are assigned to shards with weights like a `Distributed`
+table does, by a hash of sharding key columns computed in the sink.
+"""
+
+import logging
+import zlib
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import pyarrow as pa  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class ClusterShard:
+    """A shard of a cluster the sink inserts into directly.
+
+    `host` is one replica of the shard; with `internal_replication`
+    the shard's other replicas fetch the inserted parts from it. `port`
+    defaults to the port of the sink. Shards get rows in proportion to
+    their `weight`, as with the weights of a `Distributed` table.
+    """
+
+    host: str
+    port: Optional[int] = None
+    weight: int = 1
+
+
+def _cluster_shards(
+    client: Any, cluster: str, port: Optional[int]
+) -> List[ClusterShard]:
+    """Read the shards of a cluster from `system.clusters`.
+
+    The first replica of each shard is used. `port` replaces the ports
+    listed there, which are those of the native protocol.
+
+    Raises:
+        ValueError: If the server does not know the cluster.
+    """
+    query = f"""SELECT shard_num, shard_weight, host_name, port
+            FROM system.clusters WHERE cluster = '{cluster}'
+            ORDER BY shard_num, replica_num"""
+    shards: Dict[int, ClusterShard] = {}
+    for shard_num, weight, host, native_port in client.query(query).result_rows:
+        if shard_num not in shards:
+            shards[shard_num] = ClusterShard(
+                host, port if port is not None else native_port, weight
+            )
+    if not shards:
+        msg = f"cluster '{cluster}' is not in `system.clusters`"
+        raise ValueError(msg)
+    logger.info(f"Shards of cluster '{cluster}': {list(shards.values())}")
+    return list(shards.values())
+
+
+def _key_bytes(value: Any) -> bytes:
+    if isinstance(value, str):
+        return value.encode()
+    if isinstance(value, bytes):
+        return value
+    return repr(value).encode()
+
+
+def _row_hashes(table: pa.Table, columns: Sequence[str]) -> pa.Array:
+    """A 32-bit hash of the `columns` of each row, as `uint64`.
+
+    Each distinct value is hashed once in Python; rows get the hashes
+    of their values with one `take` per column.
+    """
+    import pyarrow.compute as pc  # type: ignore # noqa: PLC0415
+
+    hashes = None
+    for name in columns:
+        column = table.column(name)
+        if pa.types.is_dictionary(column.type):
+            column = column.cast(column.type.value_type)
+        encoded = pc.dictionary_encode(column.combine_chunks())
+        distinct = pa.array(
+            [zlib.crc32(_key_bytes(value)) for value in encoded.dictionary.to_pylist()],
+            pa.uint64(),
+        )
+        column_hashes = pc.fill_null(pc.take(distinct, encoded.indices), 0)
+        if hashes is None:
+            hashes = column_hashes
+        else:
+            hashes = pc.bit_wise_and(
+                pc.add(pc.multiply(hashes, 31), column_hashes), 0xFFFFFFFF
+            )
+    return hashes
+
+
+class _ShardRouter:
+    """Split tables into the rows for each shard.
+
+    Like a `Distributed` table, each shard owns `weight` consecutive
+    slots, and a row goes to slot `hash % total weight`. Without
+    `sharding_key` whole tables go to one slot after the other, or to
+    the slot of the sequence number given, so tables replayed with the
+    same number go to the same shard.
+    """
+
+    def __init__(
+        self, shards: Sequence[ClusterShard], sharding_key: Optional[Sequence[str]]
+    ):
+        slots = [i for i, shard in enumerate(shards) for _ in range(shard.weight)]
+        if not slots:
+            msg = "shards of a cluster need a total weight of at least 1"
+            raise ValueError(msg)
+        self.slots = pa.array(slots, pa.int32())
+        self.sharding_key = sharding_key
+        self._next_slot = 0
+
+    def split(
+        self, table: pa.Table, seq: Optional[int] = None
+    ) -> List[Tuple[int, pa.Table]]:
+        if not self.sharding_key:
+            if seq is None:
+                seq = self._next_slot
+                self._next_slot += 1
+            return [(self.slots[seq % len(self.slots)].as_py(), table)]
+
+        import pyarrow.compute as pc  # type: ignore # noqa: PLC0415
+
+        hashes = _row_hashes(table, self.sharding_key)
+        total = pa.scalar(len(self.slots), pa.uint64())
+        slot = pc.subtract(hashes, pc.multiply(pc.divide(hashes, total), total))
+        row_shards = pc.take(self.slots, slot)
+        return [
+            (shard, table.filter(pc.equal(row_shards, shard)))
+            for shard in sorted(pc.unique(row_shards).to_pylist())
+        ]
@@ -0,0 +1,364 @@
+"""Table definitions for tables created by the ClickHouse sink.
+
+`TableSpec` describes the MergeTree layout of a table the sink creates
+when it does not exist yet: its engine, sorting and primary key,
+partitioning, data-skipping indexes, column codecs, TTL and settings.
+
+Its columns can also be derived from the Arrow schema of the dataflow,
+adjusted by a `ColumnHint` per column, so the two schemas cannot drift
+apart.
+"""
+
+import re
+from dataclasses import dataclass, field
+from typing import AbstractSet, Any, Mapping, Optional, Sequence
+
+import pyarrow as pa  # type: ignore
+from bytewax.clickhouse._schema import _split_top_level
+
+_VERSIONED_ENGINES = ("ReplacingMergeTree", "ReplicatedReplacingMergeTree")
+
+_INTEGER_TYPES = {
+    8: "Int8",
+    16: "Int16",
+    32: "Int32",
+    64: "Int64",
+}
+
+# Codecs for columns whose values mostly grow, like event times, and
+# for floats that change slowly, like gauges.
+_MONOTONIC_CODEC = "Delta, ZSTD"
+_GAUGE_CODEC = "Gorilla"
+
+
+@dataclass(frozen=True)
+class SkipIndex:
+    """A data-skipping index, as in `INDEX name expression TYPE type`.
+
+    `type` is the index type with its arguments, e.g. `"minmax"`,
+    `"set(100)"` or `"bloom_filter(0.01)"`. `granularity` is the
+    number of granules each index entry covers.
+    """
+
+    name: str
+    expression: str
+    type: str
+    granularity: int = 1
+
+    def definition(self) -> str:
+        return (
+            f"INDEX {self.name} {self.expression} TYPE {self.type} "
+            f"GRANULARITY {self.granularity}"
+        )
+
+
+@dataclass(frozen=True)
+class TableSpec:
+    """How the sink creates its table when it does not exist.
+
+    The defaults create the same table as the plain `order_by` option
+    of the sink: a `ReplacingMergeTree` sorted by `order_by`.
+
+    Partition time series by a coarse time bucket, e.g.
+    `partition_by="toYYYYMM(ts)"`, so merges stay within a partition
+    and old data can be dropped a partition at a time by `ttl`. With
+    `version`, `ReplacingMergeTree` keeps the row with the highest
+    version instead of the last inserted one. `primary_key` may be a
+    prefix of `order_by` to keep the primary index small.
+
+    `codecs` maps column names to the codecs to compress them with,
+    e.g. `{"ts": "Delta, ZSTD"}`. `settings` are MergeTree settings
+    such as `index_granularity`.
+    """
+
+    order_by: str = ""
+    engine: str = "ReplacingMergeTree"
+    version: Optional[str] = None
+    partition_by: Optional[str] = None
+    primary_key: Optional[str] = None
+    indexes: Sequence[SkipIndex] = ()
+    codecs: Mapping[str, str] = field(default_factory=dict)
+    ttl: Optional[str] = None
+    settings: Mapping[str, Any] = field(default_factory=dict)
+
+    def __post_init__(self) -> None:
+        if self.version is not None and self.engine not in _VERSIONED_ENGINES:
+            msg = (
+                f"`version` requires one of {_VERSIONED_ENGINES!r} as "
+                f"`engine`; got {self.engine!r}"
+            )
+            raise ValueError(msg)
+
+    @property
+    def engine_name(self) -> str:
+        return self.engine.split("(", 1)[0].strip()
+
+    def _key_columns(self) -> AbstractSet[str]:
+        """Names used in the sorting, primary or partition key, or version.
+
+        MergeTree tables can't have `Nullable` columns there, so these
+        are never derived as `Nullable`. Function names in the key
+        expressions are included too, but match no column.
+        """
+        keys = (self.order_by, self.primary_key, self.partition_by, self.version)
+        return {
+            match.group(2) if match.group(2) is not None else match.group(0)
+            for expression in keys
+            if expression
+            for match in re.finditer(
+                r"([`\"])(.*?)\1|[A-Za-z_][A-Za-z0-9_]*", expression
+            )
+        }
+
+    def _engine_clause(self) -> str:
+        if "(" in self.engine:
+            return self.engine
+        return f"{self.engine}({self.version or ''})"
+
+    def _columns(self, schema: str) -> str:
+        definitions = [d for d in _split_top_level(schema) if d]
+        unknown = set(self.codecs)
+        for i, definition in enumerate(definitions):
+            name = _column_name(definition)
+            codec = self.codecs.get(name)
+            if codec is None:
+                continue
+            unknown.discard(name)
+            if "CODEC(" in definition.upper().replace(" ", ""):
+                msg = f"column `{name}` already has a codec in the schema"
+                raise ValueError(msg)
+            definitions[i] = f"{definition} CODEC({codec})"
+        if unknown:
+            msg = f"`codecs` names columns not in the schema: {sorted(unknown)!r}"
+            raise ValueError(msg)
+        definitions.extend(index.definition() for index in self.indexes)
+        return ",\n    ".join(definitions)
+
+    def create_query(self, database: str, table_name: str, schema: str) -> str:
+        """The `CREATE TABLE` statement for a table of these columns.
+
+        Args:
+            database (str): Database of the table.
+            table_name (str): Name of the table.
+            schema (str): Column definitions, separated by commas.
+
+        Returns:
+            str: The statement.
+
+        Raises:
+            ValueError: If `codecs` names a column that is not in
+            `schema`, or one that already has a codec.
+        """
+        clauses = [
+            f"CREATE TABLE {database}.{table_name} (",
+            f"    {self._columns(schema)}",
+            f") ENGINE = {self._engine_clause()}",
+        ]
+        if self.partition_by:
+            clauses.append(f"PARTITION BY {self.partition_by}")
+        if self.primary_key:
+            clauses.append(f"PRIMARY KEY {self.primary_key}")
+        clauses.append(f"ORDER BY tuple({self.order_by})")
+        if self.ttl:
+            clauses.append(f"TTL {self.ttl}")
+        if self.settings:
+            settings = ", ".join(
+                f"{name} = {_setting_value(value)}"
+                for name, value in self.settings.items()
+            )
+            clauses.append(f"SETTINGS {settings}")
+        return "\n".join(clauses)
+
+
+def _column_name(definition: str) -> str:
+    quoted = re.match(r'\s*([`"])((?:\\.|(?!\1).)*)\1', definition)
+    if quoted is not None:
+        return re.sub(r"\\(.)", r"\1", quoted.group(2))
+    return definition.split(None, 1)[0]
+
+
+def _setting_value(value: Any) -> str:
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, (int, float)):
+        return str(value)
+    escaped = str(value).replace("\\", "\\\\").replace("'", "\\'")
+    return f"'{escaped}'"
+
+
+@dataclass(frozen=True)
+class ColumnHint:
+    """Adjust the ClickHouse column derived from an Arrow field.
+
+    Columns are `Nullable` when their Arrow field is nullable, except
+    for arrays and columns in the table's key, which can't be. Set
+    `nullable=False` to store nulls as the type's default instead, with
+    a warning the first time in each column, or `nullable=True` for a
+    non-nullable field. `low_cardinality` makes a string column
+    `LowCardinality(String)`, which fields of dictionary type always
+    are.
+
+    Time and date columns are compressed with `Delta, ZSTD`, which
+    suits values that mostly grow, as do integers with `monotonic`;
+    set `monotonic=False` to turn that off. Floats with `gauge`, which
+    change slowly, are compressed with `Gorilla`. `codec` replaces the
+    derived codec and `type` the whole derived type.
+    """
+
+    type: Optional[str] = None
+    codec: Optional[str] = None
+    nullable: Optional[bool] = None
+    low_cardinality: bool = False
+    monotonic: Optional[bool] = None
+    gauge: bool = False
+
+
+def _quote_name(name: str) -> str:
+    if re.fullmatch(r"[A-Za-z_][A-Za-z0-9_]*", name):
+        return name
+    escaped = name.replace("\\", "\\\\").replace("`", "\\`")
+    return f"`{escaped}`"
+
+
+def _ch_type(data_type: pa.DataType) -> Optional[str]:
+    """The ClickHouse type storing values of an Arrow type as-is."""
+    t = pa.types
+    if t.is_boolean(data_type):
+        return "Bool"
+    if t.is_integer(data_type):
+        name = _INTEGER_TYPES[data_type.bit_width]
+        return name if t.is_signed_integer(data_type) else f"U{name}"
+    if t.is_float32(data_type):
+        return "Float32"
+    if t.is_float64(data_type):
+        return "Float64"
+    if t.is_string(data_type) or t.is_large_string(data_type):
+        return "String"
+    if t.is_binary(data_type) or t.is_large_binary(data_type):
+        return "String"
+    if t.is_date(data_type):
+        return "Date32"
+    if t.is_timestamp(data_type):
+        tz = f", '{data_type.tz}'" if data_type.tz else ""
+        if data_type.unit == "s":
+            return f"DateTime({tz[2:]})" if tz else "DateTime"
+        precision = {"ms": 3, "us": 6, "ns": 9}[data_type.unit]
+        return f"DateTime64({precision}{tz})"
+    if t.is_decimal(data_type):
+        return f"Decimal({data_type.precision}, {data_type.scale})"
+    if t.is_list(data_type) or t.is_large_list(data_type):
+        item = _ch_type(data_type.value_type)
+        return f"Array({item})" if item is not None else None
+    if t.is_fixed_size_list(data_type):
+        item = _ch_type(data_type.value_type)
+        return f"Array({item})" if item is not None else None
+    return None
+
+
+def _column_definition(
+    arrow_field: pa.Field, hint: ColumnHint, key: bool = False
+) -> str:
+    t = pa.types
+    data_type = arrow_field.type
+    low_cardinality = hint.low_cardinality
+    if t.is_dictionary(data_type):
+        data_type = data_type.value_type
+        low_cardinality = low_cardinality or t.is_string(data_type)
+    array = (
+        t.is_list(data_type)
+        or t.is_large_list(data_type)
+        or t.is_fixed_size_list(data_type)
+    )
+    temporal = t.is_timestamp(data_type) or t.is_date(data_type)
+
+    ch_type = hint.type
+    if ch_type is None:
+        ch_type = _ch_type(data_type)
+        if ch_type is None:
+            msg = (
+                f"no ClickHouse type for `{arrow_field.name}` of type "
+                f"{arrow_field.type}; give one with `ColumnHint(type=...)`"
+            )
+            raise ValueError(msg)
+        nullable = hint.nullable
+        if nullable is None:
+            nullable = arrow_field.nullable and not array and not key
+        elif nullable and array:
+            msg = f"`{arrow_field.name}` is an `Array`, which can't be `Nullable`"
+            raise ValueError(msg)
+        if nullable:
+            ch_type = f"Nullable({ch_type})"
+        if low_cardinality:
+            ch_type = f"LowCardinality({ch_type})"
+
+    if hint.monotonic and not (t.is_integer(data_type) or temporal):
+        # Delta only encodes fixed-size integers, dates and times.
+        msg = (
+            f"`monotonic` needs an integer, date or time field; "
+            f"`{arrow_field.name}` is {arrow_field.type}"
+        )
+        raise ValueError(msg)
+    if hint.gauge and not t.is_floating(data_type):
+        msg = f"`gauge` needs a float field; `{arrow_field.name}` is {arrow_field.type}"
+        raise ValueError(msg)
+    codec = hint.codec
+    if codec is None and hint.type is None:
+        if hint.monotonic or (hint.monotonic is None and temporal):
+            codec = _MONOTONIC_CODEC
+        elif hint.gauge:
+            codec = _GAUGE_CODEC
+    definition = f"{_quote_name(arrow_field.name)} {ch_type}"
+    return f"{definition} CODEC({codec})" if codec else definition
+
+
+def _column_definitions(
+    pa_schema: pa.Schema,
+    hints: Optional[Mapping[str, ColumnHint]] = None,
+    key_columns: AbstractSet[str] = frozenset(),
+) -> str:
+    """Column definitions of a table for tables of `pa_schema`.
+
+    Args:
+        pa_schema (pa.Schema): Schema of the tables to be inserted.
+        hints (Optional[Mapping[str, ColumnHint]]): Hints by field name.
+        key_columns (AbstractSet[str]): Names used in the table's key,
+            whose columns are not made `Nullable` unless hinted.
+
+    Returns:
+        str: The column definitions, separated by commas.
+
+    Raises:
+        ValueError: If a hint names a field not in `pa_schema`, a
+        field has no ClickHouse type and no hinted one, an array is
+        hinted `nullable`, or a field does not fit its `monotonic` or
+        `gauge` hint.
+    """
+    hints = hints or {}
+    unknown = set(hints) - set(pa_schema.names)
+    if unknown:
+        msg = f"`column_hints` names fields not in `pa_schema`: {sorted(unknown)!r}"
+        raise ValueError(msg)
+    return ",\n".join(
+        _column_definition(
+            arrow_field,
+            hints.get(arrow_field.name, ColumnHint()),
+            arrow_field.name in key_columns,
+        )
+        for arrow_field in pa_schema
+    )
+
+
+@dataclass(frozen=True)
+class OutputTable:
+    """One of the tables written by a multi-table ClickHouse sink.
+
+    `pa_schema` is the Arrow schema of its rows. `ch_schema`,
+    `table_spec` and `column_hints` define the table if it needs to be
+    created, as the arguments of the same names of `chop.output`;
+    without `ch_schema` the columns are derived from `pa_schema`.
+    """
+
+    pa_schema: pa.Schema
+    ch_schema: Optional[str] = None
+    table_spec: Optional[TableSpec] = None
+    column_hints: Optional[Mapping[str, ColumnHint]] = None
@@ -0,0 +1,153 @@
+"""Runtime metrics and tracing for the ClickHouse sink.
+
+Metrics are registered in the global Prometheus registry, which
+Bytewax serves with its own metrics on the dataflow API, and are
+labelled with the step ID and, for the sink, the partition.
+
+Inserts are also recorded as OpenTelemetry spans when
+`opentelemetry-api` is installed. Spans are dropped unless the
+dataflow configures a tracer provider.
+"""
+
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Any, Dict, Iterator
+
+_METRIC_NAMES = (
+    "BATCH_ROWS",
+    "CONVERSION_SECONDS",
+    "CONCAT_SECONDS",
+    "INSERT_SECONDS",
+    "ROWS_INSERTED",
+    "BYTES_INSERTED",
+    "SERVER_WRITTEN_ROWS",
+    "INSERT_RETRIES",
+    "QUEUE_DEPTH",
+    "SPILL_BYTES",
+)
+
+_BATCH_ROWS_BUCKETS = (
+    10,
+    100,
+    1_000,
+    5_000,
+    10_000,
+    50_000,
+    100_000,
+    500_000,
+    1_000_000,
+)
+
+_lock = threading.Lock()
+
+
+def _register() -> Dict[str, Any]:
+    from prometheus_client import Counter, Gauge, Histogram  # noqa: PLC0415
+
+    # Global, since the Prometheus REGISTRY is also global.
+    return {
+        "BATCH_ROWS": Histogram(
+            "bytewax_clickhouse_batch_rows",
+            "Rows in each batch emitted for insertion.",
+            ["step_id"],
+            buckets=_BATCH_ROWS_BUCKETS,
+        ),
+        "CONVERSION_SECONDS": Histogram(
+            "bytewax_clickhouse_conversion_seconds",
+            "Time spent converting buffered records into an Arrow table.",
+            ["step_id"],
+        ),
+        "CONCAT_SECONDS": Histogram(
+            "bytewax_clickhouse_concat_seconds",
+            "Time spent concatenating the tables of a sink batch.",
+            ["step_id", "partition"],
+        ),
+        "INSERT_SECONDS": Histogram(
+            "bytewax_clickhouse_insert_seconds",
+            "Latency of inserts into ClickHouse, including retries.",
+            ["step_id", "partition"],
+            buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+        ),
+        "ROWS_INSERTED": Counter(
+            "bytewax_clickhouse_rows_inserted",
+            "Rows sent to ClickHouse.",
+            ["step_id", "partition"],
+        ),
+        "BYTES_INSERTED": Counter(
+            "bytewax_clickhouse_bytes_inserted",
+            "Bytes of insert payloads sent to ClickHouse, after compression.",
+            ["step_id", "partition"],
+        ),
+        "SERVER_WRITTEN_ROWS": Counter(
+            "bytewax_clickhouse_server_written_rows",
+            "Rows ClickHouse reported as written by inserts.",
+            ["step_id", "partition"],
+        ),
+        "INSERT_RETRIES": Counter(
+            "bytewax_clickhouse_insert_retries",
+            "Inserts retried after a transient error.",
+            ["step_id", "partition"],
+        ),
+        "QUEUE_DEPTH": Gauge(
+            "bytewax_clickhouse_queue_depth",
+            "Batches queued for or being inserted by background senders.",
+            ["step_id", "partition"],
+        ),
+        "SPILL_BYTES": Gauge(
+            "bytewax_clickhouse_spill_bytes",
+            "Bytes of batches in the spill directory waiting to be inserted.",
+            ["step_id", "partition"],
+        ),
+    }
+
+
+def __getattr__(name: str) -> Any:
+    """Register all metrics when the first is used (PEP 562).
+
+    Defining a dataflow then does not import `prometheus_client`.
+    """
+    if name not in _METRIC_NAMES:
+        msg = f"module {__name__!r} has no attribute {name!r}"
+        raise AttributeError(msg)
+    with _lock:
+        if name not in globals():
+            globals().update(_register())
+    return globals()[name]
+
+
+@lru_cache(maxsize=None)
+def _trace() -> Any:
+    """The `opentelemetry.trace` module, or `None` if not installed."""
+    try:
+        from opentelemetry import trace  # type: ignore # noqa: PLC0415
+    except ImportError:
+        return None
+    return trace
+
+
+@lru_cache(maxsize=None)
+def _tracer() -> Any:
+    trace = _trace()
+    return trace.get_tracer("bytewax.clickhouse") if trace is not None else None
+
+
+@contextmanager
+def _span(name: str, **attributes: Any) -> Iterator[Any]:
+    """Record an OpenTelemetry span, if tracing is available.
+
+    Yields the span, or `None` without `opentelemetry-api`.
+    """
+    tracer = _tracer()
+    if tracer is None:
+        yield None
+        return
+    with tracer.start_as_current_span(name, attributes=attributes) as span:
+        yield span
+
+
+def _span_event(name: str, **attributes: Any) -> None:
+    """Add an event to the current OpenTelemetry span, if any."""
+    trace = _trace()
+    if trace is not None:
+        trace.get_current_span().add_event(name, attributes)
@@ -0,0 +1,171 @@
+"""Native TCP protocol transport for the ClickHouse sink.
+
+Wraps a `clickhouse_driver.Client` in the subset of the
+`clickhouse_connect` client interface the sink uses, so the rest of
+the sink does not need to know which transport is in use. Requires
+the optional `clickhouse-driver` dependency.
+
+Inserts hand the driver NumPy arrays, which it writes a column at a
+time without converting each value to a Python object, when every
+column of the table has a type its NumPy columns support. Other
+tables are converted to Python objects first.
+"""
+
+import uuid
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+
+import pyarrow as pa  # type: ignore
+from pyarrow import Table  # type: ignore
+
+if TYPE_CHECKING:
+    from clickhouse_connect.driver.summary import QuerySummary
+
+
+@dataclass
+class _QueryResult:
+    result_rows: List[Any]
+
+
+def _has_numpy_support(data_type: pa.DataType) -> bool:
+    t = pa.types
+    if t.is_dictionary(data_type):
+        value_type = data_type.value_type
+        return t.is_string(value_type) or t.is_integer(value_type)
+    return (
+        t.is_integer(data_type)
+        or t.is_floating(data_type)
+        or t.is_boolean(data_type)
+        or t.is_string(data_type)
+        or t.is_large_string(data_type)
+        or t.is_timestamp(data_type)
+        or t.is_date32(data_type)
+    )
+
+
+def _to_numpy(array: pa.Array) -> Any:
+    import numpy as np  # noqa: PLC0415
+
+    data_type = array.type
+    if pa.types.is_timestamp(data_type) and data_type.tz is not None:
+        # Plain `datetime64` values would be taken as local times of
+        # the column's time zone.
+        import pandas as pd  # type: ignore # noqa: PLC0415
+
+        return pd.DatetimeIndex(array.to_pandas())
+    if pa.types.is_date32(data_type) or (
+        array.null_count > 0 and not pa.types.is_timestamp(data_type)
+    ):
+        # Dates have no NumPy type the driver reads, and NumPy would
+        # turn the nulls of other columns into floats or `NaN`s.
+        values = np.empty(len(array), dtype=object)
+        values[:] = array.to_pylist()
+        return values
+    # Copies only strings, booleans and dictionaries.
+    return array.to_numpy(zero_copy_only=False)
+
+
+def _numpy_columns(table: Table) -> Optional[List[Any]]:
+    """The columns of a table as the driver's NumPy columns write them.
+
+    Returns `None` if a column has a type without NumPy support, or
+    floats with `NaN`s, which the driver would write as nulls.
+    """
+    import pyarrow.compute as pc  # type: ignore # noqa: PLC0415
+
+    columns = []
+    for column in table.columns:
+        if not _has_numpy_support(column.type):
+            return None
+        array = column.combine_chunks()
+        if pa.types.is_floating(array.type) and pc.any(pc.is_nan(array)).as_py():
+            return None
+        columns.append(_to_numpy(array))
+    return columns
+
+
+class _NativeClient:
+    """A native protocol connection to a single ClickHouse server.
+
+    Connections are not thread safe, so unlike HTTP clients these are
+    never shared between threads.
+
+    The driver's NumPy support needs NumPy and pandas, which the
+    `native` extra installs; without them every table is converted to
+    Python objects.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        username: str,
+        password: str,
+        database: str,
+        compression: Optional[str] = None,
+    ):
+        try:
+            from clickhouse_driver import Client  # type: ignore # noqa: PLC0415
+        except ImportError as ex:
+            msg = (
+                "the native transport requires `clickhouse-driver`; "
+                "install `bytewax-clickhouse[native]`"
+            )
+            raise ImportError(msg) from ex
+
+        self.client = Client(
+            host=host,
+            port=port,
+            user=username,
+            password=password,
+            database=database,
+            compression=compression or False,
+        )
+        try:
+            import pandas  # type: ignore # noqa: F401, PLC0415
+        except ImportError:
+            self.use_numpy = False
+        else:
+            self.use_numpy = True
+
+    def command(self, query: str, settings: Optional[Dict[str, Any]] = None) -> Any:
+        rows = self.client.execute(query, settings=settings)
+        if not rows:
+            return None
+        if len(rows) == 1 and len(rows[0]) == 1:
+            return rows[0][0]
+        return list(rows[0])
+
+    def query(
+        self, query: str, settings: Optional[Dict[str, Any]] = None
+    ) -> _QueryResult:
+        return _QueryResult(self.client.execute(query, settings=settings))
+
+    def insert_arrow(
+        self,
+        table: str,
+        arrow_table: Table,
+        settings: Optional[Dict[str, Any]] = None,
+    ) -> "QuerySummary":
+        """Insert a table as Native blocks, one column at a time."""
+        from clickhouse_connect.driver.summary import QuerySummary  # noqa: PLC0415
+
+        names = ", ".join(f"`{name}`" for name in arrow_table.column_names)
+        data = _numpy_columns(arrow_table) if self.use_numpy else None
+        use_numpy = data is not None
+        if data is None:
+            data = [column.to_pylist() for column in arrow_table.columns]
+        query_id = str(uuid.uuid4())
+        written_rows = self.client.execute(
+            f"INSERT INTO {table} ({names}) VALUES",
+            data,
+            columnar=True,
+            settings={**(settings or {}), "use_numpy": use_numpy},
+            query_id=query_id,
+        )
+        return QuerySummary(
+            {"written_rows": str(written_rows or 0), "query_id": query_id}
+        )
+
+    def close(self) -> None:
+        self.client.disconnect()
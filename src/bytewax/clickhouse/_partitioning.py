@@ -0,0 +1,205 @@
+"""Group inserted rows by the `PARTITION BY` key of the table.
+
+ClickHouse writes at least one part per table partition an insert
+touches, so a batch spanning many days or tenants makes many small
+parts. The sink evaluates the table's partition key, as listed in
+`system.tables.partition_key`, on each batch with Arrow kernels, and
+buffers rows per partition until there are enough of them to make one
+large part.
+
+Columns and the usual time buckets, such as `toYYYYMM(ts)` or
+`toMonday(ts)`, are computed here. Rows only need to be grouped the
+way the server partitions them, not to get its values, so
+`toYYYYMM(ts)` groups by the start of the month. Tables partitioned by
+other expressions are inserted without grouping.
+"""
+
+import logging
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import pyarrow as pa  # type: ignore
+from bytewax.clickhouse._schema import _split_top_level, _split_type
+
+logger = logging.getLogger(__name__)
+
+# Functions of a time or date column, by the unit and options of
+# `floor_temporal` that groups rows the same way. Time zones are those
+# of the Arrow column.
+_TIME_BUCKETS: Dict[str, Tuple[str, Dict[str, Any]]] = {
+    "toStartOfHour": ("hour", {}),
+    "toDate": ("day", {}),
+    "toDate32": ("day", {}),
+    "toStartOfDay": ("day", {}),
+    "toYYYYMMDD": ("day", {}),
+    "toMonday": ("week", {"week_starts_monday": True}),
+    "toStartOfMonth": ("month", {}),
+    "toYYYYMM": ("month", {}),
+    "toStartOfQuarter": ("quarter", {}),
+    "toStartOfYear": ("year", {}),
+    "toYear": ("year", {}),
+}
+
+_KeyFunction = Callable[[pa.Table], pa.ChunkedArray]
+
+
+def _column(name: str) -> Optional[str]:
+    name = name.strip()
+    if name.startswith("`") and name.endswith("`"):
+        return name[1:-1]
+    return name if name.isidentifier() else None
+
+
+def _key_function(expression: str, pa_schema: pa.Schema) -> Optional[_KeyFunction]:
+    import pyarrow.compute as pc  # type: ignore # noqa: PLC0415
+
+    column = _column(expression)
+    if column is not None:
+        if column not in pa_schema.names:
+            return None
+        return lambda table: table.column(column)
+
+    name, args = _split_type(expression)
+    column = _column(args[0]) if args else None
+    if column is None or column not in pa_schema.names:
+        return None
+    data_type = pa_schema.field(column).type
+    if name in _TIME_BUCKETS and len(args) == 1:
+        if not (pa.types.is_timestamp(data_type) or pa.types.is_date(data_type)):
+            return None
+        unit, options = _TIME_BUCKETS[name]
+        return lambda table: pc.floor_temporal(
+            table.column(column), unit=unit, **options
+        )
+    if name == "intDiv" and len(args) == 2 and args[1].strip().isdigit():
+        if not pa.types.is_integer(data_type):
+            return None
+        divisor = int(args[1])
+        return lambda table: pc.divide(table.column(column), divisor)
+    return None
+
+
+def _partition_key_functions(
+    partition_key: str, pa_schema: pa.Schema
+) -> Optional[List[_KeyFunction]]:
+    """Arrow functions computing each element of a partition key.
+
+    Args:
+        partition_key (str): The key, as in `system.tables`.
+        pa_schema (pa.Schema): Schema of the tables to be inserted.
+
+    Returns:
+        Optional[List[_KeyFunction]]: An empty list for unpartitioned
+        tables, or `None` if the key has an expression that is not
+        computed here or a column not in `pa_schema`.
+    """
+    expression = partition_key.strip()
+    if not expression:
+        return []
+    name, args = _split_type(expression)
+    if name == "tuple":
+        expressions = args
+    else:
+        if expression.startswith("(") and expression.endswith(")"):
+            expression = expression[1:-1]
+        expressions = _split_top_level(expression)
+
+    functions = []
+    for part in expressions:
+        function = _key_function(part, pa_schema)
+        if function is None:
+            return None
+        functions.append(function)
+    return functions
+
+
+def _split_partitions(
+    table: pa.Table, functions: List[_KeyFunction]
+) -> List[Tuple[Tuple[Any, ...], pa.Table]]:
+    """Split a table into the rows of each table partition.
+
+    Rows are sorted by partition once, so each partition's rows are a
+    slice of the sorted table.
+    """
+    import pyarrow.compute as pc  # type: ignore # noqa: PLC0415
+
+    if not functions or table.num_rows == 0:
+        return [((), table)]
+    keys = []
+    for function in functions:
+        key = function(table)
+        if pa.types.is_dictionary(key.type):
+            key = key.cast(key.type.value_type)
+        keys.append(key.combine_chunks())
+    if all(pc.count_distinct(key, mode="all").as_py() == 1 for key in keys):
+        return [(tuple(key[0].as_py() for key in keys), table)]
+
+    names = [str(i) for i in range(len(keys))]
+    order = pc.sort_indices(
+        pa.table(keys, names=names),
+        sort_keys=[(name, "ascending") for name in names],
+    )
+    table = table.take(order)
+    keys = [key.take(order) for key in keys]
+
+    # A partition starts wherever any key differs from the row before.
+    prev = [key.slice(0, len(key) - 1) for key in keys]
+    cur = [key.slice(1) for key in keys]
+    changed = None
+    for a, b in zip(prev, cur):
+        differs = pc.or_(
+            pc.fill_null(pc.not_equal(a, b), False),
+            pc.not_equal(pc.is_null(a), pc.is_null(b)),
+        )
+        changed = differs if changed is None else pc.or_(changed, differs)
+    starts = [0] + [i + 1 for i in pc.indices_nonzero(changed).to_pylist()]
+    ends = starts[1:] + [table.num_rows]
+    return [
+        (tuple(key[start].as_py() for key in keys), table.slice(start, end - start))
+        for start, end in zip(starts, ends)
+    ]
+
+
+class _PartitionBuffer:
+    """Rows waiting to be inserted, by table partition.
+
+    A partition's rows are inserted once there are `max_rows` of them,
+    or when the buffer is drained. Each insert holds the rows of at
+    most `max_partitions` partitions, so it makes that many parts.
+    """
+
+    def __init__(
+        self, functions: List[_KeyFunction], max_rows: int, max_partitions: int
+    ):
+        self.functions = functions
+        self.max_rows = max_rows
+        self.max_partitions = max_partitions
+        self.tables: Dict[Tuple[Any, ...], List[pa.Table]] = {}
+        self.rows: Dict[Tuple[Any, ...], int] = {}
+
+    def add(self, table: pa.Table) -> List[pa.Table]:
+        """Buffer a table; returns the tables to insert now."""
+        ready = []
+        for key, piece in _split_partitions(table, self.functions):
+            self.tables.setdefault(key, []).append(piece)
+            self.rows[key] = self.rows.get(key, 0) + piece.num_rows
+            if self.rows[key] >= self.max_rows:
+                ready.append(key)
+        return self._take(ready)
+
+    def drain(self) -> List[pa.Table]:
+        """Return the tables to insert every buffered row."""
+        return self._take(list(self.tables))
+
+    def _take(self, keys: List[Tuple[Any, ...]]) -> List[pa.Table]:
+        partitions = []
+        for key in keys:
+            partitions.append(pa.concat_tables(self.tables.pop(key)))
+            del self.rows[key]
+        inserts = []
+        for i in range(0, len(partitions), self.max_partitions):
+            table = pa.concat_tables(partitions[i : i + self.max_partitions])
+            if any(pa.types.is_dictionary(field.type) for field in table.schema):
+                # Pieces of different batches have their own dictionaries.
+                table = table.unify_dictionaries()
+            inserts.append(table)
+        return inserts
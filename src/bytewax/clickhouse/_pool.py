@@ -0,0 +1,140 @@
+"""Process-wide ClickHouse clients shared between sinks.
+
+Every sink, partition and sender thread in a process that targets the
+same server, user and database shares a single client and HTTP
+connection pool. Clients are created without a session so they can
+be used from several threads at once. A shared client is counted by
+its users and closed, with its connections, once the last one
+releases it.
+
+Native protocol connections cannot be shared between threads, so each
+acquire of one opens a new connection which is closed on release.
+
+`clickhouse_connect` is imported with the first client, rather than
+when a dataflow is defined.
+"""
+
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from bytewax.clickhouse._native import _NativeClient
+
+TRANSPORTS = ("http", "native")
+
+
+@dataclass
+class _SharedClient:
+    client: Any
+    pool_mgr: Any
+    max_connections: int
+    users: int = 0
+
+
+_KEY = Tuple[str, int, str, str, str]
+
+_LOCK = threading.Lock()
+_SHARED: Dict[_KEY, _SharedClient] = {}
+
+
+def _acquire_client(
+    host: str,
+    port: int,
+    username: str,
+    password: str,
+    database: str,
+    max_connections: int = 16,
+    keep_alive: int = 30,
+    transport: str = "http",
+    compression: Optional[str] = None,
+) -> Any:
+    """Get the shared client for a server, creating it if needed.
+
+    The first caller for a server sets the pool options. The pool
+    blocks callers once `max_connections` connections are in use
+    rather than opening throwaway ones.
+
+    `compression` only applies to native connections; HTTP insert
+    bodies are compressed by the caller.
+    """
+    if transport == "native":
+        return _NativeClient(host, port, username, password, database, compression)
+    if transport != "http":
+        msg = f"unknown transport {transport!r}; expected one of {TRANSPORTS!r}"
+        raise ValueError(msg)
+
+    key = (host, port, username, password, database)
+    with _LOCK:
+        shared = _SHARED.get(key)
+        if shared is None:
+            from clickhouse_connect import get_client  # noqa: PLC0415
+            from clickhouse_connect.driver.httputil import (  # noqa: PLC0415
+                get_pool_manager,
+            )
+
+            pool_mgr = get_pool_manager(
+                keep_idle=keep_alive, maxsize=max_connections, block=True
+            )
+            client = get_client(
+                host=host,
+                port=port,
+                username=username,
+                password=password,
+                database=database,
+                pool_mgr=pool_mgr,
+                autogenerate_session_id=False,
+            )
+            shared = _SharedClient(client, pool_mgr, max_connections)
+            _SHARED[key] = shared
+        shared.users += 1
+        return shared.client
+
+
+def _release_client(client: Any) -> None:
+    """Stop using a client from `_acquire_client`.
+
+    Shared clients stay open while any sink, partition or thread still
+    uses them, and are closed with their pool by the last release.
+    Unshared clients are closed.
+    """
+    with _LOCK:
+        for key, shared in _SHARED.items():
+            if shared.client is client:
+                shared.users -= 1
+                if shared.users > 0:
+                    return
+                del _SHARED[key]
+                break
+        else:
+            shared = None
+    client.close()
+    if shared is not None:
+        # The client leaves a pool manager it was given open.
+        shared.pool_mgr.clear()
+
+
+def pool_stats() -> List[Dict[str, Any]]:
+    """Report on the ClickHouse connection pools of this process.
+
+    Returns:
+        List[Dict[str, Any]]: One entry per server with `host`, `port`,
+        `database`, `users` (sinks, partitions and threads holding the
+        client), `max_connections`, `connections_opened` and `requests`
+        sent so far.
+    """
+    stats = []
+    with _LOCK:
+        for (host, port, _username, _password, database), shared in _SHARED.items():
+            pools = [shared.pool_mgr.pools[k] for k in shared.pool_mgr.pools.keys()]
+            stats.append(
+                {
+                    "host": host,
+                    "port": port,
+                    "database": database,
+                    "users": shared.users,
+                    "max_connections": shared.max_connections,
+                    "connections_opened": sum(p.num_connections for p in pools),
+                    "requests": sum(p.num_requests for p in pools),
+                }
+            )
+    return stats
@@ -0,0 +1,345 @@
+"""Reconcile the Arrow schema of a dataflow with a ClickHouse table.
+
+At startup the sink compares `pa_schema` with the table's columns in
+`system.columns`, fails on columns that cannot be inserted, and
+compiles a `_ConversionPlan` that converts each batch, one vectorized
+Arrow kernel per column, into exactly the Arrow types ClickHouse reads
+for those columns. The server then does no casting of its own.
+
+ClickHouse types without an Arrow equivalent the plan can target,
+such as `UUID`, `Enum8` or `Map`, are passed through unchecked.
+"""
+
+import logging
+import re
+from dataclasses import dataclass
+from datetime import date
+from decimal import Decimal
+from typing import Any, List, Optional, Sequence, Set, Tuple
+
+import pyarrow as pa  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+_SIMPLE_TYPES = {
+    "Int8": pa.int8(),
+    "Int16": pa.int16(),
+    "Int32": pa.int32(),
+    "Int64": pa.int64(),
+    "UInt8": pa.uint8(),
+    "UInt16": pa.uint16(),
+    "UInt32": pa.uint32(),
+    "UInt64": pa.uint64(),
+    "Float32": pa.float32(),
+    "Float64": pa.float64(),
+    "Bool": pa.bool_(),
+    "String": pa.string(),
+    "Date": pa.date32(),
+    "Date32": pa.date32(),
+}
+
+_DECIMAL_PRECISION = {
+    "Decimal32": 9,
+    "Decimal64": 18,
+    "Decimal128": 38,
+    "Decimal256": 76,
+}
+
+_TIMESTAMP_UNITS = ("s", "ms", "us", "ns")
+
+# Columns that are computed by the server and cannot be inserted.
+_COMPUTED = ("MATERIALIZED", "ALIAS")
+
+
+def _split_top_level(text: str) -> List[str]:
+    """Split on commas outside parentheses and quotes, and strip."""
+    parts, depth, start, quote = [], 0, 0, None
+    for i, char in enumerate(text):
+        if quote is not None:
+            if char == quote and text[i - 1] != "\\":
+                quote = None
+        elif char in "'`\"":
+            quote = char
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "," and depth == 0:
+            parts.append(text[start:i].strip())
+            start = i + 1
+    parts.append(text[start:].strip())
+    return parts
+
+
+def _split_type(ch_type: str) -> Tuple[str, List[str]]:
+    """Split `Name(arg, ...)` into its name and top-level arguments."""
+    match = re.fullmatch(r"\s*(\w+)\s*(?:\((.*)\))?\s*", ch_type, re.DOTALL)
+    if match is None:
+        return ch_type.strip(), []
+    name, inner = match.groups()
+    if not inner:
+        return name, []
+    return name, _split_top_level(inner)
+
+
+def _timezone(arg: str) -> Optional[str]:
+    return arg.strip("'\"") or None
+
+
+def _arrow_type(ch_type: str, source: pa.DataType) -> Optional[pa.DataType]:
+    """The Arrow type ClickHouse reads natively for a column type.
+
+    `source` is the Arrow type being inserted, used to keep its time
+    zone when the column has none. Returns `None` for column types the
+    plan does not handle.
+    """
+    name, args = _split_type(ch_type)
+    if name == "Nullable":
+        return _arrow_type(args[0], source)
+    if name == "SimpleAggregateFunction":
+        # Stored, and inserted, as the plain type of its values.
+        return _arrow_type(args[-1], source)
+    if name == "LowCardinality":
+        value_type = source.value_type if pa.types.is_dictionary(source) else source
+        inner = _arrow_type(args[0], value_type)
+        return pa.dictionary(pa.int32(), inner) if inner is not None else None
+    if name == "String" and (
+        pa.types.is_binary(source) or pa.types.is_large_binary(source)
+    ):
+        # Sent as-is; ClickHouse strings are bytes.
+        return source
+    if name in _SIMPLE_TYPES:
+        return _SIMPLE_TYPES[name]
+    if name in ("DateTime", "DateTime64"):
+        precision = int(args[0]) if name == "DateTime64" else 0
+        tz_args = args[1:] if name == "DateTime64" else args
+        tz = _timezone(tz_args[0]) if tz_args else None
+        if tz is None and pa.types.is_timestamp(source):
+            tz = source.tz
+        unit = _TIMESTAMP_UNITS[min(3, -(-precision // 3))]
+        return pa.timestamp(unit, tz=tz)
+    if name == "Decimal" or name in _DECIMAL_PRECISION:
+        if name == "Decimal":
+            precision, scale = int(args[0]), int(args[1]) if len(args) > 1 else 0
+        else:
+            precision, scale = _DECIMAL_PRECISION[name], int(args[0])
+        return (pa.decimal128 if precision <= 38 else pa.decimal256)(precision, scale)
+    if name == "Array":
+        source_item = (
+            source.value_type
+            if pa.types.is_list(source) or pa.types.is_large_list(source)
+            else pa.null()
+        )
+        item = _arrow_type(args[0], source_item)
+        return pa.list_(item) if item is not None else None
+    return None
+
+
+def _is_nullable(ch_type: str) -> bool:
+    name, args = _split_type(ch_type)
+    if name == "LowCardinality":
+        return _is_nullable(args[0])
+    if name == "SimpleAggregateFunction":
+        return _is_nullable(args[-1])
+    return name == "Nullable"
+
+
+def _castable(source: pa.DataType, target: pa.DataType) -> bool:
+    """Whether values of `source` can be converted to `target` losslessly."""
+    if pa.types.is_dictionary(source):
+        source = source.value_type
+    if pa.types.is_dictionary(target):
+        target = target.value_type
+    if source.equals(target) or pa.types.is_null(source):
+        return True
+    t = pa.types
+    if t.is_integer(target) or t.is_boolean(target):
+        return t.is_integer(source) or t.is_boolean(source)
+    if t.is_floating(target):
+        return t.is_integer(source) or t.is_floating(source) or t.is_decimal(source)
+    if t.is_decimal(target):
+        return t.is_integer(source) or t.is_decimal(source)
+    if t.is_string(target):
+        return t.is_string(source) or t.is_large_string(source)
+    if t.is_date(target) or t.is_timestamp(target):
+        return t.is_date(source) or t.is_timestamp(source)
+    if t.is_list(target):
+        return (
+            t.is_list(source) or t.is_large_list(source) or t.is_fixed_size_list(source)
+        ) and _castable(source.value_type, target.value_type)
+    return False
+
+
+def _zero(value_type: pa.DataType) -> Optional[pa.Scalar]:
+    """ClickHouse's default value for a column of this Arrow type."""
+    t = pa.types
+    if t.is_integer(value_type) or t.is_floating(value_type):
+        value: Any = 0
+    elif t.is_boolean(value_type):
+        value = False
+    elif t.is_string(value_type) or t.is_large_string(value_type):
+        value = ""
+    elif t.is_binary(value_type) or t.is_large_binary(value_type):
+        value = b""
+    elif t.is_decimal(value_type):
+        value = Decimal(0)
+    elif t.is_date(value_type):
+        value = date(1970, 1, 1)
+    elif t.is_timestamp(value_type):
+        return pa.scalar(0, pa.int64()).cast(value_type)
+    else:
+        return None
+    return pa.scalar(value, type=value_type)
+
+
+@dataclass(frozen=True)
+class _ColumnStep:
+    name: str
+    field: pa.Field
+    cast_to: pa.DataType
+    fill: Optional[pa.Scalar]
+    encode: bool
+    safe: bool
+
+    def convert(self, column: pa.ChunkedArray) -> pa.ChunkedArray:
+        import pyarrow.compute as pc  # type: ignore # noqa: PLC0415
+
+        if (
+            self.encode
+            and pa.types.is_dictionary(column.type)
+            and column.type.value_type.equals(self.cast_to)
+            and (self.fill is None or column.null_count == 0)
+        ):
+            # Already encoded; only the index type may differ.
+            return column.cast(self.field.type)
+        if pa.types.is_dictionary(column.type):
+            column = column.cast(column.type.value_type)
+        if pa.types.is_integer(column.type) and pa.types.is_decimal(self.cast_to):
+            # Arrow only casts integers to decimals wide enough for any
+            # value of the integer type; narrow them in a second, checked,
+            # cast.
+            if self.cast_to.precision <= 38:
+                wide = pa.decimal128(38, self.cast_to.scale)
+            else:
+                wide = pa.decimal256(76, self.cast_to.scale)
+            column = column.cast(wide)
+        if not column.type.equals(self.cast_to):
+            column = column.cast(self.cast_to, safe=self.safe)
+        if self.fill is not None and column.null_count > 0:
+            column = pc.fill_null(column, self.fill)
+        if self.encode:
+            column = column.dictionary_encode()
+        return column
+
+
+class _ConversionPlan:
+    """Convert tables of `pa_schema` to the column types of a table.
+
+    Only columns whose type differs, or that need nulls filled, have a
+    step. Tables with dictionary columns also get one dictionary per
+    column. A plan with neither returns tables unchanged.
+
+    The first nulls filled in each column are logged as a warning, as
+    they are no longer nulls once stored.
+    """
+
+    def __init__(self, steps: Sequence[_ColumnStep], dictionaries: bool = False):
+        self.steps = list(steps)
+        self._encodes = dictionaries or any(step.encode for step in self.steps)
+        self._filled: Set[str] = set()
+
+    def __bool__(self) -> bool:
+        return bool(self.steps) or self._encodes
+
+    def apply(self, table: pa.Table) -> pa.Table:
+        for step in self.steps:
+            i = table.schema.get_field_index(step.name)
+            column = table.column(i)
+            if step.fill is not None and step.name not in self._filled:
+                if column.null_count > 0:
+                    self._filled.add(step.name)
+                    logger.warning(
+                        f"Storing nulls in column '{step.name}' as "
+                        f"{step.fill.as_py()!r}; "
+                        "make the column `Nullable` to keep them"
+                    )
+            table = table.set_column(i, step.field, step.convert(column))
+        if self._encodes:
+            # Send one dictionary per column with the insert, rather
+            # than one per record batch.
+            table = table.unify_dictionaries()
+        return table
+
+
+def _compile_plan(
+    pa_schema: pa.Schema, columns: Sequence[Tuple[str, str, str]]
+) -> _ConversionPlan:
+    """Check `pa_schema` against a table and compile its conversion plan.
+
+    Args:
+        pa_schema (pa.Schema): Schema of the tables to be inserted.
+        columns (Sequence[Tuple[str, str, str]]): `name`, `type` and
+            `default_kind` of each column of the table, as in
+            `system.columns`.
+
+    Returns:
+        _ConversionPlan: The conversions to run on every batch.
+
+    Raises:
+        ValueError: If any field of `pa_schema` is not a column of the
+        table, is a computed column, or has a type that cannot be
+        converted to the column's type.
+    """
+    by_name = {name: (ch_type, default_kind) for name, ch_type, default_kind in columns}
+    errors = []
+    steps = []
+    dictionaries = False
+    for field in pa_schema:
+        if field.name not in by_name:
+            errors.append(f"`{field.name}` is not a column of the table")
+            continue
+        ch_type, default_kind = by_name[field.name]
+        if default_kind in _COMPUTED:
+            errors.append(f"`{field.name}` is a {default_kind} column")
+            continue
+        target = _arrow_type(ch_type, field.type)
+        if target is None:
+            continue
+        if not _castable(field.type, target):
+            errors.append(f"`{field.name}` of type {field.type} cannot be {ch_type}")
+            continue
+
+        encode = pa.types.is_dictionary(target)
+        dictionaries = dictionaries or encode
+        value_type = target.value_type if encode else target
+        nullable = _is_nullable(ch_type)
+        # Nulls in a column without a DEFAULT expression become the
+        # type's default on the server; do that here instead.
+        fill = _zero(value_type) if not nullable and not default_kind else None
+        if field.type.equals(target) and (fill is None or not field.nullable):
+            continue
+        source_value = (
+            field.type.value_type if pa.types.is_dictionary(field.type) else field.type
+        )
+        temporal = pa.types.is_timestamp(source_value) or pa.types.is_date(source_value)
+        steps.append(
+            _ColumnStep(
+                field.name,
+                pa.field(field.name, target, nullable=nullable or fill is None),
+                value_type,
+                fill,
+                encode,
+                # Timestamps may be truncated to a coarser unit, as
+                # ClickHouse itself would.
+                safe=not temporal,
+            )
+        )
+        if not field.type.equals(target):
+            logger.info(
+                f"Converting column '{field.name}' from {field.type} to {target}"
+            )
+
+    if errors:
+        msg = "`pa_schema` does not match the table: " + "; ".join(errors)
+        raise ValueError(msg)
+    return _ConversionPlan(steps, dictionaries)
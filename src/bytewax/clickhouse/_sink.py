@@ -0,0 +1,1398 @@
+"""The ClickHouse sinks and their partitions."""
+
+import logging
+import os
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from datetime import timedelta
+from functools import lru_cache, partial
+from pathlib import Path
+from typing import (
+    Any,
+    Dict,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+from zlib import adler32
+
+from bytewax.clickhouse import _metrics
+from bytewax.clickhouse._arrow import (
+    _check_compression,
+    _content_digest,
+    _InsertStream,
+)
+from bytewax.clickhouse._bootstrap import _MetadataCache, _TableMetadata
+from bytewax.clickhouse._cluster import ClusterShard, _cluster_shards, _ShardRouter
+from bytewax.clickhouse._ddl import (
+    ColumnHint,
+    OutputTable,
+    TableSpec,
+    _column_definitions,
+)
+from bytewax.clickhouse._metrics import _span, _span_event
+from bytewax.clickhouse._partitioning import (
+    _KeyFunction,
+    _partition_key_functions,
+    _PartitionBuffer,
+)
+from bytewax.clickhouse._pool import _acquire_client, _release_client
+from bytewax.clickhouse._schema import _compile_plan, _ConversionPlan
+from bytewax.clickhouse._spill import _SpillBuffer
+from bytewax.clickhouse._writer import (
+    RetryPolicy,
+    _BatchTuner,
+    _InsertPipeline,
+    _Retrier,
+)
+from bytewax.outputs import (
+    DynamicSink,
+    FixedPartitionedSink,
+    StatefulSinkPartition,
+    StatelessSinkPartition,
+)
+from pyarrow import Schema, Table, concat_tables  # type: ignore
+from typing_extensions import override
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=None)
+def _check_license() -> None:
+    """Print the license notice, once, when the first sink is defined."""
+    if "BYTEWAX_LICENSE" in os.environ:
+        return
+    msg = (
+        "`bytewax-interval` is commercially licensed "
+        "with publicly available source code.\n"
+        "You are welcome to prototype using this module for free, "
+        "but any use on business data requires a paid license.\n"
+        "See https://modules.bytewax.io/ for a license. "
+        "Set the env var `BYTEWAX_LICENSE=1` to suppress this message."
+    )
+    print(msg, file=sys.stderr)
+
+
+@dataclass
+class _PartitionState:
+    next_block: int = 0
+    spill_position: Optional[Tuple[int, int]] = None
+
+
+class _ClickHousePartition(StatefulSinkPartition[Table, _PartitionState]):
+    def __init__(
+        self,
+        table_name: str,
+        host: str,
+        port: int,
+        username: str,
+        password: str,
+        database: str,
+        max_in_flight: int = 1,
+        max_queued: int = 2,
+        step_id: str = "clickhouse",
+        for_part: str = "0",
+        batch_tuner: Optional[_BatchTuner] = None,
+        max_connections: int = 16,
+        keep_alive: int = 30,
+        transport: str = "http",
+        compression: Optional[str] = None,
+        arrow_compression: Optional[str] = None,
+        compression_level: Optional[int] = None,
+        settings: Optional[Dict[str, Any]] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        dedup_block_rows: Optional[int] = None,
+        spill_dir: Optional[Union[str, Path]] = None,
+        spill_max_bytes: int = 1 << 30,
+        plan: Optional[_ConversionPlan] = None,
+        shards: Optional[Sequence[ClusterShard]] = None,
+        sharding_key: Optional[Sequence[str]] = None,
+        partition_keys: Optional[List[_KeyFunction]] = None,
+        table_partition_rows: Optional[int] = None,
+        max_table_partitions: int = 4,
+        resume_state: Optional[_PartitionState] = None,
+    ):
+        self.table_name = table_name
+        # Tables whose merge backlog is polled; a fan-out writer inserts
+        # into several.
+        self.table_names = [table_name]
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.database = database
+        self.batch_tuner = batch_tuner
+        self.max_connections = max_connections
+        self.keep_alive = keep_alive
+        self.transport = transport
+        self.compression = compression
+        self.arrow_compression = arrow_compression
+        self.compression_level = compression_level
+        # `buffer_size` is an option of the HTTP interface only.
+        self.insert_settings: Dict[str, Any] = (
+            {"buffer_size": 0} if transport == "http" else {}
+        )
+        self.insert_settings.update(settings or {})
+        self.name = name = f"{step_id}-{for_part}"
+        self._rows_inserted = _metrics.ROWS_INSERTED.labels(step_id, for_part)
+        self._bytes_inserted = _metrics.BYTES_INSERTED.labels(step_id, for_part)
+        self._server_written_rows = _metrics.SERVER_WRITTEN_ROWS.labels(
+            step_id, for_part
+        )
+        self._insert_seconds = _metrics.INSERT_SECONDS.labels(step_id, for_part)
+        self._concat_seconds = _metrics.CONCAT_SECONDS.labels(step_id, for_part)
+        self._insert_retries = _metrics.INSERT_RETRIES.labels(step_id, for_part)
+        self._labels = (step_id, for_part)
+        # One connection target, and breaker, per shard.
+        self.targets: List[Tuple[str, int]] = (
+            [(shard.host, shard.port or port) for shard in shards]
+            if shards
+            else [(host, port)]
+        )
+        self.router = _ShardRouter(shards, sharding_key) if shards else None
+        self.retriers = [
+            _Retrier(
+                retry_policy or RetryPolicy(),
+                name if len(self.targets) == 1 else f"{name}-{target_host}",
+                on_retry=self._on_retry,
+            )
+            for target_host, _ in self.targets
+        ]
+        self.plan = plan
+        self.dedup_block_rows = dedup_block_rows
+        self.partition_buffer = (
+            _PartitionBuffer(partition_keys, table_partition_rows, max_table_partitions)
+            if partition_keys and table_partition_rows is not None
+            else None
+        )
+        state = resume_state if resume_state is not None else _PartitionState()
+        self.next_block = state.next_block
+        self.pending: List[Table] = []
+        self.pending_rows = 0
+        self.clients: List[Any] = []
+        self.pipelines: List[_InsertPipeline] = []
+        self.spill: Optional[_SpillBuffer] = None
+        if spill_dir is not None:
+            self.spill = spill = _SpillBuffer(
+                Path(spill_dir) / name, spill_max_bytes, state.spill_position
+            )
+            _metrics.SPILL_BYTES.labels(*self._labels).set_function(lambda: spill.bytes)
+            self.pipelines.append(
+                _InsertPipeline(
+                    self._insert_spilled,
+                    partial(self._make_client, host, port),
+                    _release_client,
+                    max(max_in_flight, 1),
+                    max_queued,
+                    name,
+                    queue=spill,
+                )
+            )
+        elif max_in_flight > 0:
+            for shard, (target_host, target_port) in enumerate(self.targets):
+                self.pipelines.append(
+                    _InsertPipeline(
+                        partial(self._insert, shard=shard),
+                        partial(self._make_client, target_host, target_port),
+                        _release_client,
+                        max_in_flight,
+                        max_queued,
+                        name if len(self.targets) == 1 else f"{name}-{target_host}",
+                    )
+                )
+        if self.pipelines:
+            pipelines = self.pipelines
+            _metrics.QUEUE_DEPTH.labels(*self._labels).set_function(
+                lambda: sum(pipeline.depth for pipeline in pipelines)
+            )
+        else:
+            self.clients = [self._make_client(*target) for target in self.targets]
+
+    def _make_client(self, host: str, port: int) -> Any:
+        return _acquire_client(
+            host,
+            port,
+            self.username,
+            self.password,
+            self.database,
+            self.max_connections,
+            self.keep_alive,
+            self.transport,
+            self.compression,
+        )
+
+    def _insert(
+        self,
+        client: Any,
+        arrow_table: Table,
+        token: Optional[str] = None,
+        table_name: Optional[str] = None,
+        shard: int = 0,
+    ) -> None:
+        settings = self.insert_settings
+        if token is not None:
+            settings = {**settings, "insert_deduplication_token": token}
+        table_name = table_name or self.table_name
+        table = f"{self.database}.{table_name}"
+        with _span(
+            "clickhouse.insert",
+            **{
+                "db.system": "clickhouse",
+                "db.name": self.database,
+                "db.sql.table": table_name,
+                "bytewax.step_id": self._labels[0],
+                "bytewax.partition": self._labels[1],
+                "net.peer.name": self.targets[shard][0],
+                "rows": arrow_table.num_rows,
+            },
+        ) as span:
+            start = time.perf_counter()
+            if self.transport == "http":
+                body = _InsertStream(
+                    arrow_table,
+                    self.arrow_compression,
+                    self.compression,
+                    self.compression_level,
+                )
+                summary = self.retriers[shard].call(
+                    lambda: client.raw_insert(
+                        table,
+                        arrow_table.column_names,
+                        body,
+                        settings=settings,
+                        fmt="ArrowStream",
+                        compression=self.compression,
+                    )
+                )
+                sent = body.bytes_sent
+            else:
+                sent = arrow_table.nbytes
+                summary = self.retriers[shard].call(
+                    lambda: client.insert_arrow(table, arrow_table, settings=settings)
+                )
+            seconds = time.perf_counter() - start
+
+            self._insert_seconds.observe(seconds)
+            self._rows_inserted.inc(arrow_table.num_rows)
+            self._bytes_inserted.inc(sent)
+            self._server_written_rows.inc(summary.written_rows)
+            if span is not None:
+                span.set_attribute("bytes", sent)
+                span.set_attribute("written_rows", summary.written_rows)
+                span.set_attribute("query_id", summary.query_id())
+            logger.debug(
+                "Inserted %d rows into '%s' in %.3fs as query '%s': "
+                "%d Arrow bytes sent as %d (%.2fx)",
+                arrow_table.num_rows,
+                table_name,
+                seconds,
+                summary.query_id(),
+                arrow_table.nbytes,
+                sent,
+                arrow_table.nbytes / max(sent, 1),
+            )
+        if self.batch_tuner is not None:
+            self.batch_tuner.record_insert(seconds)
+            if self.batch_tuner.poll_due():
+                self.batch_tuner.record_parts(self._max_active_parts(client))
+
+    def _insert_spilled(
+        self, client: Any, arrow_table: Table, token: Optional[str], seq: int
+    ) -> None:
+        assert self.spill is not None
+        try:
+            self._insert(client, arrow_table, token)
+        except BaseException:
+            self.spill.fail()
+            raise
+        self.spill.ack(seq)
+
+    def _max_active_parts(self, client: Any) -> int:
+        tables = ", ".join(f"'{table_name}'" for table_name in self.table_names)
+        query = f"""SELECT max(parts) FROM (
+                SELECT count() AS parts FROM system.parts
+                WHERE database = '{self.database}' AND table IN ({tables})
+                AND active GROUP BY table, partition)"""
+        return int(client.command(query) or 0)
+
+    def _on_retry(self, ex: BaseException) -> None:
+        self._insert_retries.inc()
+        _span_event("retry", error=str(ex))
+
+    @override
+    def write_batch(self, batch: List[Table]) -> None:
+        """Write a batch of data to the ClickHouse table.
+
+        This method concatenates the incoming batch of PyArrow Tables and inserts the
+        resulting table into the specified ClickHouse table. Concatenation only
+        chains the tables' chunks without copying them, and over HTTP the chunks
+        are serialized and sent one at a time. When background
+        inserts are enabled the table is queued instead, and this blocks only
+        while the queue is full.
+
+        With deduplication enabled, rows are instead cut into blocks of
+        `dedup_block_rows` rows, regardless of how they were batched upstream,
+        and any remainder is held until the next batch or snapshot.
+
+        With `table_partition_rows`, rows are grouped by the table partition
+        they go to, and each partition's rows are held until there are
+        `table_partition_rows` of them or the next snapshot.
+
+        Args:
+            batch (List[Table]): A list of PyArrow Table objects representing the batch
+            of data to be written.
+        """
+        self._write(batch, self.table_name, self.plan)
+
+    def _write(
+        self, batch: List[Table], table_name: str, plan: Optional[_ConversionPlan]
+    ) -> None:
+        start = time.perf_counter()
+        arrow_table = concat_tables(batch)
+        self._concat_seconds.observe(time.perf_counter() - start)
+        if plan:
+            arrow_table = plan.apply(arrow_table)
+        if table_name != self.table_name:
+            # Only the partition's own table is deduplicated.
+            self._submit(arrow_table, None, table_name=table_name)
+            return
+        if self.partition_buffer is not None:
+            for table in self.partition_buffer.add(arrow_table):
+                self._submit(table, None)
+            return
+        if self.dedup_block_rows is None:
+            self._submit(arrow_table, None)
+            return
+
+        self.pending.append(arrow_table)
+        self.pending_rows += arrow_table.num_rows
+        while self.pending_rows >= self.dedup_block_rows:
+            pending = concat_tables(self.pending)
+            rest = pending.slice(self.dedup_block_rows)
+            self._submit_block(pending.slice(0, self.dedup_block_rows))
+            self.pending = [rest] if rest.num_rows > 0 else []
+            self.pending_rows = rest.num_rows
+
+    def _submit(
+        self,
+        arrow_table: Table,
+        token: Optional[str],
+        seq: Optional[int] = None,
+        table_name: Optional[str] = None,
+    ) -> None:
+        pieces = (
+            self.router.split(arrow_table, seq)
+            if self.router is not None
+            else [(0, arrow_table)]
+        )
+        # A shard's piece of a block keeps the block's token, since
+        # each shard deduplicates its own inserts.
+        # Items for the partition's own table are `(table, token)`,
+        # which is also what a spill buffer stores.
+        args = (token,) if table_name is None else (token, table_name)
+        for shard, piece in pieces:
+            if self.pipelines:
+                self.pipelines[shard].submit(piece, *args)
+            else:
+                self._insert(self.clients[shard], piece, token, table_name, shard)
+
+    def _submit_block(self, block: Table) -> None:
+        # ClickHouse skips its own hash of the rows when given a token,
+        # so the token must name the rows and not only the block's
+        # place in the stream: a block replayed with other rows, e.g.
+        # when several upstream workers feed this partition in a
+        # different order, is then inserted rather than dropped.
+        seq = self.next_block
+        self.next_block += 1
+        token = f"{self.name}-{seq}-{_content_digest(block)}"
+        self._submit(block, token, seq)
+
+    def _flush_pending(self) -> None:
+        if self.pending_rows > 0:
+            self._submit_block(concat_tables(self.pending))
+            self.pending = []
+            self.pending_rows = 0
+
+    def _flush_partitions(self) -> None:
+        if self.partition_buffer is not None:
+            for table in self.partition_buffer.drain():
+                self._submit(table, None)
+
+    @override
+    def snapshot(self) -> _PartitionState:
+        """Make sure every batch so far is inserted or spilled to disk.
+
+        Without a spill directory this waits for queued inserts, which
+        is what keeps delivery at-least-once when inserts run in the
+        background. With one, it only syncs new spill files to disk and
+        records which have yet to be inserted, so a slow server does not
+        hold up the epoch.
+
+        Rows held for table partitions, and the rows of a deduplication
+        block that is not full yet, are inserted first. The state also
+        has the sequence number of the next deduplication block.
+        """
+        self._flush_partitions()
+        self._flush_pending()
+        spill_position = None
+        if self.spill is not None:
+            self.pipelines[0].check()
+            self.spill.sync()
+            spill_position = self.spill.position()
+        else:
+            for pipeline in self.pipelines:
+                pipeline.flush()
+        return _PartitionState(self.next_block, spill_position)
+
+    @override
+    def close(self) -> None:
+        try:
+            self._flush_partitions()
+            self._flush_pending()
+        finally:
+            if self.spill is not None:
+                _metrics.SPILL_BYTES.remove(*self._labels)
+            if self.pipelines:
+                _metrics.QUEUE_DEPTH.remove(*self._labels)
+            # Pipelines keep raising a failed insert; close them all
+            # before re-raising the first error.
+            errors = []
+            for pipeline in self.pipelines:
+                try:
+                    pipeline.close()
+                except RuntimeError as ex:
+                    errors.append(ex)
+            for client in self.clients:
+                _release_client(client)
+            if errors:
+                raise errors[0]
+
+
+def _async_insert_settings(
+    async_insert: bool,
+    wait_for_async_insert: bool,
+    max_data_size: Optional[int],
+    busy_timeout: Optional[timedelta],
+) -> Dict[str, Any]:
+    if not async_insert:
+        if max_data_size is not None or busy_timeout is not None:
+            msg = "async insert options require `async_insert=True`"
+            raise ValueError(msg)
+        return {}
+
+    settings: Dict[str, Any] = {
+        "async_insert": 1,
+        "wait_for_async_insert": 1 if wait_for_async_insert else 0,
+    }
+    if max_data_size is not None:
+        settings["async_insert_max_data_size"] = max_data_size
+    if busy_timeout is not None:
+        settings["async_insert_busy_timeout_ms"] = int(
+            busy_timeout.total_seconds() * 1000
+        )
+    return settings
+
+
+class ClickHouseSink(FixedPartitionedSink[Table, _PartitionState]):
+    """A partitioned sink for writing data to a ClickHouse database in a dataflow.
+
+    The ClickHouseSink class provides functionality to connect to a ClickHouse database,
+    check for the existence of a specified table, and create it if it doesn't exist.
+    The class ensures that the table uses the ReplacingMergeTree engine and writes data
+    in batches using the PyArrow format.
+
+    Items are `(key, table)` pairs routed by key to one of `parts` partitions,
+    which bytewax spreads across workers. Keys that are the decimal shard
+    numbers produced by the `shards` option of `chop.output` map onto
+    partitions one-to-one. For a stream of tables without keys, use
+    `ClickHouseDynamicSink`.
+
+    The table is checked when the first partition of each process is
+    built, not when the sink is defined, so defining a dataflow makes no
+    queries. Only the worker of partition 0 creates the table.
+
+    Methods:
+        build_part(step_id, for_part, resume_state) -> _ClickHousePartition:
+            Checks, or creates, the table once per process, then constructs a
+            _ClickHousePartition instance that manages the actual data
+            writing process.
+    """
+
+    def __init__(
+        self,
+        table_name: str,
+        schema: Optional[str],
+        username: str,
+        password: str,
+        host: str = "localhost",
+        port: int = 8123,
+        database: str = "default",
+        order_by: str = "",
+        parts: int = 1,
+        max_in_flight: int = 1,
+        max_queued: int = 2,
+        batch_tuner: Optional[_BatchTuner] = None,
+        max_connections: int = 16,
+        keep_alive: int = 30,
+        transport: str = "http",
+        compression: Optional[str] = None,
+        arrow_compression: Optional[str] = None,
+        compression_level: Optional[int] = None,
+        async_insert: bool = False,
+        wait_for_async_insert: bool = True,
+        async_insert_max_data_size: Optional[int] = None,
+        async_insert_busy_timeout: Optional[timedelta] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        dedup_block_rows: Optional[int] = None,
+        spill_dir: Optional[Union[str, Path]] = None,
+        spill_max_bytes: int = 1 << 30,
+        pa_schema: Optional[Schema] = None,
+        table_spec: Optional[TableSpec] = None,
+        column_hints: Optional[Mapping[str, ColumnHint]] = None,
+        cluster: Optional[Union[str, Sequence[ClusterShard]]] = None,
+        sharding_key: Optional[Sequence[str]] = None,
+        metadata_cache_dir: Optional[Union[str, Path]] = None,
+        metadata_cache_ttl: timedelta = timedelta(hours=1),
+        bootstrap_timeout: timedelta = timedelta(minutes=1),
+        table_partition_rows: Optional[int] = None,
+        max_table_partitions: int = 4,
+    ):
+        """Initialize the ClickHouseSink.
+
+        Sets up the connection parameters for the ClickHouse database. The
+        target table is verified when the dataflow is built: the worker
+        building partition 0 creates it, using the specified schema, if it
+        does not exist, and the other workers wait for it.
+
+        Args:
+            table_name (str): Name of the table in ClickHouse.
+            username (str): Username for authentication with the ClickHouse server.
+            password (str): Password for authentication with the ClickHouse server.
+            host (str, optional): Hostname of ClickHouse server. Default is "localhost".
+            port (int, optional): Port number of the ClickHouse server. Default is 8123.
+            database (Optional[str], optional): Name of the database in ClickHouse.
+                                    If not provided, uses "default".
+            schema (Optional[str], optional): Schema definition for the table if needs
+                                    to be created. If None, the columns are
+                                    derived from `pa_schema` and
+                                    `column_hints`.
+            order_by (str, optional): Comma-separated list of columns to order by in the
+                                    ReplacingMergeTree engine. Defaults to "".
+            parts (int, optional): Number of sink partitions to spread inserts
+                                    over. Defaults to 1.
+            max_in_flight (int, optional): Number of inserts each partition runs
+                                    concurrently on background threads, each with
+                                    its own connection. 0 inserts synchronously on
+                                    the worker thread. Defaults to 1.
+            max_queued (int, optional): Number of batches each partition queues
+                                    for the background threads before blocking
+                                    the worker. Defaults to 2.
+            batch_tuner (optional): Used by `chop.output` to feed insert
+                                    latency and merge backlog back into the
+                                    size of the batches it builds.
+            max_connections (int, optional): Size of the HTTP connection pool
+                                    shared by every sink in this process that
+                                    targets the same server, user and database.
+                                    Threads wait for a free connection beyond
+                                    this. The first sink to connect sets the
+                                    pool options. Defaults to 16.
+            keep_alive (int, optional): Seconds a pooled connection may idle
+                                    before TCP keep-alive probes are sent.
+                                    Defaults to 30.
+            transport (str, optional): "http" to use the HTTP interface, or
+                                    "native" to send Native blocks over the
+                                    native TCP protocol, usually on port 9000.
+                                    "native" requires the `native` extra and
+                                    opens one connection per sender thread.
+                                    Defaults to "http".
+            compression (Optional[str], optional): "lz4" or "zstd" to compress
+                                    insert payloads on the wire: the request
+                                    body over HTTP, Native blocks over the
+                                    native protocol. Defaults to None.
+            arrow_compression (Optional[str], optional): "lz4" or "zstd" to
+                                    compress the buffers inside the Arrow IPC
+                                    payload sent over HTTP. Defaults to None.
+                                    HTTP only.
+            compression_level (Optional[int], optional): Codec level for both
+                                    kinds of compression; codec default if None.
+                                    Use DEBUG logging to see the compression
+                                    ratio of each insert. HTTP only.
+            async_insert (bool, optional): Let the server buffer inserts and
+                                    coalesce them into fewer parts, so many
+                                    workers can send small batches. Defaults
+                                    to False.
+            wait_for_async_insert (bool, optional): Wait until the server has
+                                    flushed an async insert to the table before
+                                    acknowledging it. Without waiting, inserts
+                                    are fire-and-forget and rows buffered on
+                                    the server can be lost in a crash, so
+                                    delivery is no longer at-least-once.
+                                    Defaults to True.
+            async_insert_max_data_size (Optional[int], optional): Bytes the
+                                    server buffers per query shape before
+                                    flushing. Server default if None.
+            async_insert_busy_timeout (Optional[timedelta], optional): Longest
+                                    time the server buffers before flushing.
+                                    Server default if None.
+            retry_policy (Optional[RetryPolicy], optional): How inserts failing
+                                    with transient errors are retried. Defaults
+                                    to `RetryPolicy()`; pass
+                                    `RetryPolicy(max_retries=0)` to fail on the
+                                    first error.
+            dedup_block_rows (Optional[int], optional): Cut inserts into blocks of
+                                    this many rows, or fewer at a snapshot,
+                                    each tagged with an
+                                    `insert_deduplication_token` built from the
+                                    step id, partition, a block number kept in
+                                    snapshots and a digest of the block's rows.
+                                    Blocks replayed with the same rows after a
+                                    resume are then dropped by ClickHouse at
+                                    insert time; blocks with other rows are
+                                    inserted. Requires a Replicated table or
+                                    `non_replicated_deduplication_window` on
+                                    the table. Defaults to None (no tokens).
+            spill_dir (Optional[Union[str, Path]], optional): Local directory
+                                    through which batches are queued for
+                                    insertion, as Arrow IPC files in a
+                                    subdirectory per partition. Snapshots
+                                    record the files not yet inserted
+                                    instead of waiting for ClickHouse, so
+                                    the directory must survive restarts
+                                    of the worker. Defaults to None
+                                    (queue in memory).
+            spill_max_bytes (int, optional): Size of the files in a
+                                    partition's spill directory at which
+                                    writes block until inserts catch up.
+                                    Defaults to 1 GiB.
+            pa_schema (Optional[Schema], optional): Arrow schema of the tables
+                                    to be written. If given, it is checked
+                                    against the table's columns at startup,
+                                    and each batch is converted to the exact
+                                    Arrow types ClickHouse reads for them
+                                    (timestamp units, decimal scales,
+                                    dictionaries for `LowCardinality`, nulls
+                                    filled for non-`Nullable` columns).
+                                    Defaults to None (sent as-is).
+            table_spec (Optional[TableSpec], optional): Engine, partitioning,
+                                    keys, skipping indexes, codecs, TTL and
+                                    settings of the table if it needs to be
+                                    created. Its `engine` is also the one
+                                    expected of an existing table. Defaults
+                                    to a `ReplacingMergeTree` sorted by
+                                    `order_by`.
+            column_hints (Optional[Mapping[str, ColumnHint]], optional): How
+                                    to derive the ClickHouse column of each
+                                    named field of `pa_schema` when `schema`
+                                    is None: nullability, `LowCardinality`,
+                                    codecs or a type of its own. Defaults
+                                    to None (derived from the Arrow types).
+            cluster (Optional[Union[str, Sequence[ClusterShard]]], optional):
+                                    Insert straight into the table on each
+                                    shard of a cluster instead of through
+                                    `host`: the name of a cluster in
+                                    `system.clusters` on `host`, or its
+                                    shards. `table_name` is then the local
+                                    table on each shard, which is created
+                                    on every shard where it is missing.
+                                    Each partition keeps connections and a
+                                    circuit breaker per shard. Defaults to
+                                    None (insert into `host` only).
+            sharding_key (Optional[Sequence[str]], optional): Columns whose
+                                    hash picks the shard of each row, split
+                                    by shard weight. Without it, whole
+                                    batches go to the shards in turn.
+                                    Defaults to None.
+            metadata_cache_dir (Optional[Union[str, Path]], optional): Directory
+                                    to keep the engine and columns of the
+                                    table, and the shards of `cluster`, in
+                                    after checking them, so restarts skip
+                                    the metadata queries and DDL. Changes
+                                    to the table are then only noticed
+                                    once the entry expires. Defaults to
+                                    None (no cache).
+            metadata_cache_ttl (timedelta, optional): How long cached
+                                    metadata is used. Defaults to 1 hour.
+            bootstrap_timeout (timedelta, optional): How long the workers
+                                    of partitions other than 0 wait for
+                                    the table to be created. Defaults to
+                                    1 minute.
+            table_partition_rows (Optional[int], optional): Group rows by the
+                                    partition of the table they go to, as
+                                    given by its `PARTITION BY` key, and
+                                    insert a partition's rows once there
+                                    are this many of them, or at the next
+                                    snapshot. Keys of columns, time buckets
+                                    such as `toYYYYMM(ts)` and `intDiv` of
+                                    columns of `pa_schema` are supported;
+                                    rows of tables partitioned otherwise
+                                    are not grouped. Not supported with
+                                    `dedup_block_rows`. Defaults to None
+                                    (insert batches as they arrive).
+            max_table_partitions (int, optional): Most table partitions in
+                                    one insert when grouping by partition,
+                                    so an insert makes at most this many
+                                    parts. Defaults to 4.
+
+        Raises:
+            ValueError: If `transport` or a compression is unknown,
+            `arrow_compression` or `compression_level` is given with the
+            native transport, async
+            insert options are given without `async_insert`, both
+            `order_by` and `table_spec` are given, `column_hints` are
+            given with a `schema` or do not fit `pa_schema`, or
+            `sharding_key` is given without `cluster` or `spill_dir`
+            with it, or `table_partition_rows` is given with
+            `dedup_block_rows` or either it or `max_table_partitions`
+            is less than 1. When the dataflow is built, also raised if
+            neither the schema nor `pa_schema` is provided and the table
+            does not exist, `pa_schema` does not match the table, or the
+            cluster is unknown.
+        """
+        _check_license()
+        _check_compression("compression", compression)
+        _check_compression("arrow_compression", arrow_compression)
+        if transport == "native" and (
+            arrow_compression is not None or compression_level is not None
+        ):
+            # clickhouse-driver compresses Native blocks at the codec's
+            # default level, and no Arrow is sent.
+            msg = (
+                "`arrow_compression` and `compression_level` are only "
+                "supported with the HTTP transport"
+            )
+            raise ValueError(msg)
+        self.insert_settings = _async_insert_settings(
+            async_insert,
+            wait_for_async_insert,
+            async_insert_max_data_size,
+            async_insert_busy_timeout,
+        )
+        if async_insert and dedup_block_rows is not None:
+            # Tokens are ignored by async inserts unless asked for.
+            self.insert_settings["async_insert_deduplicate"] = 1
+
+        if table_spec is None:
+            table_spec = TableSpec(order_by=order_by)
+        elif order_by:
+            msg = "pass `order_by` as part of `table_spec`"
+            raise ValueError(msg)
+        if not schema and pa_schema is not None:
+            schema = _column_definitions(
+                pa_schema, column_hints, table_spec._key_columns()
+            )
+        elif column_hints is not None:
+            msg = "`column_hints` require the schema to be derived from `pa_schema`"
+            raise ValueError(msg)
+        if table_partition_rows is not None:
+            if dedup_block_rows is not None:
+                # Blocks must not depend on how rows were grouped.
+                msg = "`table_partition_rows` is not supported with deduplication"
+                raise ValueError(msg)
+            if table_partition_rows < 1 or max_table_partitions < 1:
+                msg = (
+                    "`table_partition_rows` and `max_table_partitions` must be "
+                    "at least 1"
+                )
+                raise ValueError(msg)
+
+        self.table_name = table_name
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.database = database
+        self.schema = schema
+        self.table_spec = table_spec
+        self.parts = parts
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued
+        self.batch_tuner = batch_tuner
+        self.max_connections = max_connections
+        self.keep_alive = keep_alive
+        self.transport = transport
+        self.compression = compression
+        self.arrow_compression = arrow_compression
+        self.compression_level = compression_level
+        self.retry_policy = retry_policy
+        self.dedup_block_rows = dedup_block_rows
+        self.spill_dir = spill_dir
+        self.spill_max_bytes = spill_max_bytes
+
+        self.pa_schema = pa_schema
+        self.cluster = cluster
+        self.shards: Optional[List[ClusterShard]] = None
+        if cluster is not None:
+            if spill_dir is not None:
+                msg = "`spill_dir` is not supported with `cluster`"
+                raise ValueError(msg)
+            if not isinstance(cluster, str):
+                self.shards = list(cluster)
+                # Fail now rather than in every partition.
+                _ShardRouter(self.shards, sharding_key)
+        elif sharding_key is not None:
+            msg = "`sharding_key` requires `cluster` to be set"
+            raise ValueError(msg)
+        self.sharding_key = sharding_key
+
+        self.metadata_cache = (
+            _MetadataCache(metadata_cache_dir, metadata_cache_ttl.total_seconds())
+            if metadata_cache_dir is not None
+            else None
+        )
+        self.bootstrap_timeout = bootstrap_timeout
+        # The table is checked, or created, when the first partition
+        # is built; see `_bootstrap`.
+        self._bootstrap_lock = threading.Lock()
+        self._metadata: Optional[_TableMetadata] = None
+        self.plan: Optional[_ConversionPlan] = None
+        self.table_partition_rows = table_partition_rows
+        self.max_table_partitions = max_table_partitions
+        self.partition_keys: Optional[List[_KeyFunction]] = None
+
+    def _connect(self, host: str, port: int) -> Any:
+        return _acquire_client(
+            host,
+            port,
+            self.username,
+            self.password,
+            self.database,
+            self.max_connections,
+            self.keep_alive,
+            self.transport,
+        )
+
+    def _bootstrap(self, for_part: str) -> None:
+        """Check, or create, the table once per process.
+
+        Only the worker building partition "0" runs DDL; the builders
+        of other partitions wait for the table to exist. Metadata found
+        in the cache is used without any query.
+        """
+        with self._bootstrap_lock:
+            if self._metadata is not None:
+                return
+            metadata = self._cached_metadata()
+            if metadata is None and for_part == "0":
+                self._use_metadata(self._fetch_metadata(create=True))
+                return
+        # Wait without the lock, which the builder of partition "0"
+        # needs if it is a worker of this process.
+        if metadata is None:
+            metadata = self._fetch_metadata(create=False)
+        with self._bootstrap_lock:
+            if self._metadata is None:
+                self._use_metadata(metadata)
+
+    def _cache_key(self) -> Tuple[Any, ...]:
+        return (self.host, self.port, self.database, self.table_name, self.cluster)
+
+    def _cached_metadata(self) -> Optional[_TableMetadata]:
+        if self.metadata_cache is None:
+            return None
+        return self.metadata_cache.load(self._cache_key())
+
+    def _fetch_metadata(self, create: bool) -> _TableMetadata:
+        shards = self.shards
+        if isinstance(self.cluster, str):
+            client = self._connect(self.host, self.port)
+            try:
+                # `system.clusters` lists native ports.
+                shard_port = self.port if self.transport == "http" else None
+                shards = _cluster_shards(client, self.cluster, shard_port)
+            finally:
+                _release_client(client)
+            _ShardRouter(shards, self.sharding_key)
+
+        targets = (
+            [(shard.host, shard.port or self.port) for shard in shards]
+            if shards
+            else [(self.host, self.port)]
+        )
+        engine = partition_key = ""
+        columns: List[Tuple[str, str, str]] = []
+        for i, (target_host, target_port) in enumerate(targets):
+            client = self._connect(target_host, target_port)
+            try:
+                if create:
+                    self._prepare_table(client)
+                else:
+                    self._wait_for_table(client)
+                if i == 0:
+                    engine, partition_key, columns = self._describe_table(client)
+            finally:
+                _release_client(client)
+
+        metadata = _TableMetadata(engine, columns, shards, partition_key)
+        if self.metadata_cache is not None:
+            self.metadata_cache.store(self._cache_key(), metadata)
+        return metadata
+
+    def _use_metadata(self, metadata: _TableMetadata) -> None:
+        engine_name = self.table_spec.engine_name
+        if engine_name not in metadata.engine:
+            logger.warning(
+                f"""Table '{self.table_name}' is not using {engine_name}.
+                Consider modifying the table to avoid performance degredation
+                and/or duplicates on restart"""
+            )
+        if self.pa_schema is not None:
+            self.plan = _compile_plan(self.pa_schema, metadata.columns)
+        if self.table_partition_rows is not None:
+            self.partition_keys = (
+                _partition_key_functions(metadata.partition_key, self.pa_schema)
+                if self.pa_schema is not None
+                else None
+            )
+            if self.partition_keys is None:
+                logger.info(
+                    f"Partition key {metadata.partition_key!r} of table "
+                    f"'{self.table_name}' is not computed by the sink; "
+                    "inserts are not grouped by partition"
+                )
+        self.shards = metadata.shards
+        self._metadata = metadata
+
+    def _prepare_table(self, client: Any) -> None:
+        """Create the table if it does not exist."""
+        # Check if the table exists
+        table_exists_query = f"EXISTS {self.database}.{self.table_name}"
+        table_exists = client.command(table_exists_query)
+        if not table_exists:
+            logger.info(
+                f"""Table '{self.table_name}' does not exist.
+                        Attempting to create with provided schema"""
+            )
+            if self.schema:
+                create_table_query = self.table_spec.create_query(
+                    self.database, self.table_name, self.schema
+                )
+                logger.debug(f"Creating table with:\n{create_table_query}")
+                client.command(create_table_query)
+                logger.info(f"Table '{self.table_name}' created successfully.")
+            else:
+                msg = """Bad Schema. Can't complete execution without schema of format
+                        column1 UInt32,
+                        column2 String,
+                        column3 Date"""
+                raise ValueError(msg)
+        else:
+            logger.info(f"Table '{self.table_name}' exists.")
+
+    def _wait_for_table(self, client: Any) -> None:
+        """Wait for the builder of partition "0" to create the table."""
+        table_exists_query = f"EXISTS {self.database}.{self.table_name}"
+        deadline = time.monotonic() + self.bootstrap_timeout.total_seconds()
+        while not client.command(table_exists_query):
+            if time.monotonic() > deadline:
+                msg = (
+                    f"table '{self.table_name}' was not created within "
+                    f"{self.bootstrap_timeout}; it is created by the worker "
+                    "of partition 0"
+                )
+                raise TimeoutError(msg)
+            time.sleep(0.5)
+
+    def _describe_table(
+        self, client: Any
+    ) -> Tuple[str, str, List[Tuple[str, str, str]]]:
+        """The engine, partition key and columns of the table."""
+        # Check the MergeTree type
+        mergetree_type_query = f"""SELECT engine, partition_key FROM system.tables
+                WHERE database = '{self.database}' AND name = '{self.table_name}'"""
+        mergetree_type, partition_key = client.query(mergetree_type_query).result_rows[
+            0
+        ]
+        logger.info(
+            f"MergeTree type of the table '{self.table_name}': {mergetree_type}"
+        )
+        logger.info(
+            f"Partition key of the table '{self.table_name}': {partition_key!r}"
+        )
+
+        # Get the table schema
+        columns_query = f"""
+        SELECT name, type, default_kind FROM system.columns
+        WHERE database = '{self.database}' AND table = '{self.table_name}'
+        """
+        columns = [
+            (name, ch_type, default_kind)
+            for name, ch_type, default_kind in client.query(columns_query).result_rows
+        ]
+        logger.info(f"Schema of the table '{self.table_name}':")
+        for column in columns:
+            logger.info(f"Column: {column[0]}, Type: {column[1]}")
+        return str(mergetree_type), str(partition_key), columns
+
+    @override
+    def list_parts(self) -> List[str]:
+        return [str(i) for i in range(self.parts)]
+
+    @override
+    def part_fn(self, item_key: str) -> int:
+        if item_key.isdigit():
+            return int(item_key)
+        return adler32(item_key.encode())
+
+    @override
+    def build_part(
+        self, step_id: str, for_part: str, resume_state: Optional[_PartitionState]
+    ) -> _ClickHousePartition:
+        """Build a sink partition for writing to ClickHouse.
+
+        This method constructs an instance of `_ClickHousePartition`, which will
+        handle the actual data writing to the ClickHouse table for the given
+        partition in a distributed Bytewax dataflow.
+
+        Args:
+            step_id (str): The ID of the step in the Bytewax dataflow.
+            for_part (str): The partition to build.
+            resume_state (Optional[_PartitionState]): Number of the next
+                deduplication block of this partition and its spill files
+                not yet inserted, or None when starting fresh.
+
+        Returns:
+            _ClickHousePartition: An instance of `_ClickHousePartition` that will manage
+            the data writing for this partition.
+        """
+        self._bootstrap(for_part)
+        return _ClickHousePartition(
+            self.table_name,
+            self.host,
+            self.port,
+            self.username,
+            self.password,
+            self.database,
+            max_in_flight=self.max_in_flight,
+            max_queued=self.max_queued,
+            step_id=step_id,
+            for_part=for_part,
+            batch_tuner=self.batch_tuner,
+            max_connections=self.max_connections,
+            keep_alive=self.keep_alive,
+            transport=self.transport,
+            compression=self.compression,
+            arrow_compression=self.arrow_compression,
+            compression_level=self.compression_level,
+            settings=self.insert_settings,
+            retry_policy=self.retry_policy,
+            dedup_block_rows=self.dedup_block_rows,
+            spill_dir=self.spill_dir,
+            spill_max_bytes=self.spill_max_bytes,
+            plan=self.plan,
+            shards=self.shards,
+            sharding_key=self.sharding_key,
+            partition_keys=self.partition_keys,
+            table_partition_rows=self.table_partition_rows,
+            max_table_partitions=self.max_table_partitions,
+            resume_state=resume_state,
+        )
+
+
+class _FanOutPartition(StatefulSinkPartition[Tuple[str, Table], _PartitionState]):
+    """Write the tables of several ClickHouse tables through one writer.
+
+    Every target table shares the writer's connections, background
+    senders and queue.
+    """
+
+    def __init__(
+        self,
+        writer: _ClickHousePartition,
+        plans: Mapping[str, Optional[_ConversionPlan]],
+    ):
+        self.writer = writer
+        self.plans = plans
+
+    @override
+    def write_batch(self, batch: List[Tuple[str, Table]]) -> None:
+        by_table: Dict[str, List[Table]] = {}
+        for table_name, arrow_table in batch:
+            by_table.setdefault(table_name, []).append(arrow_table)
+        for table_name, tables in by_table.items():
+            self.writer._write(tables, table_name, self.plans[table_name])
+
+    @override
+    def snapshot(self) -> _PartitionState:
+        return self.writer.snapshot()
+
+    @override
+    def close(self) -> None:
+        self.writer.close()
+
+
+class ClickHouseMultiSink(FixedPartitionedSink[Tuple[str, Table], _PartitionState]):
+    """A partitioned sink writing to several ClickHouse tables.
+
+    Items are `(key, (table name, table))` pairs. Each table named in
+    `tables` is checked, or created, like the table of a
+    `ClickHouseSink`, but every partition inserts into all of them
+    through a single writer: one queue, set of background senders and
+    pool of connections, however many tables there are.
+    """
+
+    def __init__(
+        self,
+        tables: Mapping[str, OutputTable],
+        username: str,
+        password: str,
+        host: str = "localhost",
+        port: int = 8123,
+        database: str = "default",
+        parts: int = 1,
+        max_in_flight: int = 1,
+        max_queued: int = 2,
+        batch_tuner: Optional[_BatchTuner] = None,
+        max_connections: int = 16,
+        keep_alive: int = 30,
+        transport: str = "http",
+        compression: Optional[str] = None,
+        arrow_compression: Optional[str] = None,
+        compression_level: Optional[int] = None,
+        async_insert: bool = False,
+        wait_for_async_insert: bool = True,
+        async_insert_max_data_size: Optional[int] = None,
+        async_insert_busy_timeout: Optional[timedelta] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        metadata_cache_dir: Optional[Union[str, Path]] = None,
+        metadata_cache_ttl: timedelta = timedelta(hours=1),
+        bootstrap_timeout: timedelta = timedelta(minutes=1),
+    ):
+        """Initialize the ClickHouseMultiSink.
+
+        The other arguments are as for `ClickHouseSink`, and apply to every
+        table.
+
+        Args:
+            tables (Mapping[str, OutputTable]): The tables to write, by name.
+            username (str): Username for authentication with the ClickHouse server.
+            password (str): Password for authentication with the ClickHouse server.
+            host (str, optional): Hostname of ClickHouse server. Default is "localhost".
+            port (int, optional): Port number of the ClickHouse server. Default is 8123.
+            database (str, optional): Name of the database of the tables.
+            parts (int, optional): Number of sink partitions.
+            max_in_flight (int, optional): Concurrent inserts per partition,
+                                    shared by all tables.
+            max_queued (int, optional): Batches of any table each partition
+                                    queues before blocking the worker.
+            batch_tuner (optional): Used by `chop.output_tables`.
+            max_connections (int, optional): Size of the connection pool.
+            keep_alive (int, optional): Seconds before keep-alive probes.
+            transport (str, optional): "http" or "native".
+            compression (Optional[str], optional): Compression on the wire.
+            arrow_compression (Optional[str], optional): Compression of the
+                                    Arrow buffers.
+            compression_level (Optional[int], optional): Level of both.
+            async_insert (bool, optional): Use server-side async inserts.
+            wait_for_async_insert (bool, optional): Wait for async inserts.
+            async_insert_max_data_size (Optional[int], optional): Async
+                                    insert buffer size.
+            async_insert_busy_timeout (Optional[timedelta], optional): Async
+                                    insert flush interval.
+            retry_policy (Optional[RetryPolicy], optional): How inserts are
+                                    retried.
+            metadata_cache_dir (Optional[Union[str, Path]], optional): Where
+                                    to cache the metadata of the tables.
+            metadata_cache_ttl (timedelta, optional): How long cached
+                                    metadata is used.
+            bootstrap_timeout (timedelta, optional): How long workers wait
+                                    for the tables to be created.
+
+        Raises:
+            ValueError: If `tables` is empty, or for any reason a
+            `ClickHouseSink` of one of the tables would raise it.
+        """
+        if not tables:
+            msg = "`tables` must name at least one table"
+            raise ValueError(msg)
+        self.sinks = {
+            table_name: ClickHouseSink(
+                table_name,
+                table.ch_schema,
+                username,
+                password,
+                host,
+                port,
+                database,
+                parts=parts,
+                max_in_flight=max_in_flight,
+                max_queued=max_queued,
+                batch_tuner=batch_tuner,
+                max_connections=max_connections,
+                keep_alive=keep_alive,
+                transport=transport,
+                compression=compression,
+                arrow_compression=arrow_compression,
+                compression_level=compression_level,
+                async_insert=async_insert,
+                wait_for_async_insert=wait_for_async_insert,
+                async_insert_max_data_size=async_insert_max_data_size,
+                async_insert_busy_timeout=async_insert_busy_timeout,
+                retry_policy=retry_policy,
+                pa_schema=table.pa_schema,
+                table_spec=table.table_spec,
+                column_hints=table.column_hints,
+                metadata_cache_dir=metadata_cache_dir,
+                metadata_cache_ttl=metadata_cache_ttl,
+                bootstrap_timeout=bootstrap_timeout,
+            )
+            for table_name, table in tables.items()
+        }
+        self.parts = parts
+
+    @override
+    def list_parts(self) -> List[str]:
+        return [str(i) for i in range(self.parts)]
+
+    @override
+    def part_fn(self, item_key: str) -> int:
+        if item_key.isdigit():
+            return int(item_key)
+        return adler32(item_key.encode())
+
+    @override
+    def build_part(
+        self, step_id: str, for_part: str, resume_state: Optional[_PartitionState]
+    ) -> _FanOutPartition:
+        # Any table's sink builds the shared writer; they only differ
+        # in their table and plan, which are passed with each write.
+        for sink in self.sinks.values():
+            sink._bootstrap(for_part)
+        writer = next(iter(self.sinks.values())).build_part(
+            step_id, for_part, resume_state
+        )
+        writer.table_names = [sink.table_name for sink in self.sinks.values()]
+        plans = {table_name: sink.plan for table_name, sink in self.sinks.items()}
+        return _FanOutPartition(writer, plans)
+
+
+# Index and count of the worker running on each thread, recorded by
+# `_WorkerIndexSink` while the dataflow is built.
+_worker_indexes: Dict[int, Tuple[int, int]] = {}
+
+
+def _worker_part() -> str:
+    """Name of the worker-local sink partition of the calling worker."""
+    try:
+        worker_index, _worker_count = _worker_indexes[threading.get_ident()]
+    except KeyError:
+        msg = "worker index unknown; `_WorkerIndexSink` must be built first"
+        raise RuntimeError(msg) from None
+    return str(worker_index)
+
+
+class _NoWrites(StatelessSinkPartition[Any]):
+    @override
+    def write_batch(self, items: List[Any]) -> None:
+        pass
+
+
+class _WorkerIndexSink(DynamicSink[Any]):
+    """Record which worker runs on each thread; writes nothing.
+
+    Bytewax builds steps in dataflow order on each worker's thread, so
+    a `_WorkerSink` after this step, and any step on its way, can name
+    the partition of their worker.
+    """
+
+    @override
+    def build(self, step_id: str, worker_index: int, worker_count: int) -> _NoWrites:
+        _worker_indexes[threading.get_ident()] = (worker_index, worker_count)
+        return _NoWrites()
+
+
+class _WorkerSink(FixedPartitionedSink[Any, _PartitionState]):
+    """Insert each worker's items through a partition of its own.
+
+    Every worker lists only its own partition, named after its index,
+    so it is the one to build it, and items keyed by `_worker_part`
+    are inserted by the worker that produced them rather than sent to
+    the worker of a fixed partition. Inserts are thus spread over
+    workers as the keys upstream are, while partitions are snapshotted
+    at the end of each epoch like those of the partitioned sink.
+
+    A worker count change moves rows between partitions on resume, so
+    rows held in deduplication blocks or a spill directory can't be
+    kept in these partitions' snapshots.
+    """
+
+    def __init__(self, sink: Union["ClickHouseSink", "ClickHouseMultiSink"]):
+        if isinstance(sink, ClickHouseSink) and (
+            sink.dedup_block_rows is not None or sink.spill_dir is not None
+        ):
+            msg = "deduplication and `spill_dir` require a partitioned sink"
+            raise ValueError(msg)
+        self.sink = sink
+        self.order: Dict[str, int] = {}
+
+    @override
+    def list_parts(self) -> List[str]:
+        _worker_index, worker_count = _worker_indexes[threading.get_ident()]
+        # Partitions are picked by position in the sorted global list,
+        # where "10" comes before "2".
+        names = sorted(str(i) for i in range(worker_count))
+        self.order = {name: i for i, name in enumerate(names)}
+        return [_worker_part()]
+
+    @override
+    def part_fn(self, item_key: str) -> int:
+        return self.order[item_key]
+
+    @override
+    def build_part(
+        self, step_id: str, for_part: str, resume_state: Optional[_PartitionState]
+    ) -> StatefulSinkPartition[Any, _PartitionState]:
+        # The worker of partition 0 creates the table, as for the
+        # partitioned sink.
+        return self.sink.build_part(step_id, for_part, resume_state)
+
+
+class _DynamicPartition(StatelessSinkPartition[Table]):
+    def __init__(self, part: _ClickHousePartition):
+        self.part = part
+
+    @override
+    def write_batch(self, items: List[Table]) -> None:
+        self.part.write_batch(items)
+        # Dynamic sinks take no snapshots and the epoch may close as
+        # soon as this returns, so nothing may be left to insert.
+        self.part.snapshot()
+
+    @override
+    def close(self) -> None:
+        self.part.close()
+
+
+class ClickHouseDynamicSink(DynamicSink[Table]):
+    """A dynamic sink writing a stream of tables without keys to ClickHouse.
+
+    `ClickHouseSink` used to be a dynamic sink taking plain tables; it
+    is now partitioned and takes `(key, table)` pairs. This keeps the
+    old behavior for `op.output` steps written for it: every worker
+    inserts the tables it receives through connections of its own,
+    waiting for each write's inserts before it returns, since dynamic
+    sinks are never snapshotted.
+
+    Takes the arguments of `ClickHouseSink`, apart from
+    `dedup_block_rows` and `spill_dir`, which hold rows in snapshots.
+    Prefer `chop.output`, which also overlaps inserts with batching.
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        self.sink = ClickHouseSink(*args, **kwargs)
+        if self.sink.dedup_block_rows is not None or self.sink.spill_dir is not None:
+            msg = "deduplication and `spill_dir` require a partitioned sink"
+            raise ValueError(msg)
+
+    @override
+    def build(
+        self, step_id: str, worker_index: int, worker_count: int
+    ) -> _DynamicPartition:
+        # The worker of partition 0 creates the table, as for the
+        # partitioned sink.
+        return _DynamicPartition(self.sink.build_part(step_id, str(worker_index), None))
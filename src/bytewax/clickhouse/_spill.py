@@ -0,0 +1,189 @@
+"""Disk-backed insert queue for the ClickHouse sink.
+
+Lets a sink partition hand batches off to local disk instead of
+waiting for ClickHouse, so a slow or briefly unavailable server does
+not stall the dataflow or grow memory upstream.
+"""
+
+import os
+import threading
+from collections import deque
+from pathlib import Path
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+
+import pyarrow as pa  # type: ignore
+
+_TOKEN_KEY = b"bytewax.clickhouse.insert_deduplication_token"
+_SUFFIX = ".arrow"
+
+
+class _SpillBuffer:
+    """A FIFO of tables stored as Arrow IPC files in a directory.
+
+    Implements the parts of `queue.Queue` that `_InsertPipeline` uses,
+    so it can stand in for the in-memory queue. Each table put in is
+    written to its own file, numbered in order, and read back
+    memory-mapped by `get`. While inserts keep up, files are read back
+    from the OS page cache; when they fall behind, the OS writes them
+    out instead of the worker holding them in memory.
+
+    `put` blocks while the files total at least `max_bytes`, until
+    `fail` is called.
+
+    Files are deleted once `ack`ed after a successful insert.
+    `position` is the range of sequence numbers that may not have been
+    inserted yet; passing it back in after a restart re-queues those
+    files and deletes any others.
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        max_bytes: int,
+        position: Optional[Tuple[int, int]] = None,
+    ):
+        directory.mkdir(parents=True, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.unfinished_tasks = 0
+        self._cond = threading.Condition()
+        self._pending: Deque[int] = deque()
+        self._in_flight: Set[int] = set()
+        self._control: Deque[Any] = deque()
+        self._sizes: Dict[int, int] = {}
+        self._unsynced: List[Path] = []
+        self._failed = False
+
+        first, self._next_seq = position if position is not None else (0, 0)
+        for path in directory.glob("*.tmp"):
+            path.unlink()
+        for path in sorted(directory.glob(f"*{_SUFFIX}")):
+            seq = int(path.stem)
+            if first <= seq < self._next_seq:
+                self._pending.append(seq)
+                self._sizes[seq] = path.stat().st_size
+                self.bytes += self._sizes[seq]
+                self.unfinished_tasks += 1
+            else:
+                # Inserted, or written after the snapshot we resume
+                # from and so about to be replayed from upstream.
+                path.unlink()
+
+    def _path(self, seq: int) -> Path:
+        return self.directory / f"{seq:020d}{_SUFFIX}"
+
+    def put(self, item: Any) -> None:
+        """Append a `(table, token)` item, blocking while over the cap.
+
+        Anything else, such as a stop marker, is kept in memory and
+        returned by `get` once no files are left.
+        """
+        if not isinstance(item, tuple):
+            with self._cond:
+                self._control.append(item)
+                self.unfinished_tasks += 1
+                self._cond.notify_all()
+            return
+
+        table, token = item
+        if any(pa.types.is_dictionary(field.type) for field in table.schema):
+            # IPC files cannot replace a dictionary between batches.
+            table = table.unify_dictionaries()
+        with self._cond:
+            while self.bytes >= self.max_bytes and self._sizes and not self._failed:
+                self._cond.wait()
+            seq = self._next_seq
+            self._next_seq += 1
+
+        if token is not None:
+            metadata = dict(table.schema.metadata or {})
+            metadata[_TOKEN_KEY] = token.encode()
+            table = table.replace_schema_metadata(metadata)
+        path = self._path(seq)
+        tmp = path.with_suffix(".tmp")
+        with pa.OSFile(str(tmp), "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp, path)
+        size = path.stat().st_size
+
+        with self._cond:
+            self._pending.append(seq)
+            self._sizes[seq] = size
+            self._unsynced.append(path)
+            self.bytes += size
+            self.unfinished_tasks += 1
+            self._cond.notify_all()
+
+    def get(self) -> Any:
+        """Take the oldest `(table, token, seq)`, blocking until one is put."""
+        with self._cond:
+            while not self._pending and not self._control:
+                self._cond.wait()
+            if not self._pending:
+                return self._control.popleft()
+            seq = self._pending.popleft()
+            self._in_flight.add(seq)
+
+        # The table keeps the mapping open; it stays valid after the
+        # file is unlinked.
+        table = pa.ipc.open_file(pa.memory_map(str(self._path(seq)))).read_all()
+        metadata = dict(table.schema.metadata or {})
+        token = metadata.pop(_TOKEN_KEY, None)
+        table = table.replace_schema_metadata(metadata or None)
+        return (table, token.decode() if token is not None else None, seq)
+
+    def ack(self, seq: int) -> None:
+        """Delete a file whose table has been inserted."""
+        self._path(seq).unlink(missing_ok=True)
+        with self._cond:
+            self._in_flight.discard(seq)
+            self.bytes -= self._sizes.pop(seq)
+            self._cond.notify_all()
+
+    def fail(self) -> None:
+        """Stop blocking `put`, since an insert failed and files will not drain."""
+        with self._cond:
+            self._failed = True
+            self._cond.notify_all()
+
+    def task_done(self) -> None:
+        with self._cond:
+            self.unfinished_tasks -= 1
+            if self.unfinished_tasks == 0:
+                self._cond.notify_all()
+
+    def join(self) -> None:
+        """Block until every item put has been processed."""
+        with self._cond:
+            while self.unfinished_tasks > 0:
+                self._cond.wait()
+
+    def sync(self) -> None:
+        """Flush files written since the last sync to disk."""
+        with self._cond:
+            paths, self._unsynced = self._unsynced, []
+        for path in paths:
+            try:
+                fd = os.open(path, os.O_RDONLY)
+            except FileNotFoundError:
+                # Already inserted and deleted.
+                continue
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        if paths and os.name == "posix":
+            fd = os.open(self.directory, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def position(self) -> Tuple[int, int]:
+        """Range of sequence numbers that have not been acked."""
+        with self._cond:
+            unacked = self._in_flight.union(self._pending)
+            first = min(unacked) if unacked else self._next_seq
+            return (first, self._next_seq)
@@ -0,0 +1,361 @@
+"""Background insert machinery for the ClickHouse sink."""
+
+import logging
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass
+from datetime import timedelta
+from queue import Queue
+from typing import Any, Callable, List, Optional, TypeVar
+
+from pyarrow import Table  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+_STOP = object()
+
+# ClickHouse error codes that describe a temporary condition on the
+# server or network rather than a problem with the data or query.
+RETRYABLE_CODES = frozenset(
+    {
+        3,  # UNEXPECTED_END_OF_FILE
+        159,  # TIMEOUT_EXCEEDED
+        202,  # TOO_MANY_SIMULTANEOUS_QUERIES
+        209,  # SOCKET_TIMEOUT
+        210,  # NETWORK_ERROR
+        236,  # ABORTED
+        241,  # MEMORY_LIMIT_EXCEEDED
+        242,  # TABLE_IS_READ_ONLY
+        252,  # TOO_MANY_PARTS
+        285,  # TOO_FEW_LIVE_REPLICAS
+        319,  # UNKNOWN_STATUS_OF_INSERT
+        425,  # SYSTEM_ERROR
+        439,  # CANNOT_SCHEDULE_TASK
+        999,  # KEEPER_EXCEPTION
+    }
+)
+
+
+def _error_code(ex: BaseException) -> Optional[int]:
+    code = getattr(ex, "code", None)
+    if isinstance(code, int):
+        return code
+    match = re.search(r"Code: (\d+)", str(ex))
+    return int(match.group(1)) if match else None
+
+
+def _is_retryable(ex: BaseException) -> bool:
+    """Whether an insert that raised `ex` may succeed if sent again."""
+    code = _error_code(ex)
+    if code is not None:
+        return code in RETRYABLE_CODES
+    status = re.search(r"response code (\d+)", str(ex))
+    if status is not None:
+        return int(status.group(1)) >= 500
+    # Connection resets, refused connections and timeouts.
+    from clickhouse_connect.driver.exceptions import (  # noqa: PLC0415
+        OperationalError,
+    )
+
+    return isinstance(ex, (OperationalError, ConnectionError, TimeoutError))
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """How the sink retries inserts that fail with a transient error.
+
+    Errors are classified by their ClickHouse error code: throttling
+    such as `TOO_MANY_PARTS`, timeouts, network errors and 5xx
+    responses are retried, while errors about the data or query fail
+    the dataflow straight away.
+
+    A failing insert is retried up to `max_retries` times with
+    exponential backoff and full jitter. Once `breaker_threshold`
+    attempts in a row have failed, the circuit opens: the server is
+    treated as down, every sender of the partition probes it only once
+    per `breaker_cooldown`, and batches are held (blocking upstream
+    once the queue is full) instead of failing. If the circuit stays
+    open longer than `max_outage`, the dataflow fails; `None` waits
+    forever.
+    """
+
+    max_retries: int = 5
+    initial_backoff: timedelta = timedelta(milliseconds=100)
+    max_backoff: timedelta = timedelta(seconds=10)
+    breaker_threshold: int = 5
+    breaker_cooldown: timedelta = timedelta(seconds=30)
+    max_outage: Optional[timedelta] = timedelta(minutes=10)
+
+
+class _Retrier:
+    """Apply a `RetryPolicy` with a circuit breaker shared by threads.
+
+    `on_retry` is called with the error before each retry.
+    """
+
+    def __init__(
+        self,
+        policy: RetryPolicy,
+        name: str,
+        on_retry: Optional[Callable[[BaseException], None]] = None,
+    ):
+        self.policy = policy
+        self.name = name
+        self.on_retry = on_retry
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._outage_start: Optional[float] = None
+
+    @property
+    def is_open(self) -> bool:
+        return self._opened_at is not None
+
+    def _wait_if_open(self) -> None:
+        with self._lock:
+            opened_at = self._opened_at
+        if opened_at is not None:
+            cooldown = self.policy.breaker_cooldown.total_seconds()
+            remaining = opened_at + cooldown - time.monotonic()
+            if remaining > 0:
+                time.sleep(remaining)
+
+    def _record_success(self) -> None:
+        with self._lock:
+            if self._outage_start is not None:
+                logger.info("Circuit for '%s' closed; inserts resumed", self.name)
+            self._failures = 0
+            self._opened_at = None
+            self._outage_start = None
+
+    def _record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self.policy.breaker_threshold:
+                now = time.monotonic()
+                if self._outage_start is None:
+                    logger.warning(
+                        "Circuit for '%s' opened after %d failed inserts",
+                        self.name,
+                        self._failures,
+                    )
+                    self._outage_start = now
+                self._opened_at = now
+
+    def _outage_exceeded(self) -> bool:
+        max_outage = self.policy.max_outage
+        with self._lock:
+            outage_start = self._outage_start
+        return (
+            max_outage is not None
+            and outage_start is not None
+            and time.monotonic() - outage_start > max_outage.total_seconds()
+        )
+
+    def _backoff(self, attempt: int) -> float:
+        cap = min(
+            self.policy.max_backoff.total_seconds(),
+            self.policy.initial_backoff.total_seconds() * 2 ** (attempt - 1),
+        )
+        return random.uniform(0, cap)
+
+    def call(self, fn: Callable[[], T]) -> T:
+        """Call `fn`, retrying it according to the policy."""
+        attempt = 0
+        while True:
+            self._wait_if_open()
+            try:
+                result = fn()
+            except Exception as ex:
+                if not _is_retryable(ex):
+                    raise
+                self._record_failure()
+                if self._outage_exceeded():
+                    raise
+                if not self.is_open:
+                    attempt += 1
+                    if attempt > self.policy.max_retries:
+                        raise
+                    time.sleep(self._backoff(attempt))
+                logger.warning("Retrying insert for '%s' after: %s", self.name, ex)
+                if self.on_retry is not None:
+                    self.on_retry(ex)
+                continue
+            self._record_success()
+            return result
+
+
+class _BatchTuner:
+    """Adapt the flush point of batches to insert feedback.
+
+    One tuner is shared by the batching step of `chop.output` and the
+    sink partitions of the same process. Batches aim for `max_rows`
+    rows and, once the average Arrow row size is known, at most
+    `max_bytes` bytes.
+
+    While inserts take longer than `ceiling` the target is halved, down
+    to 1/16th, so rows still reach ClickHouse in time. It doubles back
+    when inserts are quick, or as soon as the table has a merge
+    backlog, since more and smaller parts would only add to it. How
+    long rows wait in a batch is not tuned here: the batching step
+    flushes every batch `ceiling` after its first row.
+    """
+
+    MIN_FACTOR = 1 / 16
+    ALPHA = 0.2
+    BACKLOG_PARTS = 100
+    POLL_INTERVAL = 30.0
+
+    def __init__(self, max_rows: int, max_bytes: Optional[int], ceiling: timedelta):
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.ceiling = ceiling.total_seconds()
+        self.factor = 1.0
+        self.row_bytes: Optional[float] = None
+        self.latency: Optional[float] = None
+        self.merge_backlog = False
+        self._polled_at = float("-inf")
+
+    @property
+    def target_rows(self) -> int:
+        """Number of rows at which a batch should be flushed."""
+        limit = self.max_rows
+        if self.max_bytes is not None and self.row_bytes:
+            limit = min(limit, int(self.max_bytes / self.row_bytes))
+        return max(1, int(limit * self.factor))
+
+    def _ewma(self, old: Optional[float], new: float) -> float:
+        return new if old is None else old + self.ALPHA * (new - old)
+
+    def record_table(self, table: Table) -> None:
+        """Update the average row size from a finished batch."""
+        if table.num_rows > 0:
+            self.row_bytes = self._ewma(self.row_bytes, table.nbytes / table.num_rows)
+
+    def record_insert(self, seconds: float) -> None:
+        """Update the flush point from the duration of an insert."""
+        self.latency = self._ewma(self.latency, seconds)
+        if self.merge_backlog or self.latency < self.ceiling / 4:
+            self.factor = min(1.0, self.factor * 2)
+        elif self.latency > self.ceiling:
+            self.factor = max(self.MIN_FACTOR, self.factor / 2)
+
+    def poll_due(self) -> bool:
+        """Whether the merge backlog should be checked again.
+
+        Claims the poll, so only one caller per interval gets `True`.
+        """
+        now = time.monotonic()
+        if now - self._polled_at < self.POLL_INTERVAL:
+            return False
+        self._polled_at = now
+        return True
+
+    def record_parts(self, max_active_parts: int) -> None:
+        """Record the most active parts in any partition of the tables."""
+        self.merge_backlog = max_active_parts >= self.BACKLOG_PARTS
+
+
+class _InsertPipeline:
+    """Run inserts on background threads fed by a bounded queue.
+
+    Each sender thread holds a client, so up to `max_in_flight`
+    inserts run concurrently while the worker thread keeps building
+    the next batches. `submit` blocks once `max_queued` tables are
+    waiting, which pushes backpressure upstream.
+
+    Once an insert has failed, the tables queued after it are dropped
+    and its error is re-raised on the worker thread by every later
+    call to `submit`, `check`, `flush` or `close`, so no snapshot can
+    be taken past the lost rows.
+
+    `queue` replaces the in-memory queue, e.g. with a `_SpillBuffer`;
+    `max_queued` is then unused.
+    """
+
+    def __init__(
+        self,
+        insert: Callable[..., None],
+        make_client: Callable[[], Any],
+        release_client: Callable[[Any], None],
+        max_in_flight: int,
+        max_queued: int,
+        name: str,
+        queue: Optional[Any] = None,
+    ):
+        self._insert = insert
+        self._release_client = release_client
+        self._queue: Any = queue if queue is not None else Queue(maxsize=max_queued)
+        self._error: Optional[BaseException] = None
+        self._clients: List[Any] = [make_client() for _ in range(max_in_flight)]
+        self._threads = [
+            threading.Thread(
+                target=self._run, args=(client,), name=f"{name}-{i}", daemon=True
+            )
+            for i, client in enumerate(self._clients)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def _run(self, client: Any) -> None:
+        while True:
+            item = self._queue.get()
+            try:
+                if item is _STOP:
+                    return
+                # Once an insert has failed, drop the rest; the error
+                # will fail the dataflow and they will be replayed.
+                if self._error is None:
+                    self._insert(client, *item)
+            except BaseException as ex:
+                self._error = ex
+            finally:
+                self._queue.task_done()
+
+    def _raise_error(self) -> None:
+        if self._error is not None:
+            msg = "background insert into ClickHouse failed"
+            raise RuntimeError(msg) from self._error
+
+    @property
+    def depth(self) -> int:
+        """Number of tables queued or being inserted."""
+        return self._queue.unfinished_tasks
+
+    def submit(self, table: Table, token: Optional[str] = None, *args: Any) -> None:
+        """Queue a table for insertion, blocking while the queue is full.
+
+        The table, token and any further `args` are passed on to
+        `insert` after the client.
+        """
+        self._raise_error()
+        self._queue.put((table, token, *args))
+
+    def check(self) -> None:
+        """Raise the error of a failed insert, without waiting."""
+        self._raise_error()
+
+    def flush(self) -> None:
+        """Block until every submitted table has been inserted."""
+        self._queue.join()
+        self._raise_error()
+
+    def close(self) -> None:
+        """Flush, then stop the sender threads and release their clients.
+
+        The threads are stopped and the clients released even if the
+        flush raises.
+        """
+        try:
+            self.flush()
+        finally:
+            for _ in self._threads:
+                self._queue.put(_STOP)
+            for thread in self._threads:
+                thread.join()
+            for client in self._clients:
+                self._release_client(client)
@@ -20,18 +20,270 @@ chop.output(
 ```
 """
 
-from datetime import timedelta
-from typing import List, Tuple
+import copy
+import itertools
+import time
+import zlib
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
 
 import bytewax.operators as op
 import pyarrow as pa  # type: ignore
-from bytewax.clickhouse import ClickHouseSink, V
+from bytewax.clickhouse import (
+    Aggregation,
+    ClickHouseMultiSink,
+    ClickHouseSink,
+    ClusterShard,
+    ColumnHint,
+    OutputTable,
+    RetryPolicy,
+    TableSpec,
+    V,
+    _metrics,
+)
+from bytewax.clickhouse._aggregate import _PreAggregator
+from bytewax.clickhouse._arrow import (
+    _as_table,
+    _ColumnarBuilder,
+    _DictionaryCache,
+    _field_getter,
+)
+from bytewax.clickhouse._sink import _worker_part, _WorkerIndexSink, _WorkerSink
+from bytewax.clickhouse._writer import _BatchTuner
 from bytewax.dataflow import Stream, operator
-from typing_extensions import TypeAlias
+from bytewax.operators import StatefulLogic
+from typing_extensions import TypeAlias, override
 
 KeyedStream: TypeAlias = Stream[Tuple[str, V]]
 """A {py:obj}`~bytewax.dataflow.Stream` of `(key, value)` 2-tuples."""
 
+_EMPTY: Tuple = tuple()
+
+
+@dataclass
+class _ColumnarCollectState:
+    rows: List[Any]
+    timeout_at: Optional[datetime] = None
+
+
+@dataclass
+class _ColumnarCollectLogic(StatefulLogic[V, pa.Table, _ColumnarCollectState]):
+    step_id: str
+    now_getter: Callable[[], datetime]
+    timeout: timedelta
+    tuner: _BatchTuner
+    builder: _ColumnarBuilder
+    state: _ColumnarCollectState
+
+    def _finish(self) -> pa.Table:
+        start = time.perf_counter()
+        table = self.builder.finish()
+        _metrics.CONVERSION_SECONDS.labels(self.step_id).observe(
+            time.perf_counter() - start
+        )
+        _metrics.BATCH_ROWS.labels(self.step_id).observe(table.num_rows)
+        self.tuner.record_table(table)
+        return table
+
+    @override
+    def on_item(self, value: V) -> Tuple[Iterable[pa.Table], bool]:
+        if isinstance(value, (pa.Table, pa.RecordBatch)):
+            # Already columnar; pass it through after any pending rows
+            # so ordering within the key is preserved.
+            table = _as_table(value, self.builder.pa_schema)
+            _metrics.BATCH_ROWS.labels(self.step_id).observe(table.num_rows)
+            if len(self.builder) > 0:
+                return ((self._finish(), table), StatefulLogic.DISCARD)
+            return ((table,), StatefulLogic.DISCARD)
+
+        # The timeout runs from the first row of the batch, so a
+        # steady trickle of rows can't hold it back.
+        if self.state.timeout_at is None:
+            self.state.timeout_at = self.now_getter() + self.timeout
+        self.builder.append(value)
+        if len(self.builder) >= self.tuner.target_rows:
+            return ((self._finish(),), StatefulLogic.DISCARD)
+
+        return (_EMPTY, StatefulLogic.RETAIN)
+
+    @override
+    def on_notify(self) -> Tuple[Iterable[pa.Table], bool]:
+        return ((self._finish(),), StatefulLogic.DISCARD)
+
+    @override
+    def on_eof(self) -> Tuple[Iterable[pa.Table], bool]:
+        return ((self._finish(),), StatefulLogic.DISCARD)
+
+    @override
+    def notify_at(self) -> Optional[datetime]:
+        return self.state.timeout_at
+
+    @override
+    def snapshot(self) -> _ColumnarCollectState:
+        return copy.deepcopy(self.state)
+
+
+@dataclass
+class _TablesCollectState:
+    rows: Dict[str, List[Any]]
+    timeout_at: Optional[datetime] = None
+
+
+@dataclass
+class _TablesCollectLogic(
+    StatefulLogic[Tuple[str, V], Tuple[str, pa.Table], _TablesCollectState]
+):
+    step_id: str
+    now_getter: Callable[[], datetime]
+    timeout: timedelta
+    tuner: _BatchTuner
+    tables: Mapping[str, OutputTable]
+    dictionaries: _DictionaryCache
+    state: _TablesCollectState
+    builders: Dict[str, _ColumnarBuilder] = field(default_factory=dict)
+
+    def _builder(self, table_name: str) -> _ColumnarBuilder:
+        builder = self.builders.get(table_name)
+        if builder is None:
+            try:
+                pa_schema = self.tables[table_name].pa_schema
+            except KeyError:
+                msg = (
+                    f"unknown table {table_name!r}; "
+                    f"`tables` has {sorted(self.tables)!r}"
+                )
+                raise ValueError(msg) from None
+            rows = self.state.rows.setdefault(table_name, [])
+            builder = _ColumnarBuilder(pa_schema, rows, self.dictionaries)
+            self.builders[table_name] = builder
+        return builder
+
+    def _finish(self, table_name: str) -> Tuple[str, pa.Table]:
+        start = time.perf_counter()
+        table = self._builder(table_name).finish()
+        _metrics.CONVERSION_SECONDS.labels(self.step_id).observe(
+            time.perf_counter() - start
+        )
+        _metrics.BATCH_ROWS.labels(self.step_id).observe(table.num_rows)
+        self.tuner.record_table(table)
+        return (table_name, table)
+
+    def _finish_all(self) -> List[Tuple[str, pa.Table]]:
+        return [
+            self._finish(table_name)
+            for table_name in self.state.rows
+            if len(self._builder(table_name)) > 0
+        ]
+
+    def _keep(self) -> bool:
+        if any(len(builder) > 0 for builder in self.builders.values()):
+            return StatefulLogic.RETAIN
+        return StatefulLogic.DISCARD
+
+    @override
+    def on_item(
+        self, value: Tuple[str, V]
+    ) -> Tuple[Iterable[Tuple[str, pa.Table]], bool]:
+        table_name, row = value
+        builder = self._builder(table_name)
+
+        if isinstance(row, (pa.Table, pa.RecordBatch)):
+            table = _as_table(row, builder.pa_schema)
+            _metrics.BATCH_ROWS.labels(self.step_id).observe(table.num_rows)
+            out = [self._finish(table_name)] if len(builder) > 0 else []
+            out.append((table_name, table))
+            return (out, self._keep())
+
+        if self.state.timeout_at is None:
+            self.state.timeout_at = self.now_getter() + self.timeout
+        builder.append(row)
+        if len(builder) >= self.tuner.target_rows:
+            return ((self._finish(table_name),), self._keep())
+
+        return (_EMPTY, StatefulLogic.RETAIN)
+
+    @override
+    def on_notify(self) -> Tuple[Iterable[Tuple[str, pa.Table]], bool]:
+        return (self._finish_all(), StatefulLogic.DISCARD)
+
+    @override
+    def on_eof(self) -> Tuple[Iterable[Tuple[str, pa.Table]], bool]:
+        return (self._finish_all(), StatefulLogic.DISCARD)
+
+    @override
+    def notify_at(self) -> Optional[datetime]:
+        return self.state.timeout_at
+
+    @override
+    def snapshot(self) -> _TablesCollectState:
+        return copy.deepcopy(self.state)
+
+
+@operator
+def _shard(
+    step_id: str,
+    up: KeyedStream[V],
+    shards: int,
+    pa_schema: pa.Schema,
+    shard_by: Optional[List[str]] = None,
+) -> KeyedStream[V]:
+    """Re-key records onto `shards` synthetic keys.
+
+    Records are hashed on the `shard_by` columns so rows with equal
+    values always land in the same shard, or spread round-robin when
+    no columns are given. Arrow tables and record batches are always
+    spread round-robin.
+
+    """
+    if shards < 1:
+        msg = f"`shards` must be at least 1; got {shards}"
+        raise ValueError(msg)
+
+    counter = itertools.count()
+    getter = _field_getter(pa_schema, shard_by) if shard_by else None
+
+    def shim_mapper(key__value: Tuple[str, V]) -> Tuple[str, V]:
+        _key, value = key__value
+        if getter is None or isinstance(value, (pa.Table, pa.RecordBatch)):
+            shard = next(counter) % shards
+        else:
+            # Python's `hash` is salted per process; this must agree
+            # across every worker process.
+            shard = zlib.crc32(repr(getter(value)).encode()) % shards
+        return (str(shard), value)
+
+    return op.map("map", up, shim_mapper)
+
+
+@operator
+def _to_worker(step_id: str, up: KeyedStream[V]) -> KeyedStream[V]:
+    """Re-key items onto the `_WorkerSink` partition of their worker.
+
+    Must come before the `_WorkerSink` output, so each worker's index
+    is known when that sink lists its partition.
+
+    """
+    op.output("index", op.filter("none", up, lambda _item: False), _WorkerIndexSink())
+
+    def shim_mapper(key__value: Tuple[str, V]) -> Tuple[str, V]:
+        _key, value = key__value
+        return (_worker_part(), value)
+
+    return op.map("map", up, shim_mapper)
+
 
 @operator
 def _to_sink(
@@ -40,23 +292,40 @@ def _to_sink(
     timeout: timedelta,
     max_size: int,
     pa_schema: pa.Schema,
-) -> KeyedStream[List[V]]:
-    """Convert records to PyArrow Table."""
-
-    def shim_mapper(key__batch: Tuple, pa_schema: pa.Schema) -> pa.Table:
-        key, batch = key__batch
-        columns = list(zip(*batch))
-        arrays = []
-        for i, f in enumerate(pa_schema):
-            array = pa.array(columns[i], f.type)
-            arrays.append(array)
-        t = pa.Table.from_arrays(arrays, schema=pa_schema)
-
-        return t
-
-    return op.collect("batch", up, timeout=timeout, max_size=max_size).then(
-        op.map, "map", lambda x: shim_mapper(x, pa_schema)
-    )
+    tuner: Optional[_BatchTuner] = None,
+) -> KeyedStream[pa.Table]:
+    """Collect records into batches and emit PyArrow Tables.
+
+    Records are buffered as they arrive and a batch is split into
+    columns in bulk when it is flushed, with one conversion per
+    column. The shape of the records is decided once per batch rather
+    than once per record.
+
+    Values that are already a `pa.Table` or `pa.RecordBatch` are
+    checked against `pa_schema` and passed through without conversion.
+
+    Fields of dictionary type are encoded as they are converted, each
+    against a dictionary kept by the worker across batches.
+
+    Batches are flushed at the row count chosen by `tuner`, or
+    `timeout` after their first record.
+
+    """
+    if tuner is None:
+        tuner = _BatchTuner(max_size, None, timeout)
+    dictionaries = _DictionaryCache()
+
+    def shim_builder(
+        resume_state: Optional[_ColumnarCollectState],
+    ) -> _ColumnarCollectLogic:
+        now_getter = lambda: datetime.now(timezone.utc)
+        state = resume_state if resume_state is not None else _ColumnarCollectState([])
+        builder = _ColumnarBuilder(pa_schema, state.rows, dictionaries)
+        return _ColumnarCollectLogic(
+            step_id, now_getter, timeout, tuner, builder, state
+        )
+
+    return op.stateful("batch", up, shim_builder)
 
 
 @operator
@@ -65,7 +334,7 @@ def output(
     up: KeyedStream[V],
     pa_schema: pa.Schema,
     table_name: str,
-    ch_schema: str,
+    ch_schema: Optional[str],
     username: str,
     password: str,
     host: str = "localhost",
@@ -73,13 +342,47 @@ def output(
     database: str = "default",
     order_by: str = "",
     timeout: timedelta = timedelta(seconds=1),
-    max_size: int = 50,
+    max_size: int = 100_000,
+    max_bytes: Optional[int] = None,
+    shards: Optional[int] = None,
+    shard_by: Optional[List[str]] = None,
+    max_in_flight: int = 1,
+    max_queued: int = 2,
+    max_connections: int = 16,
+    transport: str = "http",
+    compression: Optional[str] = None,
+    arrow_compression: Optional[str] = None,
+    compression_level: Optional[int] = None,
+    async_insert: bool = False,
+    wait_for_async_insert: bool = True,
+    async_insert_max_data_size: Optional[int] = None,
+    async_insert_busy_timeout: Optional[timedelta] = None,
+    retry_policy: Optional[RetryPolicy] = None,
+    deduplicate: bool = False,
+    spill_dir: Optional[Union[str, Path]] = None,
+    spill_max_bytes: int = 1 << 30,
+    table_spec: Optional[TableSpec] = None,
+    column_hints: Optional[Mapping[str, ColumnHint]] = None,
+    cluster: Optional[Union[str, Sequence[ClusterShard]]] = None,
+    sharding_key: Optional[List[str]] = None,
+    metadata_cache_dir: Optional[Union[str, Path]] = None,
+    metadata_cache_ttl: timedelta = timedelta(hours=1),
+    bootstrap_timeout: timedelta = timedelta(minutes=1),
+    table_partition_rows: Optional[int] = None,
+    max_table_partitions: int = 4,
 ) -> None:
     r"""Produce to ClickHouse as an output sink.
 
     Uses Arrow format, must be arrow serializiable.
 
-    Default partition routing is used.
+    Batches are built on the worker that owns each key. By default
+    each worker inserts the batches it built through a sink partition
+    of its own. Set `shards` to spread a stream with few distinct keys
+    across workers; batches are then written by one of `shards` sink
+    partitions. Either way inserts overlap with batching, and are
+    waited for at the end of each epoch. `deduplicate` and
+    `spill_dir` hold rows across epochs, so without `shards` they use
+    a single partition.
 
     Workers are the unit of parallelism.
 
@@ -89,14 +392,26 @@ def output(
     :arg step_id: Unique ID.
 
     :arg up: Stream of records. Key must be a `String`
-        and value must be serializable into an arrow table.
-
-    :arg pa_schema: Arrow schema.
+        and value must be serializable into an arrow table. Values
+        may be tuples or lists in schema order, or dicts,
+        dataclasses or NumPy structured records with fields named
+        after the schema. Values may also be a `pa.Table` or
+        `pa.RecordBatch` matching `pa_schema`, which are written
+        as-is without a round trip through Python objects.
+
+    :arg pa_schema: Arrow schema. Declare low-cardinality string
+        fields as `pa.dictionary(pa.int32(), pa.string())`, for
+        `LowCardinality(String)` columns: they are then
+        dictionary-encoded while batches are built, with
+        dictionaries each worker keeps across batches, and sent
+        encoded.
 
     :arg table_name: Table name for the writes.
 
     :arg ch_schema: schema string of format
                         ```column1 UInt32,\\n column2 String,\\n column3 Date```,
+        or `None` to derive the columns of the table from
+        `pa_schema` and `column_hints`.
 
     :arg username: database username, user must have
         correct permissions.
@@ -114,19 +429,439 @@ def output(
         the table for deduplication. Should be of format:
         `column1, column2`
 
-    :arg timeout: a timedelta of the amount of time to wait for
-        new data before writing. Defaults to 1 second.
+    :arg timeout: a timedelta of the longest time a record waits
+        in a batch before it is written, counted from the first
+        record of the batch. Also the latency ceiling for
+        inserts: while inserts take longer than this, batches are
+        made smaller. Defaults to 1 second.
+
+    :arg max_size: the number of items to wait for before writing.
+        Defaults to 100,000. Batches are this big unless inserts are
+        slower than `timeout`; a merge backlog on the table always
+        brings them back up to this size, as larger inserts create
+        fewer parts.
+
+    :arg max_bytes: optional Arrow size budget for a batch. Once
+        the average row size has been observed, batches are flushed
+        before they exceed this many bytes, e.g. `64 * 1024 * 1024`.
+
+    :arg shards: if set, replace the upstream keys with this many
+        synthetic keys so batching and inserts run in parallel on
+        several workers. Use at least the total number of workers.
+        Defaults to keeping the upstream keys.
+
+    :arg shard_by: columns to hash records on when `shards` is set,
+        e.g. the `PARTITION BY` or leading `ORDER BY` columns, so
+        related rows are inserted together. Defaults to spreading
+        records round-robin.
+
+    :arg max_in_flight: number of inserts each sink partition runs
+        concurrently on background threads, so the next batch is
+        built while the previous one is in flight. Queued inserts
+        are drained before every snapshot. Set to 0 to insert
+        synchronously. Defaults to 1.
+
+    :arg max_queued: number of batches each sink partition buffers
+        for its background threads before blocking upstream.
+        Defaults to 2.
+
+    :arg max_connections: size of the HTTP connection pool shared by
+        all ClickHouse sinks in the process that target the same
+        server, user and database. Defaults to 16.
+
+    :arg transport: `"http"` for the HTTP interface, or `"native"` to
+        insert Native blocks over the native TCP protocol; set `port`
+        to the native port, usually 9000. Requires the `native`
+        extra. Defaults to `"http"`.
+
+    :arg compression: `"lz4"` or `"zstd"` to compress insert payloads
+        on the wire. Defaults to no compression.
+
+    :arg arrow_compression: `"lz4"` or `"zstd"` to compress the
+        buffers of the Arrow payload sent over HTTP. Defaults to no
+        compression. Not supported with `transport="native"`.
+
+    :arg compression_level: codec level for both compressions.
+        Defaults to the codec's own default. The ratio achieved by
+        each insert is logged at `DEBUG` level. Not supported with
+        `transport="native"`, which uses the codec's default.
+
+    :arg async_insert: let ClickHouse buffer inserts server-side and
+        coalesce them into fewer parts. Pair with a small `timeout`
+        and `max_size` for low-latency flows with many workers.
+        Defaults to `False`.
+
+    :arg wait_for_async_insert: acknowledge async inserts only once
+        the server has flushed them. Set to `False` for
+        fire-and-forget inserts, which gives up at-least-once
+        delivery. Defaults to `True`.
+
+    :arg async_insert_max_data_size: bytes the server buffers before
+        flushing async inserts. Defaults to the server setting.
+
+    :arg async_insert_busy_timeout: longest time the server buffers
+        async inserts before flushing. Defaults to the server
+        setting.
+
+    :arg retry_policy: how inserts that fail with transient errors,
+        such as `TOO_MANY_PARTS` or connection resets, are retried
+        and when a circuit breaker holds batches back instead of
+        failing. Defaults to `RetryPolicy()`.
+
+    :arg deduplicate: insert blocks of `max_size` rows, or fewer at a
+        snapshot, each with an `insert_deduplication_token` made of a
+        block number kept in snapshots and a digest of the block's
+        rows, so ClickHouse drops blocks replayed after a resume at
+        insert time. Only blocks rebuilt with the same rows in the
+        same order are dropped, which needs each sink partition to be
+        fed by a single upstream worker replaying deterministic
+        input; otherwise replayed rows are inserted again, as without
+        deduplication, but never lost. The table must be Replicated
+        or set `non_replicated_deduplication_window`. Defaults to
+        `False`.
+
+    :arg spill_dir: local directory to queue batches through as
+        memory-mapped Arrow IPC files, drained in order by the
+        background senders. Snapshots record which files are not yet
+        inserted rather than waiting for ClickHouse, so a slow or
+        unavailable server does not stall the dataflow. Use a
+        directory that survives worker restarts. Defaults to queuing
+        in memory.
+
+    :arg spill_max_bytes: size of a partition's spill files at which
+        writing blocks until inserts catch up. Defaults to 1 GiB.
+
+    :arg table_spec: engine, `PARTITION BY`, `PRIMARY KEY`, sorting,
+        data-skipping indexes, column codecs, TTL and settings of the
+        table if it is created, as a
+        {py:obj}`~bytewax.clickhouse.TableSpec`. Replaces `order_by`.
+        Defaults to a `ReplacingMergeTree` sorted by `order_by`.
+
+    :arg column_hints: with `ch_schema=None`, a
+        {py:obj}`~bytewax.clickhouse.ColumnHint` by field name to
+        adjust the column derived from it, e.g.
+        `{"value": ColumnHint(gauge=True)}` to compress a float gauge
+        with `Gorilla`. Columns are otherwise derived from the Arrow
+        types alone: `pa.timestamp("us")` becomes `DateTime64(6)`
+        compressed with `Delta, ZSTD`, dictionary fields become
+        `LowCardinality(String)`, and nullable fields become
+        `Nullable`, except arrays and key columns. Hint
+        `ColumnHint(nullable=False)` to store nulls as the type's
+        default instead, with a warning.
+
+    :arg cluster: name of a cluster in `system.clusters` on `host`,
+        or a list of {py:obj}`~bytewax.clickhouse.ClusterShard`, to
+        insert straight into `table_name` as the local table on each
+        shard rather than through a `Distributed` table. Every sink
+        partition connects to every shard. Not supported with
+        `spill_dir`. Defaults to inserting into `host` only.
+
+    :arg sharding_key: columns hashed to pick the shard of each row
+        when `cluster` is set, split by shard weight like a
+        `Distributed` table, though not by its sharding expression.
+        Defaults to sending whole batches to the shards in turn.
+
+    :arg metadata_cache_dir: directory to cache the table's engine
+        and columns, and the shards of `cluster`, in once checked, so
+        restarts within `metadata_cache_ttl` make no metadata queries.
+        The table is checked when the dataflow is built, by one worker
+        per process, and created only by the worker of partition 0.
+        Defaults to no cache.
+
+    :arg metadata_cache_ttl: how long cached metadata is used.
+        Defaults to 1 hour.
+
+    :arg bootstrap_timeout: how long workers wait for the worker of
+        partition 0 to create the table. Defaults to 1 minute.
+
+    :arg table_partition_rows: group rows by the partition of the
+        table they go to, per its `PARTITION BY` key, and insert a
+        partition's rows once there are this many, or at the next
+        snapshot, so each insert makes few large parts. Supports keys
+        of columns of `pa_schema`, time buckets such as `toYYYYMM(ts)`
+        and `intDiv`; rows of tables partitioned otherwise are not
+        grouped. Not supported with `deduplicate`. Defaults to
+        inserting batches as they arrive.
+
+    :arg max_table_partitions: most table partitions in one insert
+        when grouping rows by partition. Defaults to 4.
+
+    """
+    if shards is not None:
+        up = _shard("shard", up, shards, pa_schema, shard_by)
+    elif shard_by is not None:
+        msg = "`shard_by` requires `shards` to be set"
+        raise ValueError(msg)
+
+    tuner = _BatchTuner(max_size, max_bytes, timeout)
+    sink = ClickHouseSink(
+        table_name,
+        ch_schema,
+        username,
+        password,
+        host,
+        port,
+        database,
+        order_by,
+        parts=shards if shards is not None else 1,
+        max_in_flight=max_in_flight,
+        max_queued=max_queued,
+        batch_tuner=tuner,
+        max_connections=max_connections,
+        transport=transport,
+        compression=compression,
+        arrow_compression=arrow_compression,
+        compression_level=compression_level,
+        async_insert=async_insert,
+        wait_for_async_insert=wait_for_async_insert,
+        async_insert_max_data_size=async_insert_max_data_size,
+        async_insert_busy_timeout=async_insert_busy_timeout,
+        retry_policy=retry_policy,
+        dedup_block_rows=max_size if deduplicate else None,
+        spill_dir=spill_dir,
+        spill_max_bytes=spill_max_bytes,
+        pa_schema=pa_schema,
+        table_spec=table_spec,
+        column_hints=column_hints,
+        cluster=cluster,
+        sharding_key=sharding_key,
+        metadata_cache_dir=metadata_cache_dir,
+        metadata_cache_ttl=metadata_cache_ttl,
+        bootstrap_timeout=bootstrap_timeout,
+        table_partition_rows=table_partition_rows,
+        max_table_partitions=max_table_partitions,
+    )
+    batches = _to_sink(
+        "to_sink",
+        up,
+        timeout=timeout,
+        max_size=max_size,
+        pa_schema=pa_schema,
+        tuner=tuner,
+    )
+    if shards is None and not deduplicate and spill_dir is None:
+        batches = _to_worker("to_worker", batches)
+        return op.output("kafka_output", batches, _WorkerSink(sink))
+    return op.output("kafka_output", batches, sink)
+
+
+@operator
+def aggregate(
+    step_id: str,
+    up: KeyedStream[V],
+    pa_schema: pa.Schema,
+    keys: List[str],
+    time_column: str,
+    bucket: timedelta,
+    aggregations: Mapping[str, Aggregation],
+    timeout: timedelta = timedelta(seconds=1),
+    max_size: int = 100_000,
+) -> KeyedStream[pa.Table]:
+    r"""Pre-aggregate records into one row per key and time bucket.
+
+    Records are collected into Arrow tables as in {py:obj}`output`, and
+    each table is reduced with Arrow's hash aggregation to one row per
+    value of the `keys` columns and bucket of `time_column`, so far
+    fewer rows are sent to ClickHouse. Pass the result to
+    {py:obj}`output` to insert it into a `SummingMergeTree`, or an
+    `AggregatingMergeTree` with `SimpleAggregateFunction` columns,
+    which merge the rows of separate batches on the server.
+
+    ```python
+    rollup = chop.aggregate(
+        "rollup",
+        metrics,
+        PA_SCHEMA,
+        keys=["metric"],
+        time_column="ts",
+        bucket=timedelta(minutes=1),
+        aggregations={
+            "value": Aggregation("sum", "value"),
+            "samples": Aggregation("count"),
+        },
+    )
+    ```
+
+    Each batch is reduced on its own, so a group may be emitted once
+    per batch; larger batches reduce more.
+
+    :arg step_id: Unique ID.
+
+    :arg up: Stream of records to aggregate, as for {py:obj}`output`.
+        Records may also be a `pa.Table` or `pa.RecordBatch`.
+
+    :arg pa_schema: Arrow schema of the records.
 
-    :arg batch_size: the number of items to wait before writing
-        defaults to 50.
+    :arg keys: columns to group by, besides the time bucket.
+
+    :arg time_column: timestamp or date column to bucket. It keeps its
+        type, floored to the start of each bucket. Buckets are aligned
+        to the Unix epoch in the column's time zone, like ClickHouse's
+        `toStartOfInterval`.
+
+    :arg bucket: width of the time buckets. Buckets of a date column
+        must be whole days.
+
+    :arg aggregations: the aggregated columns, by name. See
+        {py:obj}`~bytewax.clickhouse.Aggregation` for their types.
+
+    :arg timeout: a timedelta of the longest time a record waits
+        in a batch before it is aggregated, counted from the first
+        record of the batch. Defaults to 1 second.
+
+    :arg max_size: the number of records to aggregate at once.
+        Defaults to 100,000.
+
+    :returns: A stream of `pa.Table`s with the `keys` columns,
+        `time_column` and the `aggregations`, in that order.
+
+    """
+    aggregator = _PreAggregator(pa_schema, keys, time_column, bucket, aggregations)
+    tables = _to_sink(
+        "to_tables", up, timeout=timeout, max_size=max_size, pa_schema=pa_schema
+    )
+    return op.map_value("aggregate", tables, aggregator)
+
+
+@operator
+def _to_tables(
+    step_id: str,
+    up: KeyedStream[Tuple[str, V]],
+    timeout: timedelta,
+    tables: Mapping[str, OutputTable],
+    tuner: _BatchTuner,
+) -> KeyedStream[Tuple[str, pa.Table]]:
+    """Collect `(table name, record)` values into a table per name.
+
+    Like `_to_sink`, but every key keeps a buffer of records for
+    each table it has seen, flushed when that table reaches the row
+    count chosen by `tuner`. All of them are flushed `timeout` after
+    the first record buffered.
 
     """
-    return _to_sink(
-        "to_sink", up, timeout=timeout, max_size=max_size, pa_schema=pa_schema
-    ).then(
-        op.output,
-        "kafka_output",
-        ClickHouseSink(
-            table_name, ch_schema, username, password, host, port, database, order_by
-        ),
+    dictionaries = _DictionaryCache()
+
+    def shim_builder(
+        resume_state: Optional[_TablesCollectState],
+    ) -> _TablesCollectLogic:
+        now_getter = lambda: datetime.now(timezone.utc)
+        state = resume_state if resume_state is not None else _TablesCollectState({})
+        return _TablesCollectLogic(
+            step_id, now_getter, timeout, tuner, tables, dictionaries, state
+        )
+
+    return op.stateful("batch", up, shim_builder)
+
+
+@operator
+def output_tables(
+    step_id: str,
+    up: KeyedStream[Tuple[str, V]],
+    tables: Mapping[str, OutputTable],
+    username: str,
+    password: str,
+    host: str = "localhost",
+    port: int = 8123,
+    database: str = "default",
+    timeout: timedelta = timedelta(seconds=1),
+    max_size: int = 100_000,
+    max_bytes: Optional[int] = None,
+    shards: Optional[int] = None,
+    max_in_flight: int = 1,
+    max_queued: int = 2,
+    max_connections: int = 16,
+    transport: str = "http",
+    compression: Optional[str] = None,
+    arrow_compression: Optional[str] = None,
+    compression_level: Optional[int] = None,
+    async_insert: bool = False,
+    wait_for_async_insert: bool = True,
+    async_insert_max_data_size: Optional[int] = None,
+    async_insert_busy_timeout: Optional[timedelta] = None,
+    retry_policy: Optional[RetryPolicy] = None,
+    metadata_cache_dir: Optional[Union[str, Path]] = None,
+    metadata_cache_ttl: timedelta = timedelta(hours=1),
+    bootstrap_timeout: timedelta = timedelta(minutes=1),
+) -> None:
+    r"""Produce to several ClickHouse tables as one output sink.
+
+    Each value names the table it is written to, so one stream can
+    fan out to any number of tables with a constant number of steps.
+    Records are buffered per table, and every sink
+    partition inserts into all tables through one set of background
+    senders and connections.
+
+    :arg step_id: Unique ID.
+
+    :arg up: Stream of `(key, (table name, record))`. The table name
+        must be in `tables`, and the record must fit that table's
+        `pa_schema` as in {py:obj}`output`. Records may also be a
+        `pa.Table` or `pa.RecordBatch`.
+
+    :arg tables: the tables to write, by name, each a
+        {py:obj}`~bytewax.clickhouse.OutputTable` with its Arrow
+        schema and how to create it if it does not exist.
+
+    :arg username: database username, user must have
+        correct permissions.
+
+    :arg password:
+
+    :arg host: host name, defaults to "localhost".
+
+    :arg port: port name, defaults to 8123.
+
+    :arg database: optional database name. If omitted
+        this will use the default database.
+
+    :arg timeout: a timedelta of the longest time a record waits
+        before every table is written, counted from the first record
+        buffered. Defaults to 1 second.
+
+    :arg max_size: the number of rows of one table to wait for before
+        writing it. Defaults to 100,000.
+
+    Other arguments are as for {py:obj}`output`, and apply to all
+    tables.
+
+    """
+    if shards is not None:
+        up = _shard("shard", up, shards, pa.schema([]))
+
+    tuner = _BatchTuner(max_size, max_bytes, timeout)
+    sink = ClickHouseMultiSink(
+        tables,
+        username,
+        password,
+        host,
+        port,
+        database,
+        parts=shards if shards is not None else 1,
+        max_in_flight=max_in_flight,
+        max_queued=max_queued,
+        batch_tuner=tuner,
+        max_connections=max_connections,
+        transport=transport,
+        compression=compression,
+        arrow_compression=arrow_compression,
+        compression_level=compression_level,
+        async_insert=async_insert,
+        wait_for_async_insert=wait_for_async_insert,
+        async_insert_max_data_size=async_insert_max_data_size,
+        async_insert_busy_timeout=async_insert_busy_timeout,
+        retry_policy=retry_policy,
+        metadata_cache_dir=metadata_cache_dir,
+        metadata_cache_ttl=metadata_cache_ttl,
+        bootstrap_timeout=bootstrap_timeout,
+    )
+    batches = _to_tables(
+        "to_tables",
+        up,
+        timeout=timeout,
+        tables=tables,
+        tuner=tuner,
     )
+    if shards is None:
+        batches = _to_worker("to_worker", batches)
+        return op.output("kafka_output", batches, _WorkerSink(sink))
+    return op.output("kafka_output", batches, sink)